@@ -14,9 +14,11 @@
 
 import logging
 import base64
+import hashlib
 import os
 import redis
 import json
+import threading
 from datetime import datetime
 
 from flask import Flask, request
@@ -38,6 +40,55 @@ redis_client = redis.StrictRedis(
     retry=redis.retry.Retry(redis.backoff.ExponentialBackoff(cap=5, base=1), 5),
     retry_on_error=[redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, redis.exceptions.ResponseError])
 
+# Recent events of each conversation are kept in Redis, so that agent desktops joining a
+# conversation late can receive them from UI Connector. Set REPLAY_MAX_EVENTS to the number
+# of events to keep per conversation to enable it.
+REPLAY_MAX_EVENTS = int(os.environ.get('REPLAY_MAX_EVENTS', 0))
+# Events larger than this size in bytes are not kept.
+REPLAY_MAX_EVENT_BYTES = int(os.environ.get('REPLAY_MAX_EVENT_BYTES', 64 * 1024))
+# Seconds the recent events of a conversation are kept after its last event.
+REPLAY_TTL = int(os.environ.get('REPLAY_TTL', 3600))
+# Interim results are superseded quickly and final transcripts are also sent as
+# new message events, so recognition results are not kept.
+REPLAY_SKIPPED_DATA_TYPES = ['new-recognition-result-notification-event']
+
+# Dialogflow often sends the same suggestions again on consecutive turns. Set
+# SUGGESTION_DEDUP_WINDOW to the number of recent suggestion sets remembered per
+# conversation and suggestion type, so that repeats of them are not published.
+SUGGESTION_DEDUP_WINDOW = int(os.environ.get('SUGGESTION_DEDUP_WINDOW', 0))
+# Seconds the recent suggestion sets of a conversation are kept after its last suggestion.
+SUGGESTION_DEDUP_TTL = int(os.environ.get('SUGGESTION_DEDUP_TTL', 3600))
+# Fields that differ between copies of the same suggestions, left out of their digests.
+SUGGESTION_VOLATILE_FIELDS = ('answerRecord', 'latestMessage', 'contextSize')
+
+# Returns 1 if every digest ARGV[i + 1] is among the recent digests in the list KEYS[i],
+# refreshing the expiry of the lists, otherwise 0. Nothing is recorded, as the digests
+# of a suggestion set are only remembered once it has been published.
+# KEYS: lists of recent digests. ARGV: expiry in seconds, then a digest for each list.
+SUGGESTION_DIGEST_SCRIPT = """
+for index, key in ipairs(KEYS) do
+  local found = false
+  for _, digest in ipairs(redis.call('LRANGE', key, 0, -1)) do
+    if digest == ARGV[index + 1] then
+      found = true
+      break
+    end
+  end
+  if not found then
+    return 0
+  end
+end
+for _, key in ipairs(KEYS) do
+  redis.call('EXPIRE', key, ARGV[1])
+end
+return 1
+"""
+check_suggestion_digests = redis_client.register_script(SUGGESTION_DIGEST_SCRIPT)
+
+# Suggestions not published because they repeat recent ones, by suggestion type.
+suppressed_suggestions = {}
+suppressed_suggestions_lock = threading.Lock()
+
 
 def get_conversation_name_without_location(conversation_name):
     """Returns a conversation name without its location id."""
@@ -49,6 +100,86 @@ def get_conversation_name_without_location(conversation_name):
     return conversation_name_without_location
 
 
+def get_replay_key(conversation_name):
+    """Returns the Redis key of the recent events of a conversation."""
+    return 'replay:{}'.format(conversation_name)
+
+
+def record_replay_event(conversation_name, message):
+    """Appends an event to the bounded list of recent events of its conversation."""
+    if len(message.encode('utf-8')) > REPLAY_MAX_EVENT_BYTES:
+        logging.debug('Event is too large to be kept for replay: {}'.format(conversation_name))
+        return
+    replay_key = get_replay_key(conversation_name)
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.rpush(replay_key, message)
+    pipeline.ltrim(replay_key, -REPLAY_MAX_EVENTS, -1)
+    pipeline.expire(replay_key, REPLAY_TTL)
+    pipeline.execute()
+
+
+def get_suggestion_digest(suggestion):
+    """Returns a digest of the content of a suggestion, without its volatile fields."""
+    def strip(value):
+        if isinstance(value, dict):
+            return {key: strip(item) for key, item in value.items() if key not in SUGGESTION_VOLATILE_FIELDS}
+        if isinstance(value, list):
+            return [strip(item) for item in value]
+        return value
+    content = json.dumps(strip(suggestion), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_suggestion_digests(conversation_name, data_object):
+    """Returns the suggestion types of a HumanAgentAssistantEvent, with the Redis keys of
+    their recent digests and the digests of its suggestions, or an empty list if its
+    suggestions cannot be deduplicated.
+    """
+    suggestion_digests = []
+    for suggestion_result in data_object.get('suggestionResults') or []:
+        if not isinstance(suggestion_result, dict):
+            return []
+        for suggestion_type, suggestion in suggestion_result.items():
+            digest_key = 'suggestion-digests:{0}:{1}'.format(conversation_name, suggestion_type)
+            suggestion_digests.append((suggestion_type, digest_key, get_suggestion_digest(suggestion)))
+    return suggestion_digests
+
+
+def is_repeated_suggestion(suggestion_digests):
+    """Returns whether every suggestion of a HumanAgentAssistantEvent repeats one of the
+    recent suggestions of the same type in its conversation, and counts it if so.
+
+    Redis errors are logged and the suggestions treated as new, so that they are published.
+    """
+    try:
+        repeated = check_suggestion_digests(
+            keys=[digest_key for _, digest_key, _ in suggestion_digests],
+            args=[SUGGESTION_DEDUP_TTL] + [digest for _, _, digest in suggestion_digests])
+    except redis.exceptions.RedisError as e:
+        logging.warning('Failed to check repeated suggestions: {}'.format(e))
+        return False
+    if not repeated:
+        return False
+    with suppressed_suggestions_lock:
+        for suggestion_type, _, _ in suggestion_digests:
+            suppressed_suggestions[suggestion_type] = suppressed_suggestions.get(suggestion_type, 0) + 1
+    return True
+
+
+def record_suggestion_digests(suggestion_digests):
+    """Remembers the digests of published suggestions among the recent ones of their type."""
+    pipeline = redis_client.pipeline(transaction=False)
+    for _, digest_key, digest in suggestion_digests:
+        pipeline.lrem(digest_key, 0, digest)
+        pipeline.lpush(digest_key, digest)
+        pipeline.ltrim(digest_key, 0, SUGGESTION_DEDUP_WINDOW - 1)
+        pipeline.expire(digest_key, SUGGESTION_DEDUP_TTL)
+    try:
+        pipeline.execute()
+    except redis.exceptions.RedisError as e:
+        logging.warning('Failed to record published suggestions: {}'.format(e))
+
+
 def cloud_pubsub_handler(request, data_type):
     """Verifies and checks requests from Cloud Pub/Sub."""
     envelope = request.get_json()
@@ -91,7 +222,6 @@ def cloud_pubsub_handler(request, data_type):
         conversation_name = data_object['conversation']
         conversation_name = get_conversation_name_without_location(conversation_name)
         logging.debug('conversation_name: {0}, conversation_name_without_location: {1}'.format(data_object['conversation'], conversation_name))
-
         # Emits messages to redis pub/sub
         msg_data = {'conversation_name': conversation_name,
                     'data': data,
@@ -108,20 +238,47 @@ def cloud_pubsub_handler(request, data_type):
             msg_data['new_recognition_result_message_id'] = new_recognition_result_message_id
             logging.debug('participant role {0} message id {1} for new recognition result'.format(
                 participant_role, new_recognition_result_message_id))
-        if redis_client.exists(conversation_name) == 0:
+        message = json.dumps(msg_data)
+        subscribed = redis_client.exists(conversation_name) != 0
+        suggestion_digests = []
+        if SUGGESTION_DEDUP_WINDOW > 0 and data_type == 'human-agent-assistant-event':
+            suggestion_digests = get_suggestion_digests(conversation_name, data_object)
+        # Suggestions are only deduplicated against those published to a UI Connector,
+        # so that an agent joining the conversation later still receives them.
+        if subscribed and suggestion_digests and is_repeated_suggestion(suggestion_digests):
+            logging.info('Suppressed repeated suggestions (message_id: {0}, conversation_name: {1}).'.format(
+                pubsub_message['messageId'], conversation_name))
+            return True
+        if REPLAY_MAX_EVENTS > 0 and data_type not in REPLAY_SKIPPED_DATA_TYPES:
+            record_replay_event(conversation_name, message)
+        if not subscribed:
             logging.warning(
                 "No SERVER_ID (UI Connector instance) for conversation name {}. Please subscribe to the conversation by sending join-conversation event.".format(conversation_name))
             return True
         else:
             server_id = redis_client.get(conversation_name).decode('utf-8')
         channel = '{}:{}'.format(server_id, conversation_name)
-        redis_client.publish(channel, json.dumps(msg_data))
+        redis_client.publish(channel, message)
+        # Recorded once published, so that Cloud Pub/Sub redelivers the event if publishing fails.
+        if suggestion_digests:
+            record_suggestion_digests(suggestion_digests)
         logging.debug(
             'Redis publish (message_id: {0}, publish_time: {1}, conversation_name: {2}, channel: {3}, data_type: {4}.'.format(
                 pubsub_message['messageId'], pubsub_message['publishTime'], conversation_name, channel, data_type))
     return True
 
 
+@app.route('/metrics')
+def get_metrics():
+    """Reports the suppressed suggestions in the Prometheus text exposition format."""
+    lines = ['# HELP suggestions_suppressed_total Suggestions not published because they repeat recent ones.',
+             '# TYPE suggestions_suppressed_total counter']
+    with suppressed_suggestions_lock:
+        for suggestion_type, count in sorted(suppressed_suggestions.items()):
+            lines.append('suggestions_suppressed_total{{suggestion_type="{0}"}} {1}'.format(suggestion_type, count))
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/human-agent-assistant-event', methods=['POST'])
 def subscribe_suggestions():
     """Receives new human agent assist events from pre-configured dialogflow Pub/Sub topic."""
@@ -18,6 +18,8 @@ import base64
 from unittest.mock import Mock, patch
 import datetime
 
+import redis
+
 import main
 from main import app
 
@@ -45,6 +47,18 @@ SAMPLE_CLOUD_PUBSUB_MSG = {
         'messageId': '3502221325816966'
     }
 }
+SAMPLE_SUGGESTION_EVENT = {
+    'conversation': CONVERSATION_NAME,
+    'participant': CONVERSATION_NAME + '/participants/p1',
+    'suggestionResults': [{'suggestFaqAnswersResponse': {'faqAnswers': [{'answer': 'a'}]}}]
+}
+SAMPLE_SUGGESTION_PUBSUB_MSG = {
+    'message': dict(SAMPLE_CLOUD_PUBSUB_MSG['message'],
+                    data=base64.b64encode(json.dumps(SAMPLE_SUGGESTION_EVENT).encode('utf-8')).decode('ascii'))
+}
+SUGGESTION_DIGEST_KEY = 'suggestion-digests:projects/{0}/conversations/{1}:suggestFaqAnswersResponse'.format(
+    PROJECT_ID, CONVERSATION_ID)
+
 
 
 class TestInterceptorAPI(unittest.TestCase):
@@ -106,6 +120,102 @@ class TestInterceptorAPI(unittest.TestCase):
         # Ack messeages to avoid unnecessary retry.
         self.assertEqual(response.status_code, 204)
 
+    @patch('main.REPLAY_MAX_EVENTS', 20)
+    @patch('main.datetime')
+    @patch('main.redis_client.exists', return_value=0)
+    @patch('main.redis_client.pipeline')
+    @patch('main.redis_client.publish')
+    def test_record_replay_event(self, MockPublish, MockPipeline, MockExists, MockDateTime):
+        """Keeps recent events for replay, including those no server is subscribed to."""
+        MockDateTime.now = Mock(
+            return_value=datetime.datetime(2022, 3, 11, 0, 0, 10))
+        client = app.test_client()
+        response = client.post('/conversation-lifecycle-event',
+                               json=SAMPLE_CLOUD_PUBSUB_MSG)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(MockPublish.called)
+        replay_key = 'replay:projects/{0}/conversations/{1}'.format(PROJECT_ID, CONVERSATION_ID)
+        pipeline = MockPipeline.return_value
+        self.assertEqual(pipeline.rpush.call_args[0][0], replay_key)
+        self.assertEqual(json.loads(pipeline.rpush.call_args[0][1])['message_id'], '3502221325816966')
+        pipeline.ltrim.assert_called_once_with(replay_key, -20, -1)
+        pipeline.expire.assert_called_once_with(replay_key, main.REPLAY_TTL)
+        pipeline.execute.assert_called_once_with()
+
+    def test_suggestion_digest(self):
+        """Digests suggestions by content, regardless of their answer records."""
+        suggestion = {'faqAnswers': [{'question': 'q', 'answer': 'a', 'answerRecord': 'record_1'}],
+                      'latestMessage': 'message_1'}
+        repeated = {'latestMessage': 'message_2',
+                    'faqAnswers': [{'answer': 'a', 'question': 'q', 'answerRecord': 'record_2'}]}
+        changed = {'faqAnswers': [{'question': 'q', 'answer': 'b', 'answerRecord': 'record_1'}]}
+        self.assertEqual(main.get_suggestion_digest(suggestion), main.get_suggestion_digest(repeated))
+        self.assertNotEqual(main.get_suggestion_digest(suggestion), main.get_suggestion_digest(changed))
+
+    @patch('main.SUGGESTION_DEDUP_WINDOW', 3)
+    @patch('main.check_suggestion_digests', side_effect=[0, 1])
+    @patch('main.redis_client.exists', return_value=1)
+    @patch('main.redis_client.get', return_value=bytes(SERVER_ID, encoding='raw_unicode_escape'))
+    @patch('main.redis_client.pipeline')
+    @patch('main.redis_client.publish')
+    def test_suppress_repeated_suggestions(self, MockPublish, MockPipeline, MockGet, MockExists, MockCheckDigests):
+        """Publishes a suggestion set once while it repeats, and counts the repeats."""
+        client = app.test_client()
+        for _ in range(2):
+            response = client.post('/human-agent-assistant-event', json=SAMPLE_SUGGESTION_PUBSUB_MSG)
+            self.assertEqual(response.status_code, 204)
+        self.assertEqual(MockPublish.call_count, 1)
+        self.assertEqual(MockCheckDigests.call_args.kwargs['keys'], [SUGGESTION_DIGEST_KEY])
+        # Only the published suggestion set is remembered.
+        pipeline = MockPipeline.return_value
+        digest = pipeline.lpush.call_args[0][1]
+        pipeline.lpush.assert_called_once_with(SUGGESTION_DIGEST_KEY, digest)
+        pipeline.ltrim.assert_called_once_with(SUGGESTION_DIGEST_KEY, 0, 2)
+        pipeline.execute.assert_called_once_with()
+        self.assertEqual(MockCheckDigests.call_args.kwargs['args'], [main.SUGGESTION_DEDUP_TTL, digest])
+        self.assertIn('suggestions_suppressed_total{suggestion_type="suggestFaqAnswersResponse"} 1',
+                      client.get('/metrics').get_data(as_text=True))
+
+    @patch('main.SUGGESTION_DEDUP_WINDOW', 3)
+    @patch('main.check_suggestion_digests', return_value=0)
+    @patch('main.redis_client.exists', return_value=1)
+    @patch('main.redis_client.get', return_value=bytes(SERVER_ID, encoding='raw_unicode_escape'))
+    @patch('main.redis_client.pipeline')
+    @patch('main.redis_client.publish', side_effect=redis.exceptions.ConnectionError)
+    def test_suggestions_not_published(self, MockPublish, MockPipeline, MockGet, MockExists, MockCheckDigests):
+        """Does not remember suggestions that failed to publish, so that their redelivery is published."""
+        client = app.test_client()
+        response = client.post('/human-agent-assistant-event', json=SAMPLE_SUGGESTION_PUBSUB_MSG)
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(MockPipeline.called)
+
+    @patch('main.SUGGESTION_DEDUP_WINDOW', 3)
+    @patch('main.check_suggestion_digests', return_value=1)
+    @patch('main.redis_client.exists', return_value=0)
+    @patch('main.redis_client.pipeline')
+    @patch('main.redis_client.publish')
+    def test_suggestions_without_server(self, MockPublish, MockPipeline, MockExists, MockCheckDigests):
+        """Neither checks nor remembers suggestions while no server is subscribed to the conversation."""
+        client = app.test_client()
+        response = client.post('/human-agent-assistant-event', json=SAMPLE_SUGGESTION_PUBSUB_MSG)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(MockCheckDigests.called)
+        self.assertFalse(MockPublish.called)
+        self.assertFalse(MockPipeline.called)
+
+    @patch('main.SUGGESTION_DEDUP_WINDOW', 3)
+    @patch('main.check_suggestion_digests', side_effect=redis.exceptions.ConnectionError)
+    @patch('main.redis_client.exists', return_value=1)
+    @patch('main.redis_client.get', return_value=bytes(SERVER_ID, encoding='raw_unicode_escape'))
+    @patch('main.redis_client.pipeline')
+    @patch('main.redis_client.publish')
+    def test_suggestion_dedup_failure(self, MockPublish, MockPipeline, MockGet, MockExists, MockCheckDigests):
+        """Publishes suggestions when they cannot be checked against the recent ones."""
+        MockPipeline.return_value.execute.side_effect = redis.exceptions.ConnectionError
+        client = app.test_client()
+        response = client.post('/human-agent-assistant-event', json=SAMPLE_SUGGESTION_PUBSUB_MSG)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(MockPublish.call_count, 1)
 
 if __name__ == '__main__':
     unittest.main()
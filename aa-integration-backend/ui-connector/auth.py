@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import datetime
+import time
 import jwt
 import requests
 
@@ -20,16 +21,76 @@ from flask import request, jsonify
 from functools import wraps
 
 import config, auth_options
+import metrics
+from token_cache import TokenCache
 
 jwt_secret_key = ''  # To be loaded from config.JWT_SECRET_KEY_PATH
 
+# Verification results of tokens issued by identity providers and of app credentials.
+auth_cache = TokenCache('auth', config.AUTH_CACHE_MAXSIZE)
+app_auth_cache = TokenCache('app-auth', config.AUTH_CACHE_MAXSIZE)
+# JWTs verified by check_jwt, kept in memory only.
+jwt_cache = TokenCache('jwt', config.JWT_CACHE_MAXSIZE)
+auth_latency = metrics.register(metrics.Histogram(
+    'auth_check_seconds', 'Latency of checking tokens, cached or not.', labels=('check',)))
+
 
 def load_jwt_secret_key():
     with open(config.JWT_SECRET_KEY_PATH, 'r') as key_file:
         jwt_secret_key = key_file.read()
 
 
+def enable_redis_token_cache(redis_client):
+    """Shares verified tokens with the other instances through Redis."""
+    auth_cache.redis_client = redis_client
+    app_auth_cache.redis_client = redis_client
+
+
+def get_token_expiry(token):
+    """Returns the expiration time claimed by a JWT, or None for opaque tokens.
+
+    The claim is read without verifying the signature, so it can only shorten
+    how long a token verified by its identity provider is trusted.
+    """
+    try:
+        expiry = jwt.decode(token, options={'verify_signature': False}).get('exp')
+    except jwt.PyJWTError:
+        return None
+    if isinstance(expiry, bool) or not isinstance(expiry, (int, float)):
+        return None
+    return expiry
+
+
+def cached_check(cache, token, check, expires_at=None):
+    """Returns the cached verification result of a token, or runs check and caches it.
+
+    Args:
+        expires_at: optional expiration time of the token, as a POSIX timestamp.
+            A valid token is not trusted past it even if AUTH_CACHE_TTL allows.
+    """
+    if config.AUTH_CACHE_TTL <= 0:
+        return bool(check())
+    result = cache.get(token)
+    if result is not None:
+        return result
+    result = bool(check())
+    if result:
+        cache_expires_at = time.time() + config.AUTH_CACHE_TTL
+        if expires_at is not None:
+            cache_expires_at = min(cache_expires_at, expires_at)
+    else:
+        cache_expires_at = time.time() + config.AUTH_NEGATIVE_CACHE_TTL
+    cache.set(token, result, cache_expires_at)
+    return result
+
+
 def check_auth(token):
+    with auth_latency.time('check_auth'):
+        return cached_check(auth_cache, '{0}:{1}'.format(config.AUTH_OPTION, token),
+                            lambda: verify_auth(token), get_token_expiry(token))
+
+
+def verify_auth(token):
     if (config.AUTH_OPTION == 'SalesforceLWC'):
         return auth_options.check_salesforce_lwc_token(token)
     elif (config.AUTH_OPTION == 'Salesforce'):
@@ -47,7 +108,15 @@ def check_auth(token):
 
 
 def check_jwt(token):
+    with auth_latency.time('check_jwt'):
+        return verify_jwt(token)
+
+
+def verify_jwt(token):
     try:
+        # Tokens verified before are valid until their expiration time.
+        if jwt_cache.get(token):
+            return True, 'Your token is valid.'
         # Decode the payload to fetch the stored details.
         data = jwt.decode(token, jwt_secret_key, algorithms=['HS256'])
         if 'gcp_agent_assist_project' not in data:
@@ -58,6 +127,7 @@ def check_jwt(token):
             return False, 'The expiration time in your token is missing.'
         if data['exp'] < datetime.datetime.now().timestamp():
             return False, 'Your token has expired.'
+        jwt_cache.set(token, True, data['exp'])
         return True, 'Your token is valid.'
     except:
         return False, 'Failed to parse your token.'
@@ -75,6 +145,15 @@ def generate_jwt(user_info=None):
 
 
 def check_app_auth(auth):
+    if not isinstance(auth, dict):
+        return False
+    return cached_check(
+        app_auth_cache,
+        '{0}:{1}:{2}'.format(config.APP_AUTH_OPTION, auth.get('accountSid'), auth.get('authToken')),
+        lambda: verify_app_auth(auth))
+
+
+def verify_app_auth(auth):
     if config.APP_AUTH_OPTION == 'Twilio':
         response = requests.get(
             config.TWILIO_ACCOUNTS_API_URL, auth=(auth.get('accountSid'), auth.get('authToken')))
@@ -0,0 +1,360 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local benchmarks for UI Connector hot paths.
+
+Benchmarks run against local fakes and need neither GCP credentials nor a
+Dialogflow project. Run them from the ui-connector folder, for example:
+    python benchmark.py upstream --threads 32 --requests 4000
+    python benchmark.py jwt
+    python benchmark.py hedging
+    python benchmark.py codec
+    python benchmark.py startup --path ../cloud-pubsub-interceptor
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('GCP_PROJECT_ID', 'benchmark-project')
+os.environ.setdefault('LOGGING_FILE', os.devnull)
+
+
+def use_anonymous_credentials():
+    """Lets modules that call google.auth.default() load without ADC."""
+    import google.auth
+    from google.auth.credentials import AnonymousCredentials
+    google.auth.default = lambda *args, **kwargs: (AnonymousCredentials(), 'benchmark-project')
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def report(name, latencies, elapsed, **extra):
+    """Prints one result line with latency percentiles in milliseconds."""
+    fields = ['{:<12}'.format(name),
+              'rps={:.0f}'.format(len(latencies) / elapsed),
+              'p50={:.2f}ms'.format(statistics.median(latencies) * 1000),
+              'p99={:.2f}ms'.format(percentile(latencies, 99) * 1000)]
+    fields += ['{}={}'.format(key, value) for key, value in extra.items()]
+    print(' '.join(fields))
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeDialogflowHandler(BaseHTTPRequestHandler):
+    """Answers every request with a small gzip-encoded conversation."""
+    protocol_version = 'HTTP/1.1'
+    body = gzip.compress(json.dumps({
+        'name': 'projects/benchmark-project/locations/global/conversations/c1',
+        'lifecycleState': 'IN_PROGRESS'}).encode('utf-8'))
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def handle_request(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    do_GET = do_POST = do_PATCH = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_https_server(delay):
+    """Starts a local HTTPS server with a self-signed certificate.
+
+    Returns the server and the certificate path to trust.
+    """
+    cert_dir = tempfile.mkdtemp()
+    cert_path = os.path.join(cert_dir, 'cert.pem')
+    key_path = os.path.join(cert_dir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                    '-keyout', key_path, '-out', cert_path, '-days', '1',
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost'],
+                   check=True, capture_output=True)
+    server = FakeHTTPServer(('localhost', 0), FakeDialogflowHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.delay = delay
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, cert_path
+
+
+def run_requests(send, threads, requests):
+    latencies = []
+
+    def timed_send(_):
+        start = time.perf_counter()
+        send()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(timed_send, range(requests)))
+    return latencies, time.perf_counter() - start
+
+
+def benchmark_upstream(args):
+    """Compares the default AuthorizedSession with the tuned upstream sessions."""
+    server, cert_path = start_fake_https_server(args.delay)
+    os.environ['REQUESTS_CA_BUNDLE'] = cert_path
+    os.environ['SSL_CERT_FILE'] = cert_path
+    os.environ['DIALOGFLOW_POOL_MAXSIZE'] = str(args.threads)
+    use_anonymous_credentials()
+    from google.auth.transport.requests import AuthorizedSession
+    import config
+    import dialogflow
+    dialogflow.get_target_url = lambda location, path: 'https://localhost:{0}/{1}'.format(
+        server.server_port, path)
+    path = 'v2beta1/projects/benchmark-project/locations/global/conversations/c1'
+
+    default_session = AuthorizedSession(dialogflow.CREDENTIALS)
+    url = dialogflow.get_target_url('global', path)
+    scenarios = [('default', lambda: default_session.get(url, stream=True).raw.data),
+                 ('tuned', lambda: dialogflow.get_dialogflow('global', path).raw.data)]
+    try:
+        import httpx  # noqa: F401
+        http2_client = dialogflow.create_http2_client()
+        scenarios.append(('http2', lambda: dialogflow.http2_request(http2_client, 'GET', url).raw.data))
+    except (ImportError, RuntimeError):
+        print('httpx[http2] is not installed, skipping the http2 scenario.')
+
+    print('threads={0} requests={1} delay={2}s pool_maxsize={3}'.format(
+        args.threads, args.requests, args.delay, config.DIALOGFLOW_POOL_MAXSIZE))
+    for name, send in scenarios:
+        connections = server.connections
+        latencies, elapsed = run_requests(send, args.threads, args.requests)
+        report(name, latencies, elapsed, connections=server.connections - connections)
+    server.shutdown()
+
+
+def benchmark_jwt(args):
+    """Measures check_jwt per call with and without the verified-JWT cache."""
+    import auth
+    from token_cache import TokenCache
+    tokens = [auth.generate_jwt({'gcp_agent_assist_user': 'agent-{}'.format(i)})
+              for i in range(args.tokens)]
+    calls = [tokens[i % len(tokens)] for i in range(args.calls)]
+    print('calls={0} distinct_tokens={1}'.format(args.calls, args.tokens))
+    for name, maxsize in [('uncached', 0), ('cached', max(args.tokens, 1))]:
+        auth.jwt_cache = TokenCache('jwt', maxsize)
+        latencies = []
+        start = time.perf_counter()
+        for token in calls:
+            call_start = time.perf_counter()
+            assert auth.check_jwt(token)[0]
+            latencies.append(time.perf_counter() - call_start)
+        report(name, latencies, time.perf_counter() - start,
+               mean='{:.1f}us'.format(statistics.mean(latencies) * 1e6))
+
+
+def benchmark_hedging(args):
+    """Compares GET latencies with and without hedging, for an upstream with a slow tail."""
+    import hedging
+
+    def send():
+        slow = random.random() < args.slow_fraction
+        time.sleep(args.slow_delay if slow else args.delay * random.uniform(0.5, 1.5))
+        return slow
+
+    print('threads={0} requests={1} delay={2}s slow_delay={3}s slow_fraction={4}'.format(
+        args.threads, args.requests, args.delay, args.slow_delay, args.slow_fraction))
+    latencies, elapsed = run_requests(send, args.threads, args.requests)
+    report('unhedged', latencies, elapsed)
+    hedger = hedging.Hedger(args.percentile, args.min_delay_ms / 1000, args.budget,
+                            max_workers=4 * args.threads)
+    hedged = hedging.hedged_requests.value
+    latencies, elapsed = run_requests(lambda: hedger.request(send, lambda response: None),
+                                      args.threads, args.requests)
+    report('hedged', latencies, elapsed,
+           extra_requests='{:.1%}'.format((hedging.hedged_requests.value - hedged) / args.requests))
+
+
+def make_codec_events():
+    """Returns sample events as published by Cloud Pub/Sub Interceptor, by name."""
+    conversation = 'projects/benchmark-project/conversations/c1'
+    rng = random.Random(0)
+    # Random words, so that the text compresses about as well as natural language.
+    words = [''.join(rng.choice('etaoinshrdlucmfwyp') for _ in range(rng.randint(2, 9))) for _ in range(2000)]
+
+    def text(length):
+        return ' '.join(rng.choice(words) for _ in range(length))
+
+    def event(data_type, data):
+        return {'conversation_name': conversation, 'data_type': data_type, 'data': json.dumps(data),
+                'publish_time': '2025-01-01T00:00:00.000Z', 'message_id': '1'}
+
+    return {
+        'transcript': event('new-recognition-result-notification-event', {
+            'conversation': conversation,
+            'newRecognitionResult': {'transcript': text(12), 'isFinal': False, 'confidence': 0.9}}),
+        'suggestions': event('human-agent-assistant-event', {
+            'conversation': conversation, 'participant': conversation + '/participants/p1',
+            'suggestionResults': [{'suggestArticlesResponse': {'articleAnswers': [
+                {'title': text(8), 'uri': 'https://example.com/articles/{}'.format(i),
+                 'snippets': [text(60), text(60)], 'confidence': 0.8,
+                 'answerRecord': conversation + '/answerRecords/{}'.format(i)}
+                for i in range(5)]}}]}),
+        'summary': event('human-agent-assistant-event', {
+            'conversation': conversation,
+            'suggestionResults': [{'generateSuggestionsResponse': {'generatorSuggestionAnswers': [{
+                'generatorSuggestion': {'summarySuggestion': {'summarySections': [
+                    {'section': section, 'summary': text(150)}
+                    for section in ('Situation', 'Action', 'Resolution', 'Customer satisfaction')]}}}]}}]}),
+    }
+
+
+def benchmark_codec(args):
+    """Compares the Socket.IO frames and encoding time of JSON and msgpack events."""
+    import payload_codec
+    from socketio import packet
+
+    def encode_json(msg_object):
+        return [packet.Packet(packet.EVENT, data=[msg_object['data_type'], msg_object]).encode()]
+
+    def encode_msgpack(msg_object):
+        return packet.Packet(packet.EVENT, data=[
+            msg_object['data_type'], payload_codec.encode(msg_object, args.compress_threshold)]).encode()
+
+    print('iterations={0} compress_threshold={1}'.format(args.iterations, args.compress_threshold))
+    for name, msg_object in make_codec_events().items():
+        for codec, encode in [('json', encode_json), ('msgpack', encode_msgpack)]:
+            frames = encode(msg_object)
+            wire_bytes = sum(len(frame.encode('utf-8') if isinstance(frame, str) else frame) for frame in frames)
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                encode(msg_object)
+            cpu = (time.perf_counter() - start) / args.iterations
+            print('{:<12} {:<8} bytes={:<6} cpu={:.1f}us'.format(name, codec, wire_bytes, cpu * 1e6))
+
+
+def import_module_timed(path, module):
+    """Imports a module in a fresh interpreter with -X importtime.
+
+    Returns the import time in seconds, and the import time in seconds of each
+    module imported directly by it.
+    """
+    code = ('import os, time; start = time.perf_counter(); import {}; '
+            'print(time.perf_counter() - start, flush=True); os._exit(0)').format(module)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=path,
+                            capture_output=True, text=True, check=True)
+    imports = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Names are indented by two spaces per nesting level.
+        if cumulative.strip().isdigit() and name.startswith('   ') and not name.startswith('    '):
+            imports[name.strip()] = int(cumulative) / 1e6
+    return float(result.stdout.split()[-1]), imports
+
+
+def benchmark_startup(args):
+    """Reports the time to import a service module, such as main, and its slowest imports."""
+    durations = []
+    for _ in range(args.runs):
+        duration, imports = import_module_timed(args.path, args.module)
+        durations.append(duration)
+    print('path={0} module={1} runs={2}'.format(args.path, args.module, args.runs))
+    print('{:<12} p50={:.0f}ms min={:.0f}ms max={:.0f}ms'.format(
+        'import', statistics.median(durations) * 1000, min(durations) * 1000, max(durations) * 1000))
+    for name, cumulative in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+        print('  {:>6.0f}ms {}'.format(cumulative * 1000, name))
+
+
+BENCHMARKS = {
+    'upstream': benchmark_upstream,
+    'jwt': benchmark_jwt,
+    'hedging': benchmark_hedging,
+    'codec': benchmark_codec,
+    'startup': benchmark_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    upstream = subparsers.add_parser(
+        'upstream', help='Dialogflow proxy sessions against a local fake HTTPS server.')
+    upstream.add_argument('--threads', type=int, default=32)
+    upstream.add_argument('--requests', type=int, default=4000)
+    upstream.add_argument('--delay', type=float, default=0.05,
+                          help='Fake upstream processing time, in seconds.')
+    jwt_parser = subparsers.add_parser(
+        'jwt', help='JWT verification cost per proxied request.')
+    jwt_parser.add_argument('--calls', type=int, default=100000)
+    jwt_parser.add_argument('--tokens', type=int, default=100,
+                            help='Number of distinct agent tokens in use.')
+    hedging_parser = subparsers.add_parser(
+        'hedging', help='Hedged Dialogflow GET requests against a simulated slow tail.')
+    hedging_parser.add_argument('--threads', type=int, default=16)
+    hedging_parser.add_argument('--requests', type=int, default=2000)
+    hedging_parser.add_argument('--delay', type=float, default=0.02,
+                                help='Typical upstream latency, in seconds.')
+    hedging_parser.add_argument('--slow-delay', type=float, default=0.5,
+                                help='Latency of slow upstream responses, in seconds.')
+    hedging_parser.add_argument('--slow-fraction', type=float, default=0.02,
+                                help='Fraction of slow upstream responses.')
+    hedging_parser.add_argument('--percentile', type=float, default=95)
+    hedging_parser.add_argument('--min-delay-ms', type=int, default=50)
+    hedging_parser.add_argument('--budget', type=float, default=0.05)
+    codec = subparsers.add_parser(
+        'codec', help='Bytes on the wire and encoding time of Socket.IO events per codec.')
+    codec.add_argument('--iterations', type=int, default=2000)
+    codec.add_argument('--compress-threshold', type=int, default=1024)
+    startup = subparsers.add_parser(
+        'startup', help='Cold start import time of a service, to track regressions.')
+    startup.add_argument('--path', default='.', help='Folder of the service.')
+    startup.add_argument('--module', default='main')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--top', type=int, default=10,
+                         help='Number of slowest direct imports listed.')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,10 @@ CORS_ALLOWED_ORIGINS = '*'
 # Lifetime for generated JWT
 JWT_TOKEN_LIFETIME = 60  # minutes
 
+# Maximum number of verified JWTs kept in memory, so that a token reused by proxy calls and
+# WebSockets connections is only decoded once during its lifetime. Set to 0 to disable the cache.
+JWT_CACHE_MAXSIZE = int(os.environ.get('JWT_CACHE_MAXSIZE', 10000))
+
 # The option of authenticating users when registering JWT. By default it's empty and
 # no users are allowed to register JWT via UI Connector service.
 # Supported values:
@@ -71,3 +75,96 @@ GENESYS_CLOUD_ENVIRONMENT = os.environ.get('GENESYS_CLOUD_ENVIRONMENT', 'mypurec
 TWILIO_FLEX_ENVIRONMENT = os.environ.get('TWILIO_FLEX_ENVIRONMENT', 'YOUR_DOMAIN.twil.io')
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'YOUR_TWILIO_ACCOUNT_SID')
 TWILIO_ACCOUNTS_API_URL = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}.json"
+
+# Upstream Dialogflow transport configuration.
+# Size of the connection pool kept per Dialogflow location. It should match the number
+# of request threads served by each worker (see GUNICORN_THREADS in Dockerfile), so that
+# concurrent proxy calls don't queue on the pool or reopen connections.
+DIALOGFLOW_POOL_MAXSIZE = int(os.environ.get(
+    'DIALOGFLOW_POOL_MAXSIZE', os.environ.get('GUNICORN_THREADS', 8)))
+# Whether a request should wait for a free pooled connection instead of opening an extra one.
+DIALOGFLOW_POOL_BLOCK = os.environ.get('DIALOGFLOW_POOL_BLOCK', 'false').lower() == 'true'
+# Timeouts for Dialogflow requests, in seconds.
+DIALOGFLOW_CONNECT_TIMEOUT = float(os.environ.get('DIALOGFLOW_CONNECT_TIMEOUT', 5))
+DIALOGFLOW_READ_TIMEOUT = float(os.environ.get('DIALOGFLOW_READ_TIMEOUT', 60))
+# Idle time after which a pooled HTTP/2 or aiohttp connection is closed, in seconds.
+DIALOGFLOW_KEEPALIVE_EXPIRY = float(os.environ.get('DIALOGFLOW_KEEPALIVE_EXPIRY', 300))
+# Set to 'true' to send Dialogflow requests over a multiplexed HTTP/2 connection.
+# Requires the optional package `httpx[http2]`.
+DIALOGFLOW_HTTP2 = os.environ.get('DIALOGFLOW_HTTP2', 'false').lower() == 'true'
+# Maximum number of concurrent connections opened by the aiohttp client sending /batch requests.
+DIALOGFLOW_ASYNC_MAX_CONNECTIONS = int(os.environ.get('DIALOGFLOW_ASYNC_MAX_CONNECTIONS', 100))
+
+# Dialogflow rate limits shared by all instances through Redis, in requests per second per
+# project and location for each method family: 'analyze-content', 'suggestion' and 'default'
+# for the other methods, e.g. 'analyze-content=10,suggestion=5,default=20'. Keep them below
+# the project quotas, also used by the Audiohook service. Empty disables rate limiting.
+DIALOGFLOW_RATE_LIMITS = os.environ.get('DIALOGFLOW_RATE_LIMITS', '')
+# Seconds of requests that can be sent at once after being idle.
+DIALOGFLOW_RATE_LIMIT_BURST_SECONDS = float(os.environ.get('DIALOGFLOW_RATE_LIMIT_BURST_SECONDS', 1))
+# Fraction of the burst that requests sent with 'X-Request-Priority: background' leave
+# to interactive ones.
+DIALOGFLOW_RATE_LIMIT_BACKGROUND_RESERVE = float(os.environ.get('DIALOGFLOW_RATE_LIMIT_BACKGROUND_RESERVE', 0.2))
+# Seconds interactive and background requests wait for the rate limit before failing with 429.
+DIALOGFLOW_RATE_LIMIT_MAX_WAIT = float(os.environ.get('DIALOGFLOW_RATE_LIMIT_MAX_WAIT', 1))
+DIALOGFLOW_RATE_LIMIT_BACKGROUND_MAX_WAIT = float(os.environ.get('DIALOGFLOW_RATE_LIMIT_BACKGROUND_MAX_WAIT', 10))
+
+# Set to 'true' to hedge idempotent Dialogflow GET requests: when the first attempt takes
+# longer than DIALOGFLOW_HEDGE_PERCENTILE of recent GET latencies, a second one is sent and
+# whichever succeeds first is returned.
+DIALOGFLOW_HEDGE_GETS = os.environ.get('DIALOGFLOW_HEDGE_GETS', 'false').lower() == 'true'
+DIALOGFLOW_HEDGE_PERCENTILE = float(os.environ.get('DIALOGFLOW_HEDGE_PERCENTILE', 95))
+# Minimum delay in milliseconds before hedging a request.
+DIALOGFLOW_HEDGE_MIN_DELAY_MS = int(os.environ.get('DIALOGFLOW_HEDGE_MIN_DELAY_MS', 50))
+# Maximum fraction of GET requests that are hedged, so slow periods can't multiply the upstream load.
+DIALOGFLOW_HEDGE_BUDGET = float(os.environ.get('DIALOGFLOW_HEDGE_BUDGET', 0.05))
+
+# Cache of third-party tokens verified when registering JWT, see check_auth and check_app_auth.
+# Seconds a successfully verified token is trusted without calling the identity provider again.
+# Tokens that are JWTs, such as Twilio Flex tokens, are never trusted past their own expiration
+# time. Opaque tokens, such as Salesforce and Genesys Cloud access tokens, carry none, so keep it
+# below the lifetime of their tokens, since a revoked token is accepted until its entry expires.
+# Set to 0 to disable the cache.
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 300))
+# Seconds a rejected token is remembered, to shield identity providers from retry storms.
+AUTH_NEGATIVE_CACHE_TTL = int(os.environ.get('AUTH_NEGATIVE_CACHE_TTL', 10))
+# Maximum number of tokens kept in memory by each instance.
+AUTH_CACHE_MAXSIZE = int(os.environ.get('AUTH_CACHE_MAXSIZE', 10000))
+# Set to 'true' to share verified tokens between instances through Redis.
+AUTH_CACHE_REDIS = os.environ.get('AUTH_CACHE_REDIS', 'false').lower() == 'true'
+
+# Limits of the /batch endpoint.
+# Maximum number of Dialogflow requests in one batch.
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 10))
+# Deadline in seconds for a batch. Clients can ask for a shorter one.
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 10))
+
+# Conversation Integration Key APIs configuration.
+# Default expiry in seconds of stored conversation names. Requests can set their own 'ttl'.
+# Set to 0 to keep conversation names until they are deleted.
+CONVERSATION_NAME_TTL = int(os.environ.get('CONVERSATION_NAME_TTL', 0))
+# Maximum number of conversationIntegrationKeys in one /conversation-names request.
+CONVERSATION_NAME_BULK_MAX_KEYS = int(os.environ.get('CONVERSATION_NAME_BULK_MAX_KEYS', 1000))
+# Maximum number of keys whose memory usage is measured by /conversation-names/stats.
+CONVERSATION_NAME_STATS_SAMPLE = int(os.environ.get('CONVERSATION_NAME_STATS_SAMPLE', 1000))
+
+# Window in milliseconds over which events sent to the same conversation are coalesced and
+# delivered as one 'batched-events' frame, with superseded interim recognition results
+# dropped. Set to 0 to emit every event as it is received. Clients must handle
+# 'batched-events' before it is enabled.
+EMIT_COALESCE_WINDOW_MS = int(os.environ.get('EMIT_COALESCE_WINDOW_MS', 0))
+# Number of threads emitting the messages read from Redis Pub/Sub, so that a slow emit never
+# stalls the reader. Messages of a conversation are always emitted by the same thread, in order.
+# The default 0 emits on the reader thread, which never drops messages. Opt in with e.g. 4
+# when slow clients delay other conversations, and size EMIT_QUEUE_SIZE for bursts.
+EMIT_WORKERS = int(os.environ.get('EMIT_WORKERS', 0))
+# Maximum number of messages waiting for each emit thread when EMIT_WORKERS is set. Messages
+# beyond it are dropped, logged and counted in emit_queue_dropped_total.
+EMIT_QUEUE_SIZE = int(os.environ.get('EMIT_QUEUE_SIZE', 1000))
+# Size in bytes above which events sent to clients using a binary codec, see connect in
+# main.py, are compressed with deflate.
+CODEC_COMPRESS_THRESHOLD = int(os.environ.get('CODEC_COMPRESS_THRESHOLD', 1024))
+
+# Maximum size in bytes of the recent events sent to a client joining a conversation with
+# replay requested. They are kept by Cloud Pub/Sub Interceptor, see REPLAY_MAX_EVENTS there.
+REPLAY_MAX_BYTES = int(os.environ.get('REPLAY_MAX_BYTES', 256 * 1024))
@@ -12,21 +12,104 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+from concurrent import futures
 import logging
+import socket
+import threading
+import time
+from types import SimpleNamespace
 
-from google.cloud import dialogflow_v2beta1 as dialogflow
-from google.auth.transport.requests import AuthorizedSession
+from google.auth.transport.requests import AuthorizedSession, Request
 import google.auth
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout
+from urllib3.connection import HTTPConnection
+
+import config
+from hedging import Hedger
 
 ROLES = ['HUMAN_AGENT', 'AUTOMATED_AGENT', 'END_USER']
 LANGUAGE_CODE = 'en-US'
 
-# static variables for dialogflow client
-CONVERSATIONS_CLIENT = dialogflow.ConversationsClient()
-PARTICIPANTS_CLIENT = dialogflow.ParticipantsClient()
-CREDENTIALS, PROJECT_ID = google.auth.default(
-    scopes=['https://www.googleapis.com/auth/dialogflow'])
-AUTHED_SESSION = AuthorizedSession(CREDENTIALS)
+# Default credentials and Dialogflow clients, created on first use by get_credentials and
+# __getattr__ so that importing this module makes no metadata server or gRPC calls.
+_DEFAULTS = {}
+_DEFAULTS_LOCK = threading.Lock()
+# Upstream sessions keyed by Dialogflow location, each with its own connection pool.
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+_CREDENTIALS_LOCK = threading.Lock()
+_ASYNC_CLIENT = None
+_ASYNC_CLIENT_LOCK = threading.Lock()
+_HEDGER = Hedger(
+    config.DIALOGFLOW_HEDGE_PERCENTILE,
+    config.DIALOGFLOW_HEDGE_MIN_DELAY_MS / 1000,
+    config.DIALOGFLOW_HEDGE_BUDGET,
+    max_workers=4 * config.DIALOGFLOW_POOL_MAXSIZE) if config.DIALOGFLOW_HEDGE_GETS else None
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a Dialogflow request does not complete within its deadline."""
+
+
+def get_credentials():
+    """Returns the application default credentials, loading them on first use."""
+    if 'CREDENTIALS' not in _DEFAULTS:
+        with _DEFAULTS_LOCK:
+            if 'CREDENTIALS' not in _DEFAULTS:
+                credentials, project_id = google.auth.default(
+                    scopes=['https://www.googleapis.com/auth/dialogflow'])
+                _DEFAULTS['PROJECT_ID'] = project_id
+                _DEFAULTS['CREDENTIALS'] = credentials
+    return _DEFAULTS['CREDENTIALS']
+
+
+def __getattr__(name):
+    """Creates CREDENTIALS, PROJECT_ID and the gRPC clients on first access."""
+    if name in ('CREDENTIALS', 'PROJECT_ID'):
+        get_credentials()
+        return _DEFAULTS[name]
+    if name in ('CONVERSATIONS_CLIENT', 'PARTICIPANTS_CLIENT'):
+        with _DEFAULTS_LOCK:
+            if name not in _DEFAULTS:
+                # Importing the client library takes about a second, and the proxy does not need it.
+                from google.cloud import dialogflow_v2beta1
+                if name == 'CONVERSATIONS_CLIENT':
+                    _DEFAULTS[name] = dialogflow_v2beta1.ConversationsClient()
+                else:
+                    _DEFAULTS[name] = dialogflow_v2beta1.ParticipantsClient()
+        return _DEFAULTS[name]
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+def get_deadline_headers(timeout):
+    """Returns the headers asking Dialogflow to give up on a request after timeout seconds."""
+    if timeout is None:
+        return {}
+    return {'X-Server-Timeout': '{:.3f}'.format(timeout)}
+
+
+class RawResponse:
+    """Upstream response with its undecoded body, shaped like the `requests`
+    response fields used by the proxy: status_code, headers and raw.data.
+    """
+
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.raw = SimpleNamespace(data=data)
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive on pooled connections, so idle
+    upstream connections survive between bursts of proxy calls.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
 
 
 def get_target_url(location, path):
@@ -35,22 +118,258 @@ def get_target_url(location, path):
     return 'https://{0}-dialogflow.googleapis.com/{1}'.format(location, path)
 
 
-def get_dialogflow(location, path):
-    url = get_target_url(location, path)
-    logging.debug('get_dialogflow {0}'.format(url))
-    response = AUTHED_SESSION.get(url, stream=True)
-    return response
+def get_authorization_headers(force_refresh=False):
+    """Returns request headers carrying a valid access token for Dialogflow.
+
+    Set force_refresh to replace a token that Dialogflow has rejected.
+    """
+    headers = {}
+    with _CREDENTIALS_LOCK:
+        credentials = get_credentials()
+        if force_refresh or not credentials.valid:
+            credentials.refresh(Request())
+        credentials.apply(headers)
+    return headers
+
+
+def create_session():
+    """Creates an authorized session with a tuned connection pool."""
+    session = AuthorizedSession(get_credentials())
+    adapter = KeepAliveHTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=config.DIALOGFLOW_POOL_MAXSIZE,
+        pool_block=config.DIALOGFLOW_POOL_BLOCK)
+    session.mount('https://', adapter)
+    return session
+
+
+def create_http2_client():
+    """Creates a client multiplexing requests over HTTP/2 connections."""
+    try:
+        import httpx
+    except ImportError as e:
+        raise RuntimeError(
+            'DIALOGFLOW_HTTP2 requires the httpx[http2] package to be installed.') from e
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=config.DIALOGFLOW_POOL_MAXSIZE,
+            max_keepalive_connections=config.DIALOGFLOW_POOL_MAXSIZE,
+            keepalive_expiry=config.DIALOGFLOW_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(
+            config.DIALOGFLOW_READ_TIMEOUT,
+            connect=config.DIALOGFLOW_CONNECT_TIMEOUT))
+
+
+def get_session(location):
+    """Returns the upstream session for a location, creating it on first use."""
+    session = _SESSIONS.get(location)
+    if session is None:
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(location)
+            if session is None:
+                session = create_http2_client() if config.DIALOGFLOW_HTTP2 else create_session()
+                _SESSIONS[location] = session
+                logging.info('Created Dialogflow session for location {0}, http2: {1}.'.format(
+                    location, config.DIALOGFLOW_HTTP2))
+    return session
+
+
+def http2_request(client, method, url, data=None, timeout=None):
+    """Sends a request with the HTTP/2 client and keeps the body undecoded."""
+    # httpx is installed, since create_http2_client created the client.
+    import httpx
+    for attempt in range(2):
+        headers = get_authorization_headers()
+        headers.update(get_deadline_headers(timeout))
+        request = client.build_request(
+            method, url, json=data, headers=headers,
+            timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else timeout)
+        try:
+            response = client.send(request, stream=True)
+            try:
+                body = b''.join(response.iter_raw())
+            finally:
+                response.close()
+        except httpx.TimeoutException as e:
+            if timeout is None:
+                raise
+            raise DeadlineExceeded() from e
+        # Refresh an access token revoked before its expiry once, as AuthorizedSession does.
+        if response.status_code != 401 or attempt:
+            break
+        get_authorization_headers(force_refresh=True)
+    return RawResponse(response.status_code, response.headers, body)
+
+
+class AsyncDialogflowClient:
+    """Sends Dialogflow requests with aiohttp on a dedicated event loop thread.
+
+    Only used to fan out the sub-requests of /batch: they are all in flight at
+    once on the loop, multiplexed over one connection pool, while the request
+    thread waits once for the whole batch. Other proxied requests are sent by
+    request_dialogflow and hold their gunicorn thread until they complete.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._session = None
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name='dialogflow-async', daemon=True)
+        self._thread.start()
+
+    def _get_session(self):
+        # Only called on the loop thread, so no lock is needed.
+        if self._session is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(
+                limit=config.DIALOGFLOW_ASYNC_MAX_CONNECTIONS,
+                keepalive_timeout=config.DIALOGFLOW_KEEPALIVE_EXPIRY)
+            # Keep the upstream body undecoded, it is forwarded along with its headers.
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                auto_decompress=False,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=config.DIALOGFLOW_CONNECT_TIMEOUT,
+                    sock_read=config.DIALOGFLOW_READ_TIMEOUT))
+        return self._session
+
+    async def _get_authorization_headers(self, force_refresh=False):
+        # Token refresh is a blocking call, keep it off the event loop.
+        return await self._loop.run_in_executor(
+            None, get_authorization_headers, force_refresh)
+
+    async def request(self, method, location, path, data=None, timeout=None):
+        """Sends a Dialogflow request and returns a RawResponse.
+
+        Args:
+            timeout: optional total time in seconds allowed for the request.
+        """
+        url = get_target_url(location, path)
+        logging.debug('{0} dialogflow (async) {1}'.format(method, url))
+        session = self._get_session()
+        import aiohttp
+        request_timeout = aiohttp.ClientTimeout(
+            total=timeout,
+            sock_connect=config.DIALOGFLOW_CONNECT_TIMEOUT,
+            sock_read=config.DIALOGFLOW_READ_TIMEOUT)
+        for attempt in range(2):
+            headers = await self._get_authorization_headers(force_refresh=attempt > 0)
+            headers.update(get_deadline_headers(timeout))
+            async with session.request(method, url, json=data, headers=headers,
+                                       timeout=request_timeout) as response:
+                body = await response.read()
+            if response.status != 401 or attempt:
+                break
+        return RawResponse(response.status, response.headers, body)
+
+    async def request_all(self, requests, timeout, observe=None):
+        """Sends Dialogflow requests concurrently within a shared deadline.
+
+        Args:
+            requests: a list of (method, location, path, data) tuples.
+            timeout: time in seconds allowed for the whole batch.
+            observe: optional function called with the index of each request
+                and the seconds it took, until its response, error or deadline.
+
+        Returns:
+            A list with, for each request in order, its RawResponse or the
+            exception it raised. Requests still running at the deadline are
+            cancelled and reported as asyncio.TimeoutError.
+        """
+        async def timed_request(index, request):
+            start = time.perf_counter()
+            try:
+                return await self.request(*request)
+            finally:
+                if observe is not None:
+                    observe(index, time.perf_counter() - start)
+
+        tasks = [asyncio.ensure_future(timed_request(index, request))
+                 for index, request in enumerate(requests)]
+        if not tasks:
+            return []
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        results = []
+        for task in tasks:
+            if task in pending:
+                results.append(asyncio.TimeoutError())
+            elif task.exception() is not None:
+                results.append(task.exception())
+            else:
+                results.append(task.result())
+        return results
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the client loop from any thread.
+
+        Returns a concurrent.futures.Future for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+
+def get_async_client():
+    """Returns the process-wide AsyncDialogflowClient, starting it on first use."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        with _ASYNC_CLIENT_LOCK:
+            if _ASYNC_CLIENT is None:
+                _ASYNC_CLIENT = AsyncDialogflowClient()
+    return _ASYNC_CLIENT
+
+
+def request_dialogflow(method, location, path, data=None, timeout=None):
+    """Sends a Dialogflow request.
+
+    Args:
+        timeout: optional seconds allowed for the request, also sent to Dialogflow.
+
+    Raises:
+        DeadlineExceeded: the request did not complete within timeout.
+    """
+    try:
+        url = get_target_url(location, path)
+        logging.debug('{0} dialogflow {1}'.format(method, url))
+        session = get_session(location)
+        if config.DIALOGFLOW_HTTP2:
+            return http2_request(session, method, url, data, timeout)
+        if timeout is None:
+            return session.request(
+                method, url, json=data, stream=True,
+                timeout=(config.DIALOGFLOW_CONNECT_TIMEOUT, config.DIALOGFLOW_READ_TIMEOUT))
+        return session.request(
+            method, url, json=data, stream=True, headers=get_deadline_headers(timeout),
+            timeout=(min(config.DIALOGFLOW_CONNECT_TIMEOUT, timeout), min(config.DIALOGFLOW_READ_TIMEOUT, timeout)))
+    except Timeout as e:
+        if timeout is None:
+            raise
+        raise DeadlineExceeded() from e
+
+
+def close_response(response):
+    """Releases the connection of a response whose body is not read."""
+    if hasattr(response, 'close'):
+        response.close()
+
+
+def get_dialogflow(location, path, timeout=None):
+    """Sends a Dialogflow GET request, hedged when DIALOGFLOW_HEDGE_GETS is set."""
+    if _HEDGER is None:
+        return request_dialogflow('GET', location, path, timeout=timeout)
+    try:
+        return _HEDGER.request(
+            lambda: request_dialogflow('GET', location, path, timeout=timeout), close_response, timeout)
+    except futures.TimeoutError as e:
+        raise DeadlineExceeded() from e
 
 
-def post_dialogflow(location, path, data=None):
-    url = get_target_url(location, path)
-    logging.debug('post_dialogflow {0}'.format(url))
-    response = AUTHED_SESSION.post(url, json=data, stream=True)
-    return response
+def post_dialogflow(location, path, data=None, timeout=None):
+    return request_dialogflow('POST', location, path, data, timeout)
 
 
-def patch_dialogflow(location, path, data):
-    url = get_target_url(location, path)
-    logging.debug('patch_dialogflow {0}'.format(url))
-    response = AUTHED_SESSION.patch(url, json=data, stream=True)
-    return response
+def patch_dialogflow(location, path, data, timeout=None):
+    return request_dialogflow('PATCH', location, path, data, timeout)
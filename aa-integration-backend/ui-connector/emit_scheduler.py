@@ -0,0 +1,97 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import json
+import logging
+import threading
+import time
+
+# Socket.IO event carrying several events coalesced for one room.
+BATCHED_EVENTS = 'batched-events'
+RECOGNITION_RESULT_EVENT = 'new-recognition-result-notification-event'
+
+
+def is_interim_recognition_result(msg_object):
+    """Returns whether an event holds a recognition result that is not final."""
+    if msg_object.get('data_type') != RECOGNITION_RESULT_EVENT:
+        return False
+    try:
+        data = json.loads(msg_object['data'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return not data.get('newRecognitionResult', {}).get('isFinal', False)
+
+
+class EmitScheduler:
+    """Coalesces the events emitted to the same room over a short window.
+
+    The first event received for a room opens a window, and the events collected
+    until it closes are emitted as one 'batched-events' frame holding the list of
+    events in order. A window holding a single event is emitted as that event.
+    Recognition results of a participant supersede the pending interim results of
+    the same participant, which are dropped before sending.
+    """
+
+    def __init__(self, emit, window):
+        """
+        Args:
+            emit: the function sending an event to a room, called as emit(event, data, to=room).
+            window: the coalescing window in seconds.
+        """
+        self._emit = emit
+        self._window = window
+        self._pending = {}
+        self._deadlines = []
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='emit-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, room, msg_object):
+        """Queues an event for a room until its window closes."""
+        with self._condition:
+            events = self._pending.get(room)
+            if events is None:
+                events = self._pending[room] = []
+                heapq.heappush(self._deadlines, (time.monotonic() + self._window, room))
+                self._condition.notify()
+            if msg_object.get('data_type') == RECOGNITION_RESULT_EVENT:
+                role = msg_object.get('participant_role')
+                events[:] = [event for event in events
+                             if not (event.get('participant_role') == role
+                                     and is_interim_recognition_result(event))]
+            events.append(msg_object)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._deadlines:
+                    self._condition.wait()
+                deadline, room = self._deadlines[0]
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+                heapq.heappop(self._deadlines)
+                events = self._pending.pop(room)
+            try:
+                self.flush(room, events)
+            except Exception:
+                logging.exception('Failed to emit events to room {}.'.format(room))
+
+    def flush(self, room, events):
+        if len(events) == 1:
+            self._emit(events[0]['data_type'], events[0], to=room)
+        else:
+            self._emit(BATCHED_EVENTS, events, to=room)
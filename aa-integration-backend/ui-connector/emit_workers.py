@@ -0,0 +1,88 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+import time
+import zlib
+
+import metrics
+
+
+class EmitWorkerPool:
+    """Hands messages read from Redis over to worker threads that emit them.
+
+    Each worker drains its own bounded queue, and messages are sharded across
+    queues by key, so messages with the same key are handled in order by the
+    same worker. When the queue of a key is full, the message is dropped, so
+    that a slow emit never stalls the Redis reader.
+    """
+
+    def __init__(self, handler, workers, queue_size):
+        """
+        Args:
+            handler: the function emitting a message, called as handler(item).
+            workers: the number of worker threads.
+            queue_size: the maximum number of messages waiting for each worker.
+        """
+        self._handler = handler
+        self._queues = [queue.Queue(queue_size) for _ in range(workers)]
+        self.dropped = metrics.Counter(
+            'emit_queue_dropped_total', 'Messages dropped because their emit queue was full.')
+        for index, shard in enumerate(self._queues):
+            threading.Thread(target=self._run, args=(shard,),
+                             name='emit-worker-{}'.format(index), daemon=True).start()
+
+    def submit(self, key, item):
+        """Queues a message for the worker of its key without blocking.
+
+        Args:
+            key: the bytes or string sharding the message, such as its Redis channel.
+            item: the message passed to the handler.
+
+        Returns:
+            Whether the message was queued.
+        """
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        shard = self._queues[zlib.crc32(key) % len(self._queues)]
+        try:
+            shard.put_nowait((time.monotonic(), item))
+        except queue.Full:
+            self.dropped.inc()
+            logging.warning('Emit queue is full, dropped message for: {}'.format(key))
+            return False
+        return True
+
+    def depth(self):
+        """Returns the number of messages waiting in all queues."""
+        return sum(shard.qsize() for shard in self._queues)
+
+    def oldest_age(self):
+        """Returns the seconds the oldest waiting message has been queued, or 0."""
+        oldest = None
+        for shard in self._queues:
+            with shard.mutex:
+                if shard.queue and (oldest is None or shard.queue[0][0] < oldest):
+                    oldest = shard.queue[0][0]
+        return 0 if oldest is None else time.monotonic() - oldest
+
+    def _run(self, shard):
+        while True:
+            _, item = shard.get()
+            try:
+                self._handler(item)
+            except Exception:
+                logging.exception('Failed to emit message: {}'.format(item))
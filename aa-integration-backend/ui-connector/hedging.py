@@ -0,0 +1,147 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+from concurrent import futures
+import logging
+import threading
+import time
+
+import metrics
+
+hedged_requests = metrics.register(metrics.Counter(
+    'dialogflow_hedged_requests_total', 'Extra Dialogflow GET requests sent as hedges.'))
+hedge_wins = metrics.register(metrics.Counter(
+    'dialogflow_hedge_wins_total', 'Hedged Dialogflow GET requests answered first by the hedge.'))
+hedge_budget_exhausted = metrics.register(metrics.Counter(
+    'dialogflow_hedge_budget_exhausted_total', 'Dialogflow GET requests not hedged because of the hedge budget.'))
+# Compared with dialogflow_upstream_seconds of GET routes, shows the latency saved by hedging.
+primary_latency = metrics.register(metrics.Histogram(
+    'dialogflow_get_primary_seconds', 'Latency of the first attempt of Dialogflow GET requests, as without hedging.'))
+
+
+class LatencyTracker:
+    """Percentiles over a sliding window of recent latencies."""
+
+    def __init__(self, window=1000, min_samples=20):
+        self._samples = deque(maxlen=window)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent):
+        """Returns a percentile of the window, or None until there are enough samples."""
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(int(len(samples) * percent / 100), len(samples) - 1)]
+
+
+class HedgeBudget:
+    """Caps hedges to a fraction of requests.
+
+    Every request adds `ratio` tokens, up to `max_tokens`, and every hedge takes one,
+    so bursts of slow responses can't multiply the upstream load.
+    """
+
+    def __init__(self, ratio, max_tokens=10):
+        self._ratio = ratio
+        self._max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + self._ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Hedger:
+    """Sends a second copy of an idempotent request when the first one is slower
+    than a percentile of recent latencies, and returns whichever succeeds first.
+    """
+
+    def __init__(self, percentile=95, min_delay=0.05, budget_ratio=0.05, max_workers=32):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker()
+        self.budget = HedgeBudget(budget_ratio)
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def get_delay(self):
+        """Returns the seconds to wait for the first attempt before hedging, or
+        None while there are too few latencies to tell.
+        """
+        delay = self.latencies.percentile(self.percentile)
+        return None if delay is None else max(delay, self.min_delay)
+
+    def _send_primary(self, send):
+        start = time.perf_counter()
+        response = send()
+        elapsed = time.perf_counter() - start
+        self.latencies.record(elapsed)
+        primary_latency.observe(elapsed)
+        return response
+
+    def request(self, send, close, timeout=None):
+        """Returns the response of send(), hedged with a second call if needed.
+
+        Args:
+            send: function sending the request and returning its response.
+            close: function releasing a response that is not used.
+            timeout: optional seconds allowed for the request.
+
+        Raises:
+            concurrent.futures.TimeoutError: no attempt succeeded within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.budget.deposit()
+        attempts = [self._executor.submit(self._send_primary, send)]
+        delay = self.get_delay()
+        if delay is not None and (timeout is None or delay < timeout):
+            done, _ = futures.wait(attempts, timeout=delay)
+            if not done:
+                if self.budget.withdraw():
+                    hedged_requests.inc()
+                    logging.debug('Hedging Dialogflow request after {:.0f} ms.'.format(delay * 1000))
+                    attempts.append(self._executor.submit(send))
+                else:
+                    hedge_budget_exhausted.inc()
+        pending = set(attempts)
+        try:
+            while pending:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                done, pending = futures.wait(pending, timeout=remaining, return_when=futures.FIRST_COMPLETED)
+                if not done:
+                    raise futures.TimeoutError()
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is not attempts[0]:
+                            hedge_wins.inc()
+                        return attempt.result()
+            # Every attempt failed, raise the error of the first one.
+            return attempts[0].result()
+        finally:
+            for attempt in pending:
+                attempt.add_done_callback(lambda f: f.exception() is None and close(f.result()))
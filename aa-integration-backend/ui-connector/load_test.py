@@ -0,0 +1,218 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Socket.IO fanout load test for a running UI Connector.
+
+It connects simulated agent desktops with JWTs from generate_jwt, joins them to
+conversations, and publishes events to Redis the way Cloud Pub/Sub Interceptor
+does. It then reports the connect rate, the publish-to-receive latency of the
+events and, given the server pid, the server memory used per socket.
+
+Start Redis and UI Connector locally with the same GCP_PROJECT_ID and JWT secret,
+then run it from the ui-connector folder, for example:
+    redis-server &
+    gunicorn --bind :8080 --workers 1 --threads 600 main:app &
+    python load_test.py --clients 500 --conversations 100 --server-pid <worker pid>
+Every WebSocket holds a gunicorn thread, so --threads must exceed --clients.
+
+Given --max-p99-ms or --max-drop-rate, it exits with status 1 when the fanout
+misses them, so that it can gate a change against a baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import redis.asyncio
+import socketio
+
+from benchmark import percentile, report
+import auth
+import config
+
+EVENT_TYPE = 'new-message-event'
+
+
+def get_rss_bytes(pid):
+    """Returns the resident memory of a process, read from /proc."""
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def get_conversation_name(run_id, index):
+    return 'projects/{0}/conversations/load-test-{1}-{2}'.format(config.GCP_PROJECT_ID, run_id, index)
+
+
+class AgentDesktop:
+    """A Socket.IO client joined to one conversation, recording event latencies."""
+
+    def __init__(self, latencies):
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.latencies = latencies
+        self.client.on(EVENT_TYPE, self.on_event)
+        self.client.on('batched-events', self.on_batched_events)
+
+    async def on_event(self, msg_object):
+        self.latencies.append(time.time() - json.loads(msg_object['data'])['sentAt'])
+
+    async def on_batched_events(self, events):
+        for msg_object in events:
+            if msg_object['data_type'] == EVENT_TYPE:
+                await self.on_event(msg_object)
+
+    async def connect(self, url, token, conversation_name, timeout):
+        await self.client.connect(url, auth={'token': token}, transports=['websocket'], wait_timeout=timeout)
+        await self.client.call('join-conversation', conversation_name)
+
+
+async def connect_clients(args, conversation_names, latencies):
+    """Connects and joins the clients, at most args.concurrency at a time.
+
+    Returns the clients and the connect latencies.
+    """
+    token = auth.generate_jwt({'gcp_agent_assist_user': 'load-test'})
+    semaphore = asyncio.Semaphore(args.concurrency)
+    connect_latencies = []
+
+    async def connect(index):
+        desktop = AgentDesktop(latencies)
+        async with semaphore:
+            start = time.perf_counter()
+            await desktop.connect(args.url, token, conversation_names[index % len(conversation_names)],
+                                  args.timeout)
+            connect_latencies.append(time.perf_counter() - start)
+        return desktop
+
+    desktops = await asyncio.gather(*(connect(index) for index in range(args.clients)))
+    return desktops, connect_latencies
+
+
+async def publish_events(args, redis_client, conversation_names):
+    """Publishes args.events events to every conversation at args.rate events per second.
+
+    Returns the number of events published, and the conversations skipped because
+    no UI Connector is mapped to them, as their join failed or the mapping expired.
+    """
+    server_ids = await redis_client.mget(conversation_names)
+    mapped = [(conversation_name, server_id)
+              for conversation_name, server_id in zip(conversation_names, server_ids) if server_id is not None]
+    interval = 1 / args.rate if args.rate > 0 else 0
+    start = time.perf_counter()
+    published = 0
+    for sequence in range(args.events):
+        for conversation_name, server_id in mapped:
+            now = time.time()
+            msg_data = {
+                'conversation_name': conversation_name,
+                'data': json.dumps({'sentAt': now, 'payload': 'x' * args.payload_bytes}),
+                'data_type': EVENT_TYPE,
+                'publish_time': datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                'message_id': '{0}-{1}'.format(sequence, published),
+            }
+            await redis_client.publish('{0}:{1}'.format(server_id.decode('utf-8'), conversation_name),
+                                       json.dumps(msg_data))
+            published += 1
+            delay = start + published * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    return published, len(conversation_names) - len(mapped)
+
+
+def check_thresholds(args, latencies, expected):
+    """Returns the fanout thresholds missed, as printable messages."""
+    failures = []
+    drop_rate = (expected - len(latencies)) / expected if expected else 0
+    if args.max_drop_rate is not None and drop_rate > args.max_drop_rate:
+        failures.append('drop rate {0:.4f} > {1}'.format(drop_rate, args.max_drop_rate))
+    if args.max_p99_ms is not None:
+        p99_ms = percentile(latencies, 99) * 1000 if latencies else float('inf')
+        if p99_ms > args.max_p99_ms:
+            failures.append('p99 {0:.2f}ms > {1}ms'.format(p99_ms, args.max_p99_ms))
+    return failures
+
+
+async def run(args):
+    """Runs the load test and returns the thresholds missed."""
+    run_id = uuid.uuid4().hex[:8]
+    conversation_names = [get_conversation_name(run_id, index) for index in range(args.conversations)]
+    redis_client = redis.asyncio.StrictRedis(host=config.REDIS_HOST, port=config.REDIS_PORT)
+    latencies = []
+    rss_before = get_rss_bytes(args.server_pid) if args.server_pid else 0
+
+    start = time.perf_counter()
+    desktops, connect_latencies = await connect_clients(args, conversation_names, latencies)
+    elapsed = time.perf_counter() - start
+    extra = {'clients': args.clients}
+    if args.server_pid:
+        extra['rss_per_socket'] = '{:.1f}KiB'.format(
+            (get_rss_bytes(args.server_pid) - rss_before) / args.clients / 1024)
+    report('connect', connect_latencies, elapsed, **extra)
+
+    start = time.perf_counter()
+    published, unmapped = await publish_events(args, redis_client, conversation_names)
+    # Every client receives every event of its conversation. Events of unmapped
+    # conversations are never published, and count as dropped.
+    expected = args.events * args.clients
+    deadline = time.monotonic() + args.timeout
+    while len(latencies) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    if latencies:
+        report('fanout', latencies, elapsed, published=published, expected=expected,
+               received=len(latencies), unmapped=unmapped, max='{:.2f}ms'.format(max(latencies) * 1000))
+    else:
+        print('fanout       received=0 expected={0} unmapped={1}'.format(expected, unmapped))
+
+    await asyncio.gather(*(desktop.client.disconnect() for desktop in desktops))
+    await redis_client.aclose()
+    return check_thresholds(args, latencies, expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8080', help='UI Connector URL.')
+    parser.add_argument('--clients', type=int, default=100, help='Number of Socket.IO clients.')
+    parser.add_argument('--conversations', type=int, default=10,
+                        help='Number of conversations, shared evenly by the clients.')
+    parser.add_argument('--events', type=int, default=100, help='Events published to each conversation.')
+    parser.add_argument('--rate', type=float, default=500,
+                        help='Events published per second across conversations, 0 for no limit.')
+    parser.add_argument('--payload-bytes', type=int, default=500, help='Size of the padding in each event.')
+    parser.add_argument('--concurrency', type=int, default=50, help='Clients connecting at the same time.')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='Seconds to wait for a connection, or for events after publishing the last one.')
+    parser.add_argument('--server-pid', type=int,
+                        help='Pid of the UI Connector process, to report its memory per socket.')
+    parser.add_argument('--max-p99-ms', type=float,
+                        help='Fail if the p99 publish-to-receive latency exceeds it, in milliseconds.')
+    parser.add_argument('--max-drop-rate', type=float,
+                        help='Fail if the fraction of expected events not received exceeds it, e.g. 0.001.')
+    args = parser.parse_args()
+    if os.path.exists(config.JWT_SECRET_KEY_PATH):
+        auth.load_jwt_secret_key()
+    failures = asyncio.run(run(args))
+    for failure in failures:
+        print('FAILED: {}'.format(failure))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
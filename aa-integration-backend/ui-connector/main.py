@@ -12,24 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import logging
 import os
 import json
 import random
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
 import gzip
 import hashlib
+from urllib.parse import urlsplit
 
-from flask import Flask, request, make_response, jsonify, render_template
+from flask import Flask, request, make_response, jsonify, render_template, session
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from socketio.exceptions import ConnectionRefusedError
+from werkzeug.exceptions import HTTPException, NotFound
 import redis
 import time
 
 import config
 import dialogflow
-from auth import check_auth, generate_jwt, token_required, check_jwt, load_jwt_secret_key, check_app_auth
+from emit_scheduler import EmitScheduler
+from emit_workers import EmitWorkerPool
+import metrics
+import payload_codec
+from rate_limiter import BACKGROUND, INTERACTIVE, RateLimiter, get_method_family, parse_rate_limits
+from auth import check_auth, generate_jwt, token_required, check_jwt, load_jwt_secret_key, check_app_auth, enable_redis_token_cache
 
 app = Flask(__name__)
 CORS(app, origins=config.CORS_ALLOWED_ORIGINS)
@@ -37,19 +46,90 @@ socketio = SocketIO(app, cors_allowed_origins=config.CORS_ALLOWED_ORIGINS)
 load_jwt_secret_key()
 
 
+def has_clients(room):
+    """Returns whether any socket of this instance is in a room."""
+    return bool(socketio.server.manager.rooms.get('/', {}).get(room))
+
+
+def emit_to_room(event, data, to):
+    """Emits an event to a room, as JSON to its clients and encoded to the clients
+    that negotiated a codec, which are in the codec rooms of the room.
+    """
+    socketio.emit(event, data, to=to)
+    for codec in payload_codec.CODECS:
+        codec_room = payload_codec.get_codec_room(to, codec)
+        if has_clients(codec_room):
+            socketio.emit(event, payload_codec.encode(data, config.CODEC_COMPRESS_THRESHOLD), to=codec_room)
+
+
+emit_scheduler = None
+if config.EMIT_COALESCE_WINDOW_MS > 0:
+    emit_scheduler = EmitScheduler(emit_to_room, config.EMIT_COALESCE_WINDOW_MS / 1000)
+
+
+redis_messages_received = metrics.register(metrics.Counter(
+    'redis_messages_received_total', 'Messages received from Redis Pub/Sub.'))
+emit_latency = metrics.register(metrics.Histogram(
+    'emit_seconds', 'Latency of emitting a message received from Redis Pub/Sub.'))
+emit_lag = metrics.register(metrics.Histogram(
+    'emit_lag_seconds', 'Delay between Cloud Pub/Sub publishing an event and emitting it.'))
+upstream_latency = metrics.register(metrics.Histogram(
+    'dialogflow_upstream_seconds', 'Latency of Dialogflow requests per proxied route.',
+    labels=('route', 'method')))
+
+
+def get_publish_timestamp(publish_time):
+    """Returns the POSIX timestamp of a Cloud Pub/Sub publishTime, such as
+    '2021-12-09T20:05:37.275Z', or None.
+    """
+    try:
+        seconds, _, fraction = publish_time.rstrip('Z').partition('.')
+        timestamp = datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        return timestamp + (float('0.' + fraction) if fraction else 0)
+    except (AttributeError, ValueError):
+        return None
+
+
+def emit_message(data):
+    """Emits a message published to Redis to the room of its conversation."""
+    msg_object = json.loads(data)
+    with emit_latency.time():
+        if emit_scheduler:
+            emit_scheduler.submit(msg_object['conversation_name'], msg_object)
+        else:
+            emit_to_room(msg_object['data_type'], msg_object, to=msg_object['conversation_name'])
+    publish_timestamp = get_publish_timestamp(msg_object.get('publish_time'))
+    if publish_timestamp is not None:
+        emit_lag.observe(max(time.time() - publish_timestamp, 0))
+    logging.info('Emitted conversation_name: {0}, data_type: {1}.'.format(
+        msg_object['conversation_name'],
+        msg_object['data_type']))
+
+
+emit_workers = None
+if config.EMIT_WORKERS > 0:
+    emit_workers = EmitWorkerPool(emit_message, config.EMIT_WORKERS, config.EMIT_QUEUE_SIZE)
+    metrics.register(emit_workers.dropped)
+    metrics.register(metrics.Gauge(
+        'emit_queue_depth', 'Messages waiting to be emitted.', emit_workers.depth))
+    metrics.register(metrics.Gauge(
+        'emit_queue_oldest_age_seconds', 'Seconds the oldest waiting message has been queued.',
+        emit_workers.oldest_age))
+
+
 def redis_pubsub_handler(message):
     """Handles messages from Redis Pub/Sub."""
-    logging.info('Redis Pub/Sub Received data: {}'.format(message))
-    msg_object = json.loads(message['data'])
-    socketio.emit(msg_object['data_type'], msg_object,
-                  to=msg_object['conversation_name'])
-    logging.info('Redis Subscribe: {0},{1},{2},{3}; conversation_name: {4}, data_type: {5}.'.format(
+    logging.info('Redis Subscribe: {0},{1},{2},{3}.'.format(
         message['type'],
         message['pattern'],
         message['channel'],
-        message['data'],
-        msg_object['conversation_name'],
-        msg_object['data_type']))
+        message['data']))
+    redis_messages_received.inc()
+    if emit_workers:
+        # Messages of a conversation share a channel, so they are emitted in order.
+        emit_workers.submit(message['channel'], message['data'])
+    else:
+        emit_message(message['data'])
 
 def psubscribe_exception_handler(ex, pubsub, thread):
     logging.exception('An error occurred while getting pubsub messages: {}'.format(ex))
@@ -66,9 +146,38 @@ redis_client = redis.StrictRedis(
     socket_keepalive=True,
     retry=redis.retry.Retry(redis.backoff.ExponentialBackoff(cap=5, base=1), 5),
     retry_on_error=[redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, redis.exceptions.ResponseError])
-p = redis_client.pubsub(ignore_subscribe_messages=True)
-p.psubscribe(**{'{}:*'.format(SERVER_ID): redis_pubsub_handler})
-thread = p.run_in_thread(sleep_time=0.001, exception_handler=psubscribe_exception_handler)
+redis_subscriber = None
+redis_subscriber_lock = threading.Lock()
+dialogflow_rate_limiter = None
+if config.DIALOGFLOW_RATE_LIMITS:
+    dialogflow_rate_limiter = RateLimiter(
+        redis_client, parse_rate_limits(config.DIALOGFLOW_RATE_LIMITS),
+        config.DIALOGFLOW_RATE_LIMIT_BURST_SECONDS, config.DIALOGFLOW_RATE_LIMIT_BACKGROUND_RESERVE)
+rate_limit_wait = metrics.register(metrics.Histogram(
+    'dialogflow_rate_limit_wait_seconds', 'Time Dialogflow requests waited for the rate limit.',
+    labels=('family', 'priority')))
+rate_limit_rejected = metrics.register(metrics.Counter(
+    'dialogflow_rate_limit_rejected_total', 'Dialogflow requests rejected by the rate limit.'))
+if config.AUTH_CACHE_REDIS:
+    enable_redis_token_cache(redis_client)
+
+def start_redis_subscriber():
+    """Subscribes to the Redis Pub/Sub channels of this server, once.
+
+    It is called when the first client connects, so that starting an instance
+    makes no Redis connection. Events are only published to this server for
+    conversations joined by its clients.
+    """
+    global redis_subscriber
+    if redis_subscriber is not None:
+        return
+    with redis_subscriber_lock:
+        if redis_subscriber is None:
+            p = redis_client.pubsub(ignore_subscribe_messages=True)
+            p.psubscribe(**{'{}:*'.format(SERVER_ID): redis_pubsub_handler})
+            p.run_in_thread(sleep_time=0.001, exception_handler=psubscribe_exception_handler)
+            redis_subscriber = p
+
 
 def get_conversation_name_without_location(conversation_name):
     """Returns a conversation name without its location id."""
@@ -95,6 +204,29 @@ def check_status():
     return 'Hello, cross-origin-world!'
 
 
+def count_connected_sockets():
+    # Every connected socket is in the None room of its namespace.
+    return len(socketio.server.manager.rooms.get('/', {}).get(None, ()))
+
+
+def count_hosted_rooms():
+    # Rooms of a namespace are the None room, one room per socket and the conversation rooms.
+    namespace_rooms = socketio.server.manager.rooms.get('/', {})
+    return max(len(namespace_rooms) - 1 - len(namespace_rooms.get(None, ())), 0)
+
+
+metrics.register(metrics.Gauge('socketio_connected_sockets', 'Connected Socket.IO clients.',
+                               count_connected_sockets))
+metrics.register(metrics.Gauge('socketio_rooms', 'Conversation rooms joined by connected clients.',
+                               count_hosted_rooms))
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Reports runtime metrics in the Prometheus text exposition format."""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/register', methods=['POST'])
 def register_token():
     """Registers a JWT token after checking authorization header."""
@@ -115,32 +247,88 @@ def register_app_token():
     return jsonify({'token': token})
 
 
+def acquire_dialogflow_quota(project, location, path):
+    """Returns whether a Dialogflow request can be sent within the rate limits,
+    waiting for them if needed.
+
+    Requests are interactive unless sent with the header 'X-Request-Priority: background'.
+    """
+    if dialogflow_rate_limiter is None:
+        return True
+    family = get_method_family(path)
+    if request.headers.get('X-Request-Priority', '').lower() == BACKGROUND:
+        priority, max_wait = BACKGROUND, config.DIALOGFLOW_RATE_LIMIT_BACKGROUND_MAX_WAIT
+    else:
+        priority, max_wait = INTERACTIVE, config.DIALOGFLOW_RATE_LIMIT_MAX_WAIT
+    waited = dialogflow_rate_limiter.acquire(
+        '{0}/{1}'.format(project, location), family, priority, max_wait)
+    if waited is None:
+        logging.warning('Rate limit exceeded for {0} {1} request: {2}'.format(priority, family, path))
+        rate_limit_rejected.inc()
+        return False
+    rate_limit_wait.observe(waited, family, priority)
+    return True
+
+
+def get_server_timeout():
+    """Returns the deadline in seconds requested with the 'X-Server-Timeout' header, or None.
+
+    Raises:
+        ValueError: the header is not a positive number.
+    """
+    value = request.headers.get('X-Server-Timeout')
+    if value is None:
+        return None
+    timeout = float(value)
+    if not timeout > 0:
+        raise ValueError('X-Server-Timeout must be positive: {}'.format(value))
+    return timeout
+
+
 def call_dialogflow(version, project, location, tail):
     """Forwards valid request to dialogflow and return its responese."""
     logging.info(
         'Called Dialogflow for request path: {}'.format(request.full_path))
-    if request.method == 'GET':
-        response = dialogflow.get_dialogflow(location, request.full_path)
-        logging.info('get_dialogflow response: {0}, {1}, {2}'.format(
-            gzip.decompress(response.raw.data), response.status_code, response.headers))
-        return response.raw.data, response.status_code, response.headers.items()
-    elif request.method == 'POST':
-        # Handles projects.conversations.complete, whose request body should be empty.
-        response = None
-        if request.path.endswith(':complete'):
-            response = dialogflow.post_dialogflow(location, request.full_path)
+    start = time.monotonic()
+    try:
+        timeout = get_server_timeout()
+    except ValueError:
+        return make_response('Bad request', 400)
+    if not acquire_dialogflow_quota(project, location, request.path):
+        return make_response('Too many requests', 429, {'Retry-After': '1'})
+    if timeout is not None:
+        # The time spent waiting for the rate limit counts against the deadline.
+        timeout -= time.monotonic() - start
+        if timeout <= 0:
+            return make_response('Deadline exceeded', 504)
+    route = request.url_rule.rule
+    try:
+        if request.method == 'GET':
+            with upstream_latency.time(route, request.method):
+                response = dialogflow.get_dialogflow(location, request.full_path, timeout=timeout)
+            logging.info('get_dialogflow response: {0}, {1}, {2}'.format(
+                gzip.decompress(response.raw.data), response.status_code, response.headers))
+        elif request.method == 'POST':
+            # Handles projects.conversations.complete, whose request body should be empty.
+            response = None
+            with upstream_latency.time(route, request.method):
+                if request.path.endswith(':complete'):
+                    response = dialogflow.post_dialogflow(location, request.full_path, timeout=timeout)
+                else:
+                    response = dialogflow.post_dialogflow(
+                        location, request.full_path, request.get_json(), timeout=timeout)
+            logging.info('post_dialogflow response: {0}, {1}, {2}'.format(
+                response.raw.data, response.status_code, response.headers))
         else:
-            response = dialogflow.post_dialogflow(
-                location, request.full_path, request.get_json())
-        logging.info('post_dialogflow response: {0}, {1}, {2}'.format(
-            response.raw.data, response.status_code, response.headers))
-        return response.raw.data, response.status_code, response.headers.items()
-    else:
-        response = dialogflow.patch_dialogflow(
-            location, request.full_path, request.get_json())
-        logging.info('patch_dialogflow response: {0}, {1}, {2}'.format(
-            response.raw.data, response.status_code, response.headers))
-        return response.raw.data, response.status_code, response.headers.items()
+            with upstream_latency.time(route, request.method):
+                response = dialogflow.patch_dialogflow(
+                    location, request.full_path, request.get_json(), timeout=timeout)
+            logging.info('patch_dialogflow response: {0}, {1}, {2}'.format(
+                response.raw.data, response.status_code, response.headers))
+    except dialogflow.DeadlineExceeded:
+        logging.warning('Deadline exceeded for request path: {}'.format(request.full_path))
+        return make_response('Deadline exceeded', 504)
+    return response.raw.data, response.status_code, response.headers.items()
 
 # projects.locations.conversations.create
 @app.route('/<version>/projects/<project>/locations/<location>/conversations', methods=['POST'])
@@ -184,6 +372,112 @@ def call_dialogflow_with_tail(version, project, location, tail):
     return call_dialogflow(version, project, location, tail)
 
 
+
+def match_proxy_path(method, path):
+    """Returns the URL rule, and its arguments such as project and location, of a
+    path served by the proxy APIs.
+
+    Raises:
+        HTTPException: the method and path don't match a proxied Dialogflow API.
+    """
+    adapter = app.url_map.bind('localhost')
+    rule, view_args = adapter.match(urlsplit(path).path, method=method, return_rule=True)
+    if rule.endpoint not in ('call_dialogflow_with_tail', 'call_dialogflow_without_tail'):
+        raise NotFound()
+    return rule.rule, view_args
+
+
+def decode_dialogflow_body(response):
+    """Returns the JSON object, or the text, of a Dialogflow response body."""
+    data = response.raw.data
+    if response.headers.get('Content-Encoding') == 'gzip':
+        data = gzip.decompress(data)
+    try:
+        return json.loads(data)
+    except ValueError:
+        return data.decode('utf-8', errors='replace')
+
+
+@app.route('/batch', methods=['POST'])
+@token_required
+def call_dialogflow_batch():
+    """Sends several proxied Dialogflow requests concurrently.
+
+    The JWT is validated once for the batch. Each sub-request gets its own status
+    and body, so some of them can fail while the others succeed.
+    """
+    body = request.get_json(silent=True) or {}
+    sub_requests = body.get('requests')
+    if not isinstance(sub_requests, list) or not 0 < len(sub_requests) <= config.BATCH_MAX_REQUESTS:
+        return make_response('Bad request', 400)
+    try:
+        timeout = min(float(body.get('timeout', config.BATCH_TIMEOUT)), config.BATCH_TIMEOUT)
+        timeout = min(timeout, get_server_timeout() or timeout)
+    except (TypeError, ValueError):
+        return make_response('Bad request', 400)
+    if not timeout > 0:
+        return make_response('Bad request', 400)
+
+    results = [None] * len(sub_requests)
+    upstream_requests = []
+    upstream_indexes = []
+    # Labels of upstream_latency for each upstream request.
+    upstream_routes = []
+    for index, sub_request in enumerate(sub_requests):
+        if not isinstance(sub_request, dict):
+            results[index] = {'status': 400, 'error': 'Bad request'}
+            continue
+        method = str(sub_request.get('method', 'GET')).upper()
+        path = str(sub_request.get('path', ''))
+        try:
+            route, view_args = match_proxy_path(method, path)
+        except HTTPException as e:
+            results[index] = {'status': e.code, 'error': e.name}
+            continue
+        location = view_args['location']
+        if not acquire_dialogflow_quota(view_args['project'], location, urlsplit(path).path):
+            results[index] = {'status': 429, 'error': 'Too many requests'}
+            continue
+        # Handles projects.conversations.complete, whose request body should be empty.
+        data = None if method == 'GET' or urlsplit(path).path.endswith(':complete') else sub_request.get('body')
+        upstream_requests.append((method, location, path, data))
+        upstream_indexes.append(index)
+        upstream_routes.append((route, method))
+
+    logging.info('Called Dialogflow for a batch of {} requests'.format(len(upstream_requests)))
+    client = dialogflow.get_async_client()
+    responses = client.submit(client.request_all(
+        upstream_requests, timeout,
+        lambda index, seconds: upstream_latency.observe(seconds, *upstream_routes[index]))).result()
+    for index, response in zip(upstream_indexes, responses):
+        if isinstance(response, asyncio.TimeoutError):
+            results[index] = {'status': 504, 'error': 'Deadline exceeded'}
+        elif isinstance(response, Exception):
+            logging.warning('Batch request {0} failed: {1}'.format(sub_requests[index].get('path'), response))
+            results[index] = {'status': 502, 'error': 'Bad gateway'}
+        else:
+            results[index] = {'status': response.status_code, 'body': decode_dialogflow_body(response)}
+    return jsonify({'responses': results})
+
+
+def get_hashed_key(conversation_integration_key):
+    """Returns the Redis key storing the conversation name of an integration key."""
+    return hashlib.sha256(conversation_integration_key.encode('utf-8')).hexdigest()
+
+
+def get_conversation_name_ttl(data):
+    """Returns the expiry in seconds requested by a request body, or the default one.
+
+    Raises:
+        ValueError: the requested expiry is not a non-negative integer.
+    """
+    ttl = data.get('ttl', config.CONVERSATION_NAME_TTL)
+    if isinstance(ttl, bool) or not isinstance(ttl, int) or ttl < 0:
+        raise ValueError('ttl must be a non-negative integer.')
+    # 0 keeps the key without expiry.
+    return ttl or None
+
+
 @app.route('/conversation-name', methods=['POST'])
 @token_required
 def set_conversation_name():
@@ -193,11 +487,15 @@ def set_conversation_name():
     conversationIntegrationKey is a phone number.
     """
     conversation_integration_key = request.json.get('conversationIntegrationKey', '')
-    hashed_key = hashlib.sha256(conversation_integration_key.encode('utf-8')).hexdigest()
+    hashed_key = get_hashed_key(conversation_integration_key)
     conversation_name = request.json.get('conversationName', '')
+    try:
+        ttl = get_conversation_name_ttl(request.json)
+    except ValueError:
+        return make_response('Bad request', 400)
     logging.info(
-        '/conversation-name - redis: SET %s %s', conversation_integration_key, conversation_name)
-    result = redis_client.set(hashed_key, conversation_name)
+        '/conversation-name - redis: SET %s %s EX %s', conversation_integration_key, conversation_name, ttl)
+    result = redis_client.set(hashed_key, conversation_name, ex=ttl)
     if not (conversation_integration_key and conversation_name and result):
         return make_response('Bad request', 400)
     else:
@@ -210,7 +508,7 @@ def get_conversation_name():
     using a conversationIntegrationKey.
     """
     conversation_integration_key = str(request.args.get('conversationIntegrationKey'))
-    hashed_key = hashlib.sha256(conversation_integration_key.encode('utf-8')).hexdigest()
+    hashed_key = get_hashed_key(conversation_integration_key)
     conversation_name = redis_client.get(hashed_key)
     logging.info(
         '/conversation-name - redis: GET %s -> %s', conversation_integration_key, conversation_name)
@@ -227,7 +525,7 @@ def del_conversation_name():
     using a conversationIntegrationKey.
     """
     conversation_integration_key = str(request.args.get('conversationIntegrationKey'))
-    hashed_key = hashlib.sha256(conversation_integration_key.encode('utf-8')).hexdigest()
+    hashed_key = get_hashed_key(conversation_integration_key)
     result = redis_client.delete(hashed_key)
     logging.info(
         '/conversation-name - redis: DEL %s, result %s', conversation_integration_key, result)
@@ -239,14 +537,119 @@ def del_conversation_name():
         return make_response('Success', 200)
 
 
+def get_conversation_integration_keys():
+    """Returns the conversationIntegrationKey query parameters of a bulk request,
+    or None if there are none or too many of them.
+    """
+    conversation_integration_keys = request.args.getlist('conversationIntegrationKey')
+    if not 0 < len(conversation_integration_keys) <= config.CONVERSATION_NAME_BULK_MAX_KEYS:
+        return None
+    return conversation_integration_keys
+
+
+@app.route('/conversation-names', methods=['POST'])
+@token_required
+def set_conversation_names():
+    """Sets conversationIntegrationKey:conversationName pairs in Redis with one
+    pipelined round trip.
+    """
+    data = request.get_json(silent=True) or {}
+    conversation_names = data.get('conversationNames')
+    try:
+        ttl = get_conversation_name_ttl(data)
+    except ValueError:
+        return make_response('Bad request', 400)
+    if (not isinstance(conversation_names, dict)
+            or not 0 < len(conversation_names) <= config.CONVERSATION_NAME_BULK_MAX_KEYS
+            or not all(key and isinstance(name, str) and name for key, name in conversation_names.items())):
+        return make_response('Bad request', 400)
+    pipeline = redis_client.pipeline(transaction=False)
+    for conversation_integration_key, conversation_name in conversation_names.items():
+        pipeline.set(get_hashed_key(conversation_integration_key), conversation_name, ex=ttl)
+    pipeline.execute()
+    logging.info(
+        '/conversation-names - redis: SET %s keys EX %s', len(conversation_names), ttl)
+    return jsonify(conversation_names)
+
+
+@app.route('/conversation-names', methods=['GET'])
+@token_required
+def get_conversation_names():
+    """Gets the conversation names of several conversationIntegrationKeys with one MGET."""
+    conversation_integration_keys = get_conversation_integration_keys()
+    if conversation_integration_keys is None:
+        return make_response('Bad request', 400)
+    conversation_names = redis_client.mget(
+        [get_hashed_key(key) for key in conversation_integration_keys])
+    logging.info(
+        '/conversation-names - redis: MGET %s keys', len(conversation_integration_keys))
+    return jsonify({'conversationNames': {
+        key: str(conversation_name, encoding='utf-8') if conversation_name else ''
+        for key, conversation_name in zip(conversation_integration_keys, conversation_names)}})
+
+
+@app.route('/conversation-names', methods=['DELETE'])
+@token_required
+def del_conversation_names():
+    """Deletes the conversation names of several conversationIntegrationKeys with
+    pipelined UNLINK commands, which free memory in the background.
+    """
+    conversation_integration_keys = get_conversation_integration_keys()
+    if conversation_integration_keys is None:
+        return make_response('Bad request', 400)
+    pipeline = redis_client.pipeline(transaction=False)
+    for conversation_integration_key in conversation_integration_keys:
+        pipeline.unlink(get_hashed_key(conversation_integration_key))
+    results = pipeline.execute()
+    logging.info(
+        '/conversation-names - redis: UNLINK %s keys, %s deleted', len(conversation_integration_keys), sum(results))
+    return jsonify({'deleted': {
+        key: bool(result) for key, result in zip(conversation_integration_keys, results)}})
+
+
+@app.route('/conversation-names/stats', methods=['GET'])
+@token_required
+def get_conversation_names_stats():
+    """Reports the number of stored conversation names and the memory they use.
+
+    Keys are found with SCAN, and MEMORY USAGE is sampled on at most
+    CONVERSATION_NAME_STATS_SAMPLE keys to estimate the total size.
+    """
+    # Conversation names are stored under 64 hex characters keys, see get_hashed_key.
+    hashed_keys = [key for key in redis_client.scan_iter(match='?' * 64, count=1000)
+                   if all(c in b'0123456789abcdef' for c in key)]
+    sampled_keys = hashed_keys[:config.CONVERSATION_NAME_STATS_SAMPLE]
+    pipeline = redis_client.pipeline(transaction=False)
+    for key in sampled_keys:
+        pipeline.memory_usage(key)
+    sampled_bytes = sum(usage or 0 for usage in pipeline.execute())
+    estimated_bytes = int(sampled_bytes * len(hashed_keys) / len(sampled_keys)) if sampled_keys else 0
+    return jsonify({'keys': len(hashed_keys),
+                    'sampledKeys': len(sampled_keys),
+                    'sampledBytes': sampled_bytes,
+                    'estimatedBytes': estimated_bytes})
+
+
 @socketio.on('connect')
 def connect(auth={}):
+    """Authenticates a client with its JWT.
+
+    Clients can also ask for events to be encoded with a binary codec, such as
+    {'token': token, 'codec': 'msgpack'}. The codec in use is then sent back in a
+    'codec' event, and clients asking for an unknown codec keep receiving JSON.
+    """
     logging.info(
         'Receives connection request with sid: {0}.'.format(request.sid))
     if isinstance(auth, dict) and 'token' in auth:
         is_valid, log_info = check_jwt(auth['token'])
         logging.info(log_info)
         if is_valid:
+            start_redis_subscriber()
+            if 'codec' in auth:
+                codec = auth['codec'] if auth['codec'] in payload_codec.CODECS else 'json'
+                if codec != 'json':
+                    session['codec'] = codec
+                emit('codec', codec)
             return True
     socketio.emit('unauthenticated')
     raise ConnectionRefusedError('authentication failed')
@@ -259,7 +662,7 @@ def disconnect(reason):
     # Delete mapping for conversation_name and SERVER_ID.
     if len(room_list) > 1:
         room_list.pop(0)  # the first one in room list is request.sid
-        redis_client.delete(*room_list)
+        redis_client.delete(*[payload_codec.get_room(room) for room in room_list])
 
 
 @app.errorhandler(500)
@@ -272,17 +675,52 @@ def server_error(e):
     """.format(e), 500
 
 
+def get_replay_events(conversation_name):
+    """Returns the recent events of a conversation kept by Cloud Pub/Sub Interceptor,
+    oldest first, within REPLAY_MAX_BYTES.
+    """
+    messages = redis_client.lrange('replay:{}'.format(conversation_name), 0, -1)
+    replay_bytes = 0
+    first_index = len(messages)
+    # Keep the most recent events that fit in the size limit.
+    while first_index > 0 and replay_bytes + len(messages[first_index - 1]) <= config.REPLAY_MAX_BYTES:
+        first_index -= 1
+        replay_bytes += len(messages[first_index])
+    return [json.loads(message) for message in messages[first_index:]]
+
+
 @socketio.on('join-conversation')
 def on_join(message):
-    """Joins a room specified by its conversation name."""
+    """Joins a room specified by its conversation name.
+
+    The message is either the conversation name, or an object
+    {'conversationName': conversation_name, 'replay': True} to also receive the
+    recent events of the conversation as one 'replay-events' event.
+    """
     logging.info('Received event: join-conversation: {}'.format(message))
+    replay = False
+    if isinstance(message, dict):
+        replay = bool(message.get('replay'))
+        message = message.get('conversationName', '')
     # Remove location id from the conversation name.
     conversation_name = get_conversation_name_without_location(message)
-    join_room(conversation_name)
+    codec = session.get('codec')
+    join_room(payload_codec.get_codec_room(conversation_name, codec) if codec else conversation_name)
     # Update mapping for conversation_name and SERVER_ID.
     redis_client.set(conversation_name, SERVER_ID)
+    # Wake the Audiohook service waiting for the agent before resuming the audio.
+    try:
+        redis_client.publish('joined:{}'.format(conversation_name), SERVER_ID)
+    except redis.exceptions.RedisError as e:
+        logging.warning('Failed to publish join-conversation for {0}: {1}'.format(conversation_name, e))
     logging.info(
             'join-conversation for: {}'.format(conversation_name))
+    if replay:
+        replay_events = get_replay_events(conversation_name)
+        logging.info('Replay {0} events for: {1}'.format(len(replay_events), conversation_name))
+        if codec:
+            replay_events = payload_codec.encode(replay_events, config.CODEC_COMPRESS_THRESHOLD)
+        emit('replay-events', replay_events)
     return True, conversation_name
 
 
@@ -292,7 +730,8 @@ def on_leave(message):
     logging.info('Received event: leave-conversation: {}'.format(message))
     # Remove location id from the conversation name.
     conversation_name = get_conversation_name_without_location(message)
-    leave_room(conversation_name)
+    codec = session.get('codec')
+    leave_room(payload_codec.get_codec_room(conversation_name, codec) if codec else conversation_name)
     # Delete mapping for conversation_name and SERVER_ID.
     redis_client.delete(conversation_name)
     logging.info(
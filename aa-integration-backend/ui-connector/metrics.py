@@ -0,0 +1,145 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+from contextlib import contextmanager
+import threading
+import time
+
+# Metrics reported by this instance.
+REGISTRY = []
+
+
+def register(metric):
+    """Adds a metric to the registry and returns it."""
+    REGISTRY.append(metric)
+    return metric
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels))
+
+
+def render():
+    """Returns the registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP {0} {1}'.format(metric.name, metric.description))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+        for suffix, labels, value in metric.samples():
+            lines.append('{0}{1}{2} {3}'.format(metric.name, suffix, format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    """A value that only goes up, such as a number of events."""
+
+    type = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self):
+        yield '', (), self._value
+
+
+class Gauge:
+    """A value read from a function when it is reported, such as a queue depth."""
+
+    type = 'gauge'
+
+    def __init__(self, name, description, function):
+        self.name = name
+        self.description = description
+        self._function = function
+
+    @property
+    def value(self):
+        return self._function()
+
+    def samples(self):
+        yield '', (), self.value
+
+
+class Histogram:
+    """Counts observed values, such as latencies in seconds, in cumulative buckets.
+
+    Observing a value only takes a lock to bump a bucket, so it is cheap enough
+    for every request and every emitted event.
+    """
+
+    type = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            name: the metric name.
+            description: the help text of the metric.
+            labels: the label names, whose values are passed to observe in order.
+            buckets: the sorted upper bounds of the buckets.
+        """
+        self.name = name
+        self.description = description
+        self._labels = tuple(labels)
+        self._buckets = tuple(buckets)
+        # Label values to [counts per bucket and +Inf, sum].
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            child = self._children.get(label_values)
+            if child is None:
+                child = self._children[label_values] = [[0] * (len(self._buckets) + 1), 0]
+            child[0][index] += 1
+            child[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes the seconds spent in the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self._lock:
+            children = [(label_values, list(counts), total)
+                        for label_values, (counts, total) in self._children.items()]
+        for label_values, counts, total in children:
+            labels = tuple(zip(self._labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self._buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '_bucket', labels + (('le', bound),), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
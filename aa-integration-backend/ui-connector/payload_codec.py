@@ -0,0 +1,72 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import zlib
+
+import msgpack
+
+# Binary codec negotiated by Socket.IO clients when connecting.
+MSGPACK = 'msgpack'
+CODECS = (MSGPACK,)
+# First byte of an encoded payload, telling whether the rest is deflate-compressed.
+UNCOMPRESSED = b'\x00'
+DEFLATED = b'\x01'
+
+
+def get_codec_room(room, codec):
+    """Returns the room joined instead of `room` by clients using a codec."""
+    return '{0}#{1}'.format(room, codec)
+
+
+def get_room(codec_room):
+    """Returns the room of a codec room, or the room itself."""
+    room, _, codec = codec_room.rpartition('#')
+    return room if codec in CODECS else codec_room
+
+
+def unwrap_data(msg_object):
+    """Returns an event with its `data` JSON string decoded, so it is not encoded twice."""
+    data = msg_object.get('data')
+    if not isinstance(data, str):
+        return msg_object
+    try:
+        return dict(msg_object, data=json.loads(data))
+    except ValueError:
+        return msg_object
+
+
+def encode(payload, compress_threshold):
+    """Encodes an event, or a list of events, with msgpack.
+
+    Payloads larger than compress_threshold bytes are compressed with deflate.
+    The first byte of the result is UNCOMPRESSED or DEFLATED.
+    """
+    if isinstance(payload, list):
+        payload = [unwrap_data(msg_object) for msg_object in payload]
+    else:
+        payload = unwrap_data(payload)
+    packed = msgpack.packb(payload)
+    if len(packed) > compress_threshold:
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        return DEFLATED + compressor.compress(packed) + compressor.flush()
+    return UNCOMPRESSED + packed
+
+
+def decode(encoded):
+    """Decodes a payload made by encode."""
+    packed = encoded[1:]
+    if encoded[:1] == DEFLATED:
+        packed = zlib.decompress(packed, wbits=-zlib.MAX_WBITS)
+    return msgpack.unpackb(packed)
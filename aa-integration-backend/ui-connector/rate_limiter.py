@@ -0,0 +1,126 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+
+import redis
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# Refills a token bucket stored in a Redis hash and takes `cost` tokens from it when
+# at least `reserve` tokens are left afterwards. Returns 0 when the tokens are taken,
+# otherwise the milliseconds to wait until they would be available.
+# KEYS[1]: bucket key. ARGV: rate in tokens per second, burst, reserve, now in milliseconds, cost.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local cost = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(bucket[1]) or burst
+local timestamp = tonumber(bucket[2]) or now
+if now > timestamp then
+  tokens = math.min(burst, tokens + (now - timestamp) * rate / 1000)
+  timestamp = now
+end
+local wait = 0
+if tokens - cost >= reserve then
+  tokens = tokens - cost
+else
+  wait = math.ceil((cost + reserve - tokens) * 1000 / rate)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'timestamp', timestamp)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+def get_method_family(path):
+    """Returns the quota family of a Dialogflow request path.
+
+    Dialogflow counts AnalyzeContent and suggestion requests against their own
+    quotas, and most other requests against a shared one.
+    """
+    path = path.split('?', 1)[0]
+    if path.endswith((':analyzeContent', ':streamingAnalyzeContent')):
+        return 'analyze-content'
+    if '/suggestions' in path or path.endswith((':suggest', ':generate', ':searchKnowledge')):
+        return 'suggestion'
+    return 'default'
+
+
+def parse_rate_limits(value):
+    """Parses limits such as 'analyze-content=10,default=20' into a dict of
+    requests per second by method family.
+    """
+    limits = {}
+    for item in value.split(','):
+        if item.strip():
+            family, _, rate = item.partition('=')
+            limits[family.strip()] = float(rate)
+    return limits
+
+
+class RateLimiter:
+    """Token buckets shared through Redis by every instance calling Dialogflow.
+
+    There is one bucket per scope, such as a project and location, and method
+    family. Interactive requests can take every token, while background requests
+    leave a reserve of the burst to interactive ones and wait longer for tokens.
+    The limiter fails open when Redis is unavailable.
+    """
+
+    def __init__(self, redis_client, limits, burst_seconds=1, background_reserve=0.2):
+        """
+        Args:
+            redis_client: the Redis client storing the buckets.
+            limits: requests per second by method family. The 'default' family
+                applies to families not listed. Families without a limit are not limited.
+            burst_seconds: seconds of requests that can be sent at once after being idle.
+            background_reserve: fraction of the burst that background requests leave to
+                interactive ones.
+        """
+        self._limits = limits
+        self._burst_seconds = burst_seconds
+        self._background_reserve = background_reserve
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self, scope, family, priority=INTERACTIVE, max_wait=0):
+        """Takes a token for a request, waiting up to max_wait seconds for one.
+
+        Returns:
+            The seconds waited, or None if no token was available in time.
+        """
+        rate = self._limits.get(family, self._limits.get('default'))
+        if not rate:
+            return 0
+        burst = max(rate * self._burst_seconds, 1)
+        reserve = burst * self._background_reserve if priority == BACKGROUND else 0
+        key = 'rate-limit:{0}:{1}'.format(scope, family)
+        waited = 0
+        while True:
+            try:
+                wait = self._script(keys=[key], args=[rate, burst, reserve, int(time.time() * 1000), 1]) / 1000
+            except redis.exceptions.RedisError as e:
+                logging.warning('Rate limiter is unavailable, letting the request through: {}'.format(e))
+                return waited
+            if wait == 0:
+                return waited
+            if waited + wait > max_wait:
+                return None
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,83 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import threading
+import time
+
+import cachetools
+import redis
+
+
+class TokenCache:
+    """Caches token verification results until a per-entry expiry time.
+
+    Entries are keyed by a SHA-256 digest of the token, so raw tokens are never
+    kept in memory or in Redis. Results are stored in a bounded in-process LRU
+    and, if a Redis client is set, shared with the other instances via Redis.
+    """
+
+    def __init__(self, name, maxsize, redis_client=None):
+        self.name = name
+        self.redis_client = redis_client
+        self._cache = cachetools.TLRUCache(
+            maxsize, ttu=lambda key, value, now: value[1], timer=time.time)
+        # cachetools caches are not thread-safe.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get_redis_key(self, key):
+        return 'token-cache:{0}:{1}'.format(self.name, key)
+
+    def get(self, token):
+        """Returns the cached result for a token, or None if it is unknown or expired."""
+        key = self.digest(token)
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if self.redis_client is None:
+            return None
+        try:
+            value = self.redis_client.get(self.get_redis_key(key))
+        except redis.exceptions.RedisError as e:
+            logging.warning('Failed to read {0} token cache from Redis: {1}'.format(self.name, e))
+            return None
+        if value is None:
+            return None
+        result, expires_at = value.decode('utf-8').split(':')
+        with self._lock:
+            self._cache[key] = (result == '1', float(expires_at))
+        return result == '1'
+
+    def set(self, token, result, expires_at):
+        """Caches a verification result until expires_at, a POSIX timestamp."""
+        ttl = expires_at - time.time()
+        if ttl <= 0 or self._cache.maxsize <= 0:
+            return
+        key = self.digest(token)
+        with self._lock:
+            self._cache[key] = (result, expires_at)
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.set(self.get_redis_key(key),
+                                  '{0}:{1}'.format(int(result), expires_at),
+                                  px=int(ttl * 1000))
+        except redis.exceptions.RedisError as e:
+            logging.warning('Failed to write {0} token cache to Redis: {1}'.format(self.name, e))
@@ -12,12 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import unittest
 import json
 import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, call
 
+import fakeredis
+from google.auth.credentials import AnonymousCredentials
+
+import auth
+import hedging
 import main
+import payload_codec
 from main import socketio
 from main import app
 from main import dialogflow
@@ -48,6 +58,25 @@ class FakeRawHTTPResponse:
         self.data = data
 
 
+class FakeDialogflowHandler(BaseHTTPRequestHandler):
+    """Local HTTP handler answering with a gzip-encoded body."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.requests.append((self.path, self.headers.get('Authorization'),
+                                     self.rfile.read(int(self.headers['Content-Length']))))
+        body = gzip.compress(b'{"name": "fake_conversation"}')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
 class TestSocketIO(unittest.TestCase):
     """Unit tests for APIs related to SocketIO events."""
 
@@ -83,6 +112,16 @@ class TestSocketIO(unittest.TestCase):
         self.assertEqual(received[0]['name'], 'unauthenticated')  # event name
         self.assertEqual(received[0]['args'], [])
 
+    @patch('main.start_redis_subscriber')
+    def test_connect_starts_redis_subscriber(self, MockStartRedisSubscriber):
+        """Subscribes to Redis once a client is authenticated."""
+        client = socketio.test_client(app, auth={'token': 'invalid'})
+        MockStartRedisSubscriber.assert_not_called()
+        client = socketio.test_client(app, auth={'token': self.valid_jwt})
+        self.assertTrue(client.is_connected())
+        MockStartRedisSubscriber.assert_called_once_with()
+        client.disconnect()
+
     def test_disconnect(self):
         """Disconnects websocket connection."""
         client = socketio.test_client(app, auth={'token': self.valid_jwt})
@@ -127,6 +166,63 @@ class TestSocketIO(unittest.TestCase):
         MockDelete.assert_has_calls(
             [call(conversation2, get_conversation_name_without_location('conversation_002'))])
 
+    @patch('main.redis_client.publish')
+    @patch('main.redis_client.lrange')
+    @patch('main.redis_client.set')
+    @patch('main.redis_client.delete')
+    def test_join_conversation_replay(self, MockDelete, MockSet, MockLrange, MockPublish):
+        """Sends recent events of a conversation to a client joining it late."""
+        conversation = get_conversation_name('conversation_001')
+        conversation_without_location = get_conversation_name_without_location('conversation_001')
+        events = [{'conversation_name': conversation_without_location, 'data': 'x' * 100, 'message_id': str(i)}
+                  for i in range(3)]
+        MockLrange.return_value = [json.dumps(event).encode('utf-8') for event in events]
+        client = socketio.test_client(app, auth={'token': self.valid_jwt})
+        client.get_received()
+        with patch('main.config.REPLAY_MAX_BYTES', 2 * len(MockLrange.return_value[0])):
+            ack, data = client.emit(
+                'join-conversation', {'conversationName': conversation, 'replay': True}, callback=True)
+        self.assertTrue(ack)
+        self.assertEqual(data, conversation_without_location)
+        MockSet.assert_called_once_with(conversation_without_location, main.SERVER_ID)
+        MockPublish.assert_called_once_with('joined:{}'.format(conversation_without_location), main.SERVER_ID)
+        MockLrange.assert_called_once_with('replay:{}'.format(conversation_without_location), 0, -1)
+        received = client.get_received()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['name'], 'replay-events')
+        self.assertEqual(received[0]['args'], [events[1:]])
+        client.disconnect()
+
+    @patch('main.redis_client.set')
+    @patch('main.redis_client.delete')
+    def test_codec(self, MockDelete, MockSet):
+        """Sends events encoded with the codec negotiated by each client."""
+        conversation = get_conversation_name_without_location('conversation_001')
+        json_client = socketio.test_client(app, auth={'token': self.valid_jwt})
+        msgpack_client = socketio.test_client(app, auth={'token': self.valid_jwt, 'codec': 'msgpack'})
+        unknown_client = socketio.test_client(app, auth={'token': self.valid_jwt, 'codec': 'unknown'})
+        self.assertEqual(msgpack_client.get_received()[0]['args'], ['msgpack'])
+        self.assertEqual(unknown_client.get_received()[0]['args'], ['json'])
+        for client in (json_client, msgpack_client, unknown_client):
+            client.get_received()
+            client.emit('join-conversation', conversation)
+        small = {'conversation_name': conversation, 'data': json.dumps({'text': 'hi'}), 'data_type': 'fake-event'}
+        large = dict(small, data=json.dumps({'text': '"quoted" ' * 200}))
+        for msg_object in (small, large):
+            main.emit_to_room(msg_object['data_type'], msg_object, to=conversation)
+        for client in (json_client, unknown_client):
+            self.assertEqual([event['args'][0] for event in client.get_received()], [small, large])
+        encoded = [event['args'][0] for event in msgpack_client.get_received()]
+        self.assertEqual(encoded[0][:1], payload_codec.UNCOMPRESSED)
+        self.assertEqual(encoded[1][:1], payload_codec.DEFLATED)
+        self.assertLess(len(encoded[1]), len(json.dumps(large)) / 10)
+        self.assertEqual([payload_codec.decode(payload) for payload in encoded],
+                         [dict(small, data={'text': 'hi'}), dict(large, data={'text': '"quoted" ' * 200})])
+        msgpack_client.disconnect()
+        MockDelete.assert_called_with(conversation)
+        json_client.disconnect()
+        unknown_client.disconnect()
+
     def test_redis_pubsub_handler(self):
         """Handles Redis Pub/Sub messages."""
         conversation1 = get_conversation_name('conversation_001')
@@ -307,6 +403,31 @@ class TestRestAPI(unittest.TestCase):
     def tearDown(self):
         pass
 
+    def test_metrics(self):
+        """Reports upstream latency and Socket.IO metrics."""
+        client = app.test_client()
+        socket_client = socketio.test_client(app, auth={'token': self.valid_jwt})
+        get_conversation_response = self.FakeGetConversationResponse(
+            self.conversation_profile_name, self.conversation_name, self.header)
+        with patch('dialogflow.get_dialogflow', return_value=(get_conversation_response)):
+            client.get(
+                '/v2beta1/projects/{0}/locations/{1}/conversations/{2}'.format(
+                    _PROJECT_ID, _LOCATION, self.conversation_id),
+                headers={'Authorization': self.valid_jwt})
+        response = client.get('/metrics')
+        socket_client.disconnect()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        samples = dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines()
+                       if not line.startswith('#'))
+        # Other tests may leave clients connected.
+        self.assertGreaterEqual(int(samples['socketio_connected_sockets']), 1)
+        self.assertIn('socketio_rooms', samples)
+        self.assertGreaterEqual(int(samples[
+            'dialogflow_upstream_seconds_count{route="/<version>/projects/<project>/locations/<location>'
+            '/conversations/<path:tail>",method="GET"}']), 1)
+        self.assertGreaterEqual(int(samples['auth_check_seconds_count{check="check_jwt"}']), 1)
+
     def test_register_JWT_auth_unset(self):
         client = app.test_client()
         response = client.post(
@@ -419,6 +540,117 @@ class TestRestAPI(unittest.TestCase):
         self.assertIn('endTime', json_data)
         self.assertIn('conversationStage', json_data)
 
+    def test_dialogflow_batch(self):
+        """Sends a batch of Dialogflow requests with partial failures."""
+        client = app.test_client()
+        participant_path = '/v2beta1/projects/{0}/locations/{1}/conversations/{2}/participants/fake_participant'.format(
+            _PROJECT_ID, _LOCATION, self.conversation_id)
+        get_conversation_response = self.FakeGetConversationResponse(
+            self.conversation_profile_name, self.conversation_name, self.header)
+
+        async def fake_request(method, location, path, data=None, timeout=None):
+            if path.endswith('suggestSmartReplies'):
+                await asyncio.sleep(1)
+            elif path.endswith('suggestFaqAnswers'):
+                raise ConnectionError('fake connection error')
+            return get_conversation_response
+
+        with patch('dialogflow.AsyncDialogflowClient.request', side_effect=fake_request) as MockRequest, \
+                patch('main.upstream_latency.observe') as MockObserve:
+            response = client.post('/batch', json={
+                'requests': [
+                    {'method': 'POST', 'path': participant_path + '/suggestions:suggestArticles', 'body': {'contextSize': 3}},
+                    {'method': 'POST', 'path': participant_path + '/suggestions:suggestFaqAnswers', 'body': {}},
+                    {'method': 'POST', 'path': participant_path + '/suggestions:suggestSmartReplies', 'body': {}},
+                    {'method': 'DELETE', 'path': participant_path},
+                    {'method': 'GET', 'path': '/status'},
+                ],
+                'timeout': 0.2}, headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['responses']
+        self.assertEqual(results[0], {'status': 200, 'body': self.get_json_object(get_conversation_response.raw.data)})
+        self.assertEqual(results[1], {'status': 502, 'error': 'Bad gateway'})
+        self.assertEqual(results[2], {'status': 504, 'error': 'Deadline exceeded'})
+        self.assertEqual(results[3], {'status': 405, 'error': 'Method Not Allowed'})
+        self.assertEqual(results[4], {'status': 404, 'error': 'Not Found'})
+        self.assertEqual(MockRequest.call_count, 3)
+        MockRequest.assert_any_call(
+            'POST', _LOCATION, participant_path + '/suggestions:suggestArticles', {'contextSize': 3})
+        # Each sub-request sent upstream is observed, including the one past the deadline.
+        self.assertEqual(MockObserve.call_count, 3)
+        for observe_call in MockObserve.call_args_list:
+            self.assertEqual(observe_call.args[1:], ('/<version>/projects/<project>/locations/<location>/conversations/<path:tail>', 'POST'))
+
+    def test_dialogflow_batch_failure(self):
+        """Rejects batches without valid JWT or requests."""
+        client = app.test_client()
+        response = client.post('/batch', json={'requests': []})
+        self.assertEqual(response.status_code, 401)
+        response = client.post('/batch', json={'requests': []}, headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.status_code, 400)
+        for timeout in (0, -1, 'soon'):
+            response = client.post('/batch', json={'requests': [{'path': '/status'}], 'timeout': timeout},
+                                   headers={'Authorization': self.valid_jwt})
+            self.assertEqual(response.status_code, 400)
+
+    @patch('main.redis_client.set', return_value=True)
+    def test_set_conversation_name_ttl(self, MockSet):
+        """Sets a conversation name with an expiry."""
+        client = app.test_client()
+        response = client.post('/conversation-name', json={
+            'conversationIntegrationKey': 'fake_key', 'conversationName': self.conversation_name, 'ttl': 60},
+            headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.get_json(), {'fake_key': self.conversation_name})
+        MockSet.assert_called_once_with(main.get_hashed_key('fake_key'), self.conversation_name, ex=60)
+        response = client.post('/conversation-name', json={
+            'conversationIntegrationKey': 'fake_key', 'conversationName': self.conversation_name, 'ttl': -1},
+            headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('main.redis_client.pipeline')
+    @patch('main.redis_client.mget')
+    def test_bulk_conversation_names(self, MockMget, MockPipeline):
+        """Sets, gets and deletes conversation names in bulk."""
+        client = app.test_client()
+        conversation_names = {'fake_key_1': self.conversation_name, 'fake_key_2': self.conversation_name}
+        response = client.post('/conversation-names', json={'conversationNames': conversation_names},
+                               headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.get_json(), conversation_names)
+        MockPipeline.return_value.set.assert_has_calls([
+            call(main.get_hashed_key('fake_key_1'), self.conversation_name, ex=None),
+            call(main.get_hashed_key('fake_key_2'), self.conversation_name, ex=None)])
+        self.assertEqual(MockPipeline.return_value.execute.call_count, 1)
+
+        MockMget.return_value = [self.conversation_name.encode('utf-8'), None]
+        response = client.get('/conversation-names?conversationIntegrationKey=fake_key_1&conversationIntegrationKey=fake_key_3',
+                              headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.get_json(), {'conversationNames': {
+            'fake_key_1': self.conversation_name, 'fake_key_3': ''}})
+        MockMget.assert_called_once_with([main.get_hashed_key('fake_key_1'), main.get_hashed_key('fake_key_3')])
+
+        MockPipeline.return_value.execute.return_value = [1, 0]
+        response = client.delete('/conversation-names?conversationIntegrationKey=fake_key_1&conversationIntegrationKey=fake_key_3',
+                                 headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.get_json(), {'deleted': {'fake_key_1': True, 'fake_key_3': False}})
+        MockPipeline.return_value.unlink.assert_has_calls([
+            call(main.get_hashed_key('fake_key_1')), call(main.get_hashed_key('fake_key_3'))])
+
+        response = client.get('/conversation-names', headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('main.redis_client.pipeline')
+    @patch('main.redis_client.scan_iter')
+    def test_conversation_names_stats(self, MockScanIter, MockPipeline):
+        """Reports the memory used by conversation names."""
+        client = app.test_client()
+        MockScanIter.return_value = [main.get_hashed_key('fake_key_1').encode('utf-8'),
+                                     main.get_hashed_key('fake_key_2').encode('utf-8'),
+                                     b'x' * 64]
+        MockPipeline.return_value.execute.return_value = [100, 120]
+        response = client.get('/conversation-names/stats', headers={'Authorization': self.valid_jwt})
+        self.assertEqual(response.get_json(), {
+            'keys': 2, 'sampledKeys': 2, 'sampledBytes': 220, 'estimatedBytes': 220})
+
     def test_dialogflow_unavailable(self):
         """Tries to send unavailable Dialogflow requests."""
         client = app.test_client()
@@ -432,5 +664,335 @@ class TestRestAPI(unittest.TestCase):
         self.assertEqual(response.headers['Content-Length'], '232')
 
 
+class TestEmitScheduler(unittest.TestCase):
+    """Unit tests for coalescing events emitted to a room."""
+
+    @staticmethod
+    def get_recognition_event(role, transcript, is_final):
+        return {'conversation_name': get_conversation_name_without_location('conversation_001'),
+                'data': json.dumps({'type': 'NEW_RECOGNITION_RESULT',
+                                    'newRecognitionResult': {'transcript': transcript, 'isFinal': is_final}}),
+                'data_type': 'new-recognition-result-notification-event',
+                'participant_role': role}
+
+    def test_coalesce_events(self):
+        """Emits the events of a window as one frame without superseded interim results."""
+        emitted = []
+        done = threading.Event()
+
+        def fake_emit(event, data, to):
+            emitted.append((event, data, to))
+            done.set()
+
+        scheduler = main.EmitScheduler(fake_emit, 0.05)
+        room = get_conversation_name_without_location('conversation_001')
+        lifecycle_event = {'data': '{}', 'data_type': 'conversation-lifecycle-event'}
+        events = [self.get_recognition_event('END_USER', 'hel', False),
+                  self.get_recognition_event('HUMAN_AGENT', 'hi', False),
+                  lifecycle_event,
+                  self.get_recognition_event('END_USER', 'hello', False),
+                  self.get_recognition_event('END_USER', 'hello there', True),
+                  self.get_recognition_event('END_USER', 'how', False)]
+        for event in events:
+            scheduler.submit(room, event)
+        self.assertTrue(done.wait(1))
+        self.assertEqual(emitted, [('batched-events', [events[1], lifecycle_event, events[4], events[5]], room)])
+
+        done.clear()
+        scheduler.submit(room, lifecycle_event)
+        self.assertTrue(done.wait(1))
+        self.assertEqual(emitted[1], ('conversation-lifecycle-event', lifecycle_event, room))
+
+
+class TestEmitWorkerPool(unittest.TestCase):
+    """Unit tests for emitting Redis messages from worker threads."""
+
+    def test_emit_in_order(self):
+        """Emits the messages of a key in order."""
+        emitted = {'a': [], 'b': []}
+        done = threading.Semaphore(0)
+
+        def handler(item):
+            key, index = item
+            emitted[key].append(index)
+            done.release()
+
+        pool = main.EmitWorkerPool(handler, 4, 100)
+        for index in range(50):
+            for key in emitted:
+                self.assertTrue(pool.submit(key, (key, index)))
+        for _ in range(100):
+            self.assertTrue(done.acquire(timeout=1))
+        self.assertEqual(emitted, {'a': list(range(50)), 'b': list(range(50))})
+        self.assertEqual(pool.depth(), 0)
+        self.assertEqual(pool.oldest_age(), 0)
+
+    def test_drop_when_full(self):
+        """Drops messages instead of blocking when a queue is full."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def handler(item):
+            started.set()
+            release.wait(1)
+
+        pool = main.EmitWorkerPool(handler, 1, 2)
+        self.assertTrue(pool.submit(b'channel', 0))
+        self.assertTrue(started.wait(1))
+        self.assertTrue(pool.submit(b'channel', 1))
+        self.assertTrue(pool.submit(b'channel', 2))
+        self.assertFalse(pool.submit(b'channel', 3))
+        self.assertEqual(pool.dropped.value, 1)
+        self.assertEqual(pool.depth(), 2)
+        self.assertGreater(pool.oldest_age(), 0)
+        release.set()
+
+
+class TestMetrics(unittest.TestCase):
+    """Unit tests for runtime metrics."""
+
+    def test_histogram(self):
+        """Counts observed values in cumulative buckets."""
+        histogram = main.metrics.Histogram('test_seconds', 'Test.', labels=('route',), buckets=(0.1, 1))
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.1, '/a')
+        histogram.observe(2, '/a')
+        self.assertEqual(list(histogram.samples()), [
+            ('_bucket', (('route', '/a'), ('le', 0.1)), 2),
+            ('_bucket', (('route', '/a'), ('le', 1)), 2),
+            ('_bucket', (('route', '/a'), ('le', '+Inf')), 3),
+            ('_sum', (('route', '/a'),), 2.15),
+            ('_count', (('route', '/a'),), 3)])
+
+    def test_publish_timestamp(self):
+        """Parses Cloud Pub/Sub publish times."""
+        self.assertEqual(main.get_publish_timestamp('2021-12-09T20:05:37.275Z'), 1639080337.275)
+        self.assertEqual(main.get_publish_timestamp('2021-12-09T20:05:37Z'), 1639080337)
+        self.assertIsNone(main.get_publish_timestamp(None))
+        self.assertIsNone(main.get_publish_timestamp('yesterday'))
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Unit tests for Dialogflow rate limits shared through Redis."""
+
+    def setUp(self):
+        self.scope = 'fake_project_id/global/{}'.format(time.time())
+
+    def test_method_family(self):
+        """Groups Dialogflow requests by quota."""
+        path = '/v2beta1/projects/p/locations/global/conversations/c/participants/a'
+        self.assertEqual(main.get_method_family(path + ':analyzeContent'), 'analyze-content')
+        self.assertEqual(main.get_method_family(path + '/suggestions:suggestArticles'), 'suggestion')
+        self.assertEqual(main.get_method_family(path + '?pageSize=10'), 'default')
+        self.assertEqual(main.parse_rate_limits('analyze-content=10, default=2.5'),
+                         {'analyze-content': 10, 'default': 2.5})
+
+    def test_token_bucket(self):
+        """Takes tokens up to the burst and leaves a reserve to interactive requests."""
+        redis_client = fakeredis.FakeStrictRedis()
+        limiter = main.RateLimiter(redis_client, {'default': 5}, burst_seconds=2, background_reserve=0.5)
+        for _ in range(5):
+            self.assertEqual(limiter.acquire(self.scope, 'default', main.BACKGROUND), 0)
+        self.assertIsNone(limiter.acquire(self.scope, 'default', main.BACKGROUND))
+        for _ in range(5):
+            self.assertEqual(limiter.acquire(self.scope, 'default', main.INTERACTIVE), 0)
+        self.assertIsNone(limiter.acquire(self.scope, 'default', main.INTERACTIVE))
+        waited = limiter.acquire(self.scope, 'default', main.INTERACTIVE, max_wait=1)
+        self.assertGreater(waited, 0.1)
+        # Families without a limit are not limited.
+        self.assertEqual(main.RateLimiter(redis_client, {'suggestion': 1}).acquire(self.scope, 'default'), 0)
+
+    @patch('main.dialogflow_rate_limiter')
+    def test_dialogflow_rate_limited(self, MockRateLimiter):
+        """Rejects proxied requests that cannot get a token in time."""
+        MockRateLimiter.acquire.return_value = None
+        client = app.test_client()
+        with patch('dialogflow.get_dialogflow') as MockGetDialogflow:
+            response = client.get(
+                '/v2beta1/projects/{0}/locations/{1}/conversations/fake_conversation_id'.format(
+                    _PROJECT_ID, _LOCATION),
+                headers={'Authorization': main.generate_jwt(), 'X-Request-Priority': 'background'})
+        self.assertEqual(response.status_code, 429)
+        MockGetDialogflow.assert_not_called()
+        MockRateLimiter.acquire.assert_called_once_with(
+            '{0}/{1}'.format(_PROJECT_ID, _LOCATION), 'default', main.BACKGROUND,
+            main.config.DIALOGFLOW_RATE_LIMIT_BACKGROUND_MAX_WAIT)
+
+
+class TestHedger(unittest.TestCase):
+    """Unit tests for hedged Dialogflow GET requests."""
+
+    def setUp(self):
+        self.hedger = hedging.Hedger(min_delay=0.01, budget_ratio=1)
+        for _ in range(20):
+            self.hedger.latencies.record(0.01)
+        self.closed = []
+
+    def test_hedge_slow_request(self):
+        """Returns the hedge when it answers first, and closes the slow response."""
+        attempts = ['slow', 'fast']
+
+        def send():
+            response = attempts.pop(0)
+            if response == 'slow':
+                time.sleep(0.2)
+            return response
+
+        wins = hedging.hedge_wins.value
+        self.assertEqual(self.hedger.request(send, self.closed.append), 'fast')
+        self.assertEqual(hedging.hedge_wins.value, wins + 1)
+        time.sleep(0.3)
+        self.assertEqual(self.closed, ['slow'])
+
+    def test_hedge_budget(self):
+        """Stops hedging when the budget is spent."""
+        budget = hedging.HedgeBudget(0.5, max_tokens=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_deadline(self):
+        """Gives up on attempts still running at the deadline."""
+        with self.assertRaises(hedging.futures.TimeoutError):
+            self.hedger.request(lambda: time.sleep(0.2) or 'slow', self.closed.append, timeout=0.05)
+        time.sleep(0.3)
+        self.assertEqual(self.closed, ['slow', 'slow'])
+
+    def test_dialogflow_deadline(self):
+        """Turns the X-Server-Timeout header into an upstream timeout."""
+        client = app.test_client()
+        path = '/v2beta1/projects/{0}/locations/{1}/conversations/fake_conversation_id'.format(
+            _PROJECT_ID, _LOCATION)
+        with patch('dialogflow.get_dialogflow', side_effect=dialogflow.DeadlineExceeded()) as MockGetDialogflow:
+            response = client.get(path, headers={'Authorization': main.generate_jwt(), 'X-Server-Timeout': '2'})
+        self.assertEqual(response.status_code, 504)
+        timeout = MockGetDialogflow.call_args.kwargs['timeout']
+        self.assertTrue(1 < timeout <= 2)
+        response = client.get(path, headers={'Authorization': main.generate_jwt(), 'X-Server-Timeout': '-1'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestAuthCache(unittest.TestCase):
+    """Unit tests for caching verified third-party tokens."""
+
+    def setUp(self):
+        auth.auth_cache = auth.TokenCache('auth', 10)
+        auth.app_auth_cache = auth.TokenCache('app-auth', 10)
+
+    @patch('main.config.AUTH_OPTION', 'GenesysCloud')
+    def test_check_auth_cached(self):
+        """Verifies a token with the identity provider once."""
+        with patch('auth_options.check_genesyscloud_token', return_value=True) as MockCheck:
+            self.assertTrue(main.check_auth('fake_token'))
+            self.assertTrue(main.check_auth('fake_token'))
+            self.assertFalse(auth.auth_cache.get('GenesysCloud:another_token'))
+        MockCheck.assert_called_once_with('fake_token')
+
+    @patch('main.config.AUTH_OPTION', 'GenesysCloud')
+    def test_check_auth_negative_cache(self):
+        """Remembers rejected tokens for the negative cache TTL."""
+        with patch('auth_options.check_genesyscloud_token', return_value=False) as MockCheck:
+            self.assertFalse(main.check_auth('fake_token'))
+            self.assertFalse(main.check_auth('fake_token'))
+            self.assertEqual(MockCheck.call_count, 1)
+            with patch('main.config.AUTH_NEGATIVE_CACHE_TTL', 0):
+                self.assertFalse(main.check_auth('another_token'))
+                self.assertFalse(main.check_auth('another_token'))
+        self.assertEqual(MockCheck.call_count, 3)
+
+    @patch('main.config.AUTH_OPTION', 'Twilio')
+    def test_check_auth_token_expiry(self):
+        """Stops trusting a verified JWT at its expiration time."""
+        token = auth.jwt.encode({'exp': time.time() + 0.2}, 'provider_secret', 'HS256')
+        with patch('auth_options.check_twilio_token', return_value=True) as MockCheck:
+            self.assertTrue(main.check_auth(token))
+            self.assertTrue(main.check_auth(token))
+            self.assertEqual(MockCheck.call_count, 1)
+            time.sleep(0.3)
+            self.assertIsNone(auth.auth_cache.get('Twilio:' + token))
+            main.check_auth(token)
+        self.assertEqual(MockCheck.call_count, 2)
+
+    @patch('main.config.APP_AUTH_OPTION', 'Twilio')
+    def test_check_app_auth_cached(self):
+        """Verifies application credentials with the provider once."""
+        auth = {'accountSid': main.config.TWILIO_ACCOUNT_SID, 'authToken': 'fake_token'}
+        with patch('auth.verify_app_auth', return_value=True) as MockVerify:
+            self.assertTrue(main.check_app_auth(auth))
+            self.assertTrue(main.check_app_auth(auth))
+            self.assertFalse(main.check_app_auth(None))
+        MockVerify.assert_called_once_with(auth)
+
+
+class TestJWTCache(unittest.TestCase):
+    """Unit tests for caching verified JWTs."""
+
+    def setUp(self):
+        auth.jwt_cache = auth.TokenCache('jwt', 10)
+
+    def test_check_jwt_cached(self):
+        """Decodes a valid JWT once for repeated checks."""
+        token = main.generate_jwt()
+        with patch('auth.jwt.decode', wraps=auth.jwt.decode) as MockDecode:
+            self.assertEqual(main.check_jwt(token), (True, 'Your token is valid.'))
+            self.assertEqual(main.check_jwt(token), (True, 'Your token is valid.'))
+            self.assertEqual(main.check_jwt('invalid_jwt'), (False, 'Failed to parse your token.'))
+            self.assertEqual(main.check_jwt('invalid_jwt'), (False, 'Failed to parse your token.'))
+        self.assertEqual(MockDecode.call_count, 3)
+
+    def test_check_jwt_cache_expiry(self):
+        """Drops cached JWTs at their expiration time."""
+        token = main.generate_jwt()
+        auth.jwt_cache.set(token, True, time.time() + 0.1)
+        self.assertTrue(auth.jwt_cache.get(token))
+        time.sleep(0.2)
+        self.assertIsNone(auth.jwt_cache.get(token))
+
+
+class TestDialogflowSession(unittest.TestCase):
+    """Unit tests for upstream Dialogflow sessions."""
+
+    @patch('dialogflow.get_credentials', return_value=AnonymousCredentials())
+    def test_session_per_location(self, MockCredentials):
+        """Reuses one pooled session per Dialogflow location."""
+        global_session = dialogflow.get_session('global')
+        self.assertIs(dialogflow.get_session('global'), global_session)
+        regional_session = dialogflow.get_session('us-central1')
+        self.assertIsNot(regional_session, global_session)
+        adapter = global_session.get_adapter('https://dialogflow.googleapis.com/')
+        self.assertIsInstance(adapter, dialogflow.KeepAliveHTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, main.config.DIALOGFLOW_POOL_MAXSIZE)
+
+    @patch('dialogflow.get_credentials', return_value=AnonymousCredentials())
+    def test_request_timeouts(self, MockCredentials):
+        """Sends upstream requests with connect and read timeouts."""
+        with patch('dialogflow.AuthorizedSession.request') as MockRequest:
+            dialogflow.post_dialogflow(_LOCATION, 'v2beta1/fake_path', {'key': 'value'})
+        MockRequest.assert_called_once_with(
+            'POST', 'https://dialogflow.googleapis.com/v2beta1/fake_path',
+            json={'key': 'value'}, stream=True,
+            timeout=(main.config.DIALOGFLOW_CONNECT_TIMEOUT, main.config.DIALOGFLOW_READ_TIMEOUT))
+
+    def test_async_client(self):
+        """Forwards requests with aiohttp and keeps the body undecoded."""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeDialogflowHandler)
+        server.daemon_threads = True
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        target_url = 'http://127.0.0.1:{}/{{}}'.format(server.server_port)
+        with patch('dialogflow.get_target_url', side_effect=lambda location, path: target_url.format(path)), \
+                patch('dialogflow.get_authorization_headers', return_value={'authorization': 'Bearer fake_token'}):
+            client = dialogflow.get_async_client()
+            response = client.submit(client.request('POST', _LOCATION, 'v2beta1/fake_path', {'key': 'value'})).result()
+        server.shutdown()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.raw.data), b'{"name": "fake_conversation"}')
+        self.assertEqual(server.requests, [('/v2beta1/fake_path', 'Bearer fake_token', b'{"key": "value"}')])
+
+
 if __name__ == '__main__':
     unittest.main()
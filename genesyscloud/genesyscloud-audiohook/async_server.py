@@ -0,0 +1,302 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asyncio server for Audiohook Monitor, an alternative to the gunicorn
+server of main.py. One event loop multiplexes the websocket sessions and
+their StreamingAnalyzeContent streams, instead of three threads per session,
+with the same session semantics as audiohook_blueprint
+
+Run it with:
+    python async_server.py
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from http import HTTPStatus
+
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+from audio_stream import Stream, deinterleave
+from audiohook import DEFAULT_CONVERSATION_ID, AudioHook
+from audiohook_config import config
+from dialogflow_api import (AsyncDialogflowAPI, async_wait_for_agent, close_async_dialogflow_clients,
+                            create_conversation_name, get_default_project, location_id, preload)
+
+CONNECT_PATH = "/connect"
+# Seconds given to the streams to send their last audio and receive the last
+# transcripts after the conversation is closed
+STREAM_DRAIN_SECONDS = 5
+
+
+logging.basicConfig(
+    format='%(levelname)-8s [%(filename)s:%(lineno)d in '
+           'function %(funcName)s] %(message)s',
+    datefmt='%Y-%m-%d:%H:%M:%S',
+    level=config.log_level.upper()
+)
+
+
+class AudiohookSession:
+    """One Audiohook websocket session, the asyncio counterpart of
+    audiohook_blueprint.audiohook_connect
+    """
+
+    def __init__(self, ws: ServerConnection, preloaded: asyncio.Future):
+        self.ws = ws
+        self.audiohook = AudioHook()
+        self._preloaded = preloaded
+        self.dialogflow_api = None
+        self.agent_stream = None
+        self.customer_stream = None
+        self.conversation_name = None
+        # Participant and audio config of the agent and customer streams
+        self._stream_args = {}
+        self._tasks = set()
+        self._setup_task = None
+        self._streaming_tasks = []
+        # perf_counter time of the "open" message
+        self._open_time = 0
+
+    async def send(self, message: dict):
+        await self.ws.send(json.dumps(message))
+
+    def start_task(self, coroutine) -> asyncio.Task:
+        """Run a coroutine for the session, cancelled when the session ends"""
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run(self):
+        logging.info(
+            "Audiohook client connected with the interceptor server")
+        try:
+            async for data in self.ws:
+                if isinstance(data, str):
+                    if await self.process_text_message(data):
+                        logging.info(
+                            "Disconnecting Audiohook with the server")
+                        break
+                elif self.conversation_name is not None:
+                    # audio is a 2-channel interleaved 8-bit PCMU audio stream
+                    # which is separated into single streams
+                    customer_audio, agent_audio = deinterleave(data)
+                    self.customer_stream.fill_buffer(customer_audio)
+                    self.agent_stream.fill_buffer(agent_audio)
+        except ConnectionClosed as e:
+            logging.warning("Audiohook connection closed %s", e)
+        finally:
+            await self.stop()
+
+    async def process_text_message(self, data: str) -> bool:
+        """Process a text message, and return True when the session is closed"""
+        try:
+            json_message = json.loads(data)
+        except ValueError as e:
+            logging.warning(
+                "Not a valid JSON message %s, error details %s ", data, e)
+            return False
+        message_type = json_message.get("type")
+        logging.info(
+            "Handle %s message %s", message_type, json_message)
+        conversation_id = json_message.get("parameters", {}).get(
+            "conversationId", DEFAULT_CONVERSATION_ID)
+        self.audiohook.set_session_id(json_message.get("id", 0))
+        self.audiohook.set_client_sequence(json_message.get("seq"))
+        if message_type == "open":
+            if conversation_id == DEFAULT_CONVERSATION_ID:
+                logging.debug(
+                    "Connection Probe, not creating Dialogflow Conversation")
+                await self.send(self.audiohook.create_opened_message())
+            elif self.conversation_name is None:
+                await self.open_conversation(conversation_id)
+                # Resume the audio once the conversation is set up and the agent
+                # assist backend has joined it in Redis, without holding the session
+                self.start_task(self.resume_after_redis())
+        elif message_type == "ping":
+            await self.send(self.audiohook.create_pong_message())
+        elif message_type == "close" and self.conversation_name is None:
+            # This "close" is for a connection probe
+            await self.send(self.audiohook.create_close_message())
+            return True
+        elif self.conversation_name is not None:
+            return await self.process_ongoing_conversation_message(json_message)
+        return False
+
+    async def open_conversation(self, conversation_id: str):
+        """Respond with an "opened" message, as the session starts paused, and
+        set up the conversation and its participants in a task
+        """
+        self._open_time = time.perf_counter()
+        # The Dialogflow client library, credentials and conversation profile
+        # are loaded when the server starts
+        await self._preloaded
+        self.dialogflow_api = AsyncDialogflowAPI()
+        self.agent_stream = Stream(
+            config.rate, chunk_size=config.chunk_size, asynchronous=True)
+        self.customer_stream = Stream(
+            config.rate, chunk_size=config.chunk_size, asynchronous=True)
+        cached_profile = await self.dialogflow_api.load_conversation_profile(
+            config.conversation_profile_name)
+        agent_audio_config = self.agent_stream.use_audio_config(
+            cached_profile.audio_config)
+        customer_audio_config = self.customer_stream.use_audio_config(
+            cached_profile.audio_config)
+        normalized_conversation_id = 'a' + conversation_id
+        self.conversation_name = create_conversation_name(
+            normalized_conversation_id, location_id, get_default_project())
+
+        async def set_up_conversation():
+            participants = await self.dialogflow_api.set_up_conversation(
+                cached_profile.profile, normalized_conversation_id)
+            self._stream_args = {
+                "agent": (self.agent_stream, participants["HUMAN_AGENT"], agent_audio_config),
+                "customer": (self.customer_stream, participants["END_USER"], customer_audio_config),
+            }
+
+        self._setup_task = self.start_task(set_up_conversation())
+        await self.send(self.audiohook.create_opened_message())
+        logging.info("Sent opened message %.0f ms after open",
+                     (time.perf_counter() - self._open_time) * 1000)
+
+    async def wait_set_up(self) -> bool:
+        """Wait for the conversation to be set up, and return whether it succeeded"""
+        try:
+            await asyncio.shield(self._setup_task)
+        except Exception as e:
+            logging.error("Error setting up conversation %s %s", self.conversation_name, e)
+            return False
+        return True
+
+    async def resume_after_redis(self):
+        # Wait for the agent assist backend to join the conversation in Redis
+        # while the conversation is set up
+        remaining = config.agent_join_timeout - (time.perf_counter() - self._open_time)
+        agent_joined = asyncio.ensure_future(
+            async_wait_for_agent(self.conversation_name, remaining))
+        try:
+            if not await self.wait_set_up():
+                await self.send(self.audiohook.create_disconnect_message(
+                    "error", "Could not set up the Dialogflow conversation"))
+                return
+            if not await agent_joined:
+                logging.warning("Agent has not joined conversation %s, resuming anyway",
+                                self.conversation_name)
+        finally:
+            agent_joined.cancel()
+        # Always send the resume, don't stop the audio streaming even if the
+        # agent has not joined yet
+        await self.send(self.audiohook.create_resume_message())
+        logging.info("Sent resume message %.0f ms after open",
+                     (time.perf_counter() - self._open_time) * 1000)
+
+    async def process_ongoing_conversation_message(self, message: dict) -> bool:
+        """Process the messages of an opened conversation, same as
+        audiohook_blueprint.process_ongoing_conversation_messages
+        """
+        match message.get("type"):
+            case "resumed":
+                # The first paused message after open message sets the
+                # closed to True, now after resume, need to flip the bit
+                self.customer_stream.closed = False
+                self.agent_stream.closed = False
+                if not self._streaming_tasks and await self.wait_set_up():
+                    self._streaming_tasks = [
+                        self.start_task(self.dialogflow_api.maintained_streaming_analyze_content(*args))
+                        for args in self._stream_args.values()]
+            case "paused":
+                self.customer_stream.closed = True
+                self.agent_stream.closed = True
+                logging.debug("Audio stream is paused")
+            case "close":
+                # This "close" is for ending a real conversation
+                self.terminate_streams()
+                await self.send(self.audiohook.create_close_message())
+                # Don't complete a conversation being created
+                await asyncio.wait([self._setup_task])
+                try:
+                    await self.dialogflow_api.complete_conversation(
+                        self.conversation_name)
+                except Exception as e:
+                    logging.error("Error completing conversation %s", e)
+                return True
+            case "discarded":
+                logging.info(
+                    "Currently the audio stream has been paused from %s for about %s second",
+                    message.get("START_TIME"),
+                    message.get("DURATION"))
+        return False
+
+    def terminate_streams(self):
+        for stream in (self.agent_stream, self.customer_stream):
+            if stream is not None:
+                stream.terminate = True
+                stream.closed = True
+
+    async def stop(self):
+        """Let the streams end, then cancel what is left of the session"""
+        self.terminate_streams()
+        if self._streaming_tasks:
+            await asyncio.wait(self._streaming_tasks, timeout=STREAM_DRAIN_SECONDS)
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error("Error in Audiohook session task %s", result)
+        logging.debug("Stop streaming tasks for customers and agents")
+
+
+async def preload_async():
+    """Same as dialogflow_api.preload, loading the conversation profile with
+    the clients of the event loop
+    """
+    await asyncio.to_thread(preload, conversation_profile=False)
+    try:
+        await AsyncDialogflowAPI().load_conversation_profile(
+            config.conversation_profile_name)
+    except Exception as e:
+        logging.warning("Error preloading the conversation profile %s", e)
+
+
+def process_request(connection: ServerConnection, request):
+    """Only accept websocket connections on the same path as the gunicorn server"""
+    if request.path.split("?")[0] != CONNECT_PATH:
+        return connection.respond(HTTPStatus.NOT_FOUND, "Not Found\n")
+    return None
+
+
+async def serve_audiohook(host: str, port: int, stop: asyncio.Future | None = None):
+    """Serve Audiohook sessions until stop is done, or forever"""
+    # Serve connection probes right away while loading Dialogflow dependencies
+    preloaded = asyncio.ensure_future(preload_async())
+
+    async def handler(ws: ServerConnection):
+        await AudiohookSession(ws, preloaded).run()
+
+    try:
+        async with serve(handler, host, port, process_request=process_request):
+            logging.info("Serving Audiohook sessions on %s:%s", host, port)
+            await (stop if stop is not None else asyncio.get_running_loop().create_future())
+    finally:
+        await close_async_dialogflow_clients()
+
+
+if __name__ == '__main__':
+    asyncio.run(serve_audiohook("", int(os.environ.get("PORT", 8080))))
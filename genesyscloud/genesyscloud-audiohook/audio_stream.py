@@ -15,29 +15,212 @@
 """Referenced implementation from
 https://github.com/GoogleCloudPlatform/python-docs-samples/blob/main/dialogflow/streaming_transcription.py
 """
+from __future__ import annotations
+
+import asyncio
 import logging
-import queue
 import threading
 
-import google.cloud.dialogflow_v2beta1 as dialogflow
-
 from audiohook_config import config
+from lazy_import import LazyModule
+
+dialogflow = LazyModule("google.cloud.dialogflow_v2beta1")
 
 MAX_BUFFER_SECONDS = 10
 SINGLE_STREAM_MAX_DURATION = 90000
+# Seconds without audio after which the generator stops, so that the stream is
+# half closed before Dialogflow times out waiting for audio
+MAX_IDLE_SECONDS = 5
+# Seconds a stream opened ahead of a rollover waits for the audio to be handed
+# over before half closing
+MAX_STANDBY_SECONDS = 30
+
+
+def deinterleave(data: bytes) -> tuple[bytes, bytes]:
+    """Split 2-channel interleaved 8-bit audio into the audio of each channel.
+    Each channel is copied once by an extended slice, without intermediate
+    arrays. A trailing incomplete sample is dropped
+    """
+    end = len(data) & ~1
+    return data[0:end:2], data[1:end:2]
+
+
+def create_audio_config(
+        conversation_profile: dialogflow.ConversationProfile,
+        rate: int) -> dialogflow.InputAudioConfig:
+    """Create the input audio config of the streams of a conversation profile.
+    Only MULAW audio encodings are currently supported in Audiohook Monitor
+    """
+    language_code = conversation_profile.stt_config.language_code or "en-US"
+    stt_model = conversation_profile.stt_config.model or "chirp_3"
+    audio_input_config = dialogflow.InputAudioConfig(
+        audio_encoding=dialogflow.AudioEncoding.AUDIO_ENCODING_MULAW,
+        sample_rate_hertz=rate,
+        language_code=language_code,
+        model=stt_model,
+        model_variant="USE_ENHANCED",
+        enable_automatic_punctuation=True)
+    logging.debug("Input audio config %s ", audio_input_config)
+    return audio_input_config
+
+
+class AudioRing:
+    """Fixed size byte ring keeping the most recent audio of a stream, so that
+    the lookback replay after a restart neither keeps nor copies the whole call
+    """
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._capacity = capacity
+        # Position where the next byte is written
+        self._end = 0
+        # Number of bytes written since the start of the stream
+        self.total_bytes = 0
+
+    def extend(self, data: bytes):
+        """Append audio, overwriting the oldest bytes once the ring is full"""
+        self.total_bytes += len(data)
+        if self._capacity == 0:
+            return
+        data = memoryview(data)[-self._capacity:]
+        first = min(len(data), self._capacity - self._end)
+        self._buffer[self._end:self._end + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self._end = (self._end + len(data)) % self._capacity
+
+    def tail(self, length: int) -> bytes:
+        """Return the last length bytes, or fewer if the ring holds less"""
+        length = max(min(length, self.total_bytes, self._capacity), 0)
+        start = (self._end - length) % self._capacity if length else self._end
+        if start + length <= self._capacity:
+            return bytes(self._buffer[start:start + length])
+        return bytes(self._buffer[start:]) + bytes(self._buffer[:self._end])
+
+
+class AudioBuffer:
+    """Single producer, single consumer byte ring between the websocket receiving
+    the audio and the StreamingAnalyzeContent requests. Keeps at most capacity
+    bytes, trimming the oldest audio on overflow in constant time
+    """
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._capacity = capacity
+        # Position of the oldest buffered byte
+        self._start = 0
+        self.size = 0
+        self.dropped_bytes = 0
+        # Held by write and read, and by consumers updating their own state
+        # atomically with a read
+        self.lock = threading.RLock()
+        self._condition = threading.Condition(self.lock)
+
+    def write(self, data: bytes):
+        """Append audio, dropping the oldest audio when the buffer is full"""
+        data = memoryview(data)
+        with self._condition:
+            if len(data) > self._capacity:
+                self.dropped_bytes += len(data) - self._capacity
+                data = data[-self._capacity:]
+            overflow = self.size + len(data) - self._capacity
+            if overflow > 0:
+                self._start = (self._start + overflow) % self._capacity
+                self.size -= overflow
+                self.dropped_bytes += overflow
+            end = (self._start + self.size) % self._capacity
+            first = min(len(data), self._capacity - end)
+            self._buffer[end:end + first] = data[:first]
+            self._buffer[:len(data) - first] = data[first:]
+            self.size += len(data)
+            self._condition.notify()
+
+    def wait(self, predicate, timeout: float) -> bool:
+        """Wait until predicate() is true, checked on each write and wake, and
+        return its last value
+        """
+        with self._condition:
+            return self._condition.wait_for(predicate, timeout)
+
+    def read(self, length: int, timeout: float, stop, abandon=lambda: False) -> bytes:
+        """Wait until length bytes are buffered and return them. Return what is
+        buffered, possibly nothing, once timeout seconds elapse or stop() is true.
+        Return nothing and leave the audio buffered once abandon() is true
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.size >= length or stop() or abandon(), timeout)
+            if abandon():
+                return b""
+            length = min(length, self.size)
+            end = self._start + length
+            if end <= self._capacity:
+                data = bytes(self._buffer[self._start:end])
+            else:
+                data = bytes(self._buffer[self._start:]) + \
+                    bytes(self._buffer[:end - self._capacity])
+            self._start = end % self._capacity if self._capacity else 0
+            self.size -= length
+            return data
+
+    def wake(self):
+        """Wake up the consumer to check its stop condition"""
+        with self._condition:
+            self._condition.notify_all()
+
+
+class AsyncAudioBuffer(AudioBuffer):
+    """AudioBuffer whose producer and consumer run on the same event loop,
+    with a consumer awaiting the audio instead of blocking a thread
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self._written = asyncio.Event()
+
+    def write(self, data: bytes):
+        super().write(data)
+        self._written.set()
+
+    async def wait_async(self, predicate, timeout: float) -> bool:
+        """Same as wait, awaiting the audio"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not predicate():
+            self._written.clear()
+            try:
+                await asyncio.wait_for(self._written.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return predicate()
+        return True
+
+    async def read_async(self, length: int, timeout: float, stop, abandon=lambda: False) -> bytes:
+        """Same as read, awaiting the audio"""
+        await self.wait_async(
+            lambda: self.size >= length or stop() or abandon(), timeout)
+        return self.read(length, 0, stop, abandon)
+
+    def wake(self):
+        super().wake()
+        self._written.set()
+
+
 class Stream:
     """Opens a stream as a generator yielding the audio chunks.
     The generator method returns an iterator that contains subsequent audio
     bytes received from audio source to the StreamingAnalyzeContentRequest
     Reference: https://cloud.google.com/python/docs/reference/dialogflow/latest/google.cloud.dialogflow_v2.services.participants.ParticipantsAsyncClient"""
 
-    def __init__(self, rate, chunk_size):
+    def __init__(self, rate, chunk_size, asynchronous=False):
         self._rate = rate
         self.chunk_size = chunk_size
         self._num_channels = 1
-        self._buff = queue.Queue()
+        # Drop excessive audio if buffer exceeds 10 seconds (approx 80KB for 8kHz MULAW).
+        # Asynchronous streams are filled and read on the event loop of the asyncio server
+        buffer_class = AsyncAudioBuffer if asynchronous else AudioBuffer
+        self._buff = buffer_class(MAX_BUFFER_SECONDS * rate)
+        self._closed_changed = asyncio.Event() if asynchronous else None
         self.is_final = False
-        self.closed = False
+        self._closed = False
         self.terminate = False
         # Count the number of times the stream analyze content restarts.
         self.restart_counter = 0
@@ -48,35 +231,49 @@ class Stream:
         self.is_final_offset = 0
         # Time end of the interim result speech end offset in second
         self.speech_end_offset = 0
-        # Save the audio chunks generated from the start of the audio stream for
-        # replay after restart.
         # stt model
         self.stt_model = "chirp_3"
-        self.audio_input_chunks = []
+        # Save the last max_lookback seconds of the audio stream for replay
+        # after restart.
+        self.audio_input_chunks = AudioRing(int(config.max_lookback * rate))
         self.new_stream = True
+        # Generation of the generator reading the audio, changed when the audio
+        # is handed over to the generator of the next stream
+        self.generation = 0
+        self._last_generation = 0
+        # Generation of the generator standing by for the audio, if any
+        self._standby_generation = None
+        # Future of the responses of the next StreamingAnalyzeContent stream,
+        # opened ahead of the rollover of the current one
+        self.standby = None
         # Only MULAW audio encodings are currently supported in Audiohook
         # Monitor
         self.audio_encoding = dialogflow.AudioEncoding.AUDIO_ENCODING_MULAW
-        self.buffer_byte_size = 0
-        self._lock = threading.Lock()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @closed.setter
+    def closed(self, closed: bool):
+        self._closed = closed
+        # Stop a generator waiting for audio
+        self._buff.wake()
+        if self._closed_changed is not None:
+            self._closed_changed.set()
+
+    async def wait_resumed(self):
+        """Wait until the stream is resumed or closed again, for asynchronous streams"""
+        self._closed_changed.clear()
+        await self._closed_changed.wait()
+
+    @property
+    def buffer_byte_size(self) -> int:
+        return self._buff.size
 
     def fill_buffer(self, in_data, *args, **kwargs):
-        """Append audio data to buffer if not full"""
-
-        with self._lock:
-            self._buff.put(in_data)
-            self.buffer_byte_size += len(in_data)
-            # Drop excessive audio if buffer exceeds 10 seconds (approx 80KB for 8kHz MULAW)
-            max_buffer_bytes = MAX_BUFFER_SECONDS * self._rate
-        
-            while self.buffer_byte_size > max_buffer_bytes:       
-                try:
-                    dropped_chunk = self._buff.get_nowait()
-                    if dropped_chunk:
-                        self.buffer_byte_size -= len(dropped_chunk)
-                except queue.Empty:
-                    logging.debug("Buffer size: %s, max buffer size: %s", self.buffer_byte_size, max_buffer_bytes)
-                    break
+        """Append audio data to buffer, dropping the oldest audio if full"""
+        self._buff.write(in_data)
     def define_audio_config(
             self,
             conversation_profile: dialogflow.ConversationProfile):
@@ -85,22 +282,22 @@ class Stream:
         https://cloud.google.com/agent-assist/docs/extended-streaming
         https://developer.genesys.cloud/devapps/audiohook/session-walkthrough#audio-streaming
         """
+        return self.use_audio_config(
+            create_audio_config(conversation_profile, self._rate))
 
-        language_code = conversation_profile.stt_config.language_code or "en-US"
-        self.stt_model = conversation_profile.stt_config.model or "chirp_3"
-        audio_input_config = dialogflow.InputAudioConfig(
-            audio_encoding=self.audio_encoding,
-            sample_rate_hertz=self._rate,
-            language_code=language_code,
-            model=self.stt_model,
-            model_variant="USE_ENHANCED",
-            enable_automatic_punctuation=True)
-        logging.debug("Input audio config %s ", audio_input_config)
-        return audio_input_config
-
-    def generator(self):
-        """Stream Audio from Genesys Audiohook Monitor to API and to local buffer"""
-        # Handle restart.
+    def use_audio_config(
+            self,
+            audio_config: dialogflow.InputAudioConfig) -> dialogflow.InputAudioConfig:
+        """Use an audio config created by create_audio_config, shared by the
+        streams of the same conversation profile
+        """
+        self.stt_model = audio_config.model
+        return audio_config
+
+    def restart(self, handed_over: bool = False) -> bytes:
+        """Handle the restart of the stream, and return the audio of the
+        lookback to replay, possibly empty
+        """
         logging.debug("Restart generator")
         self.restart_counter += 1
         # After the restart of the streaming, set is_final to False
@@ -119,27 +316,141 @@ class Stream:
             self.last_start_time,
             self.is_final_offset,
             total_processed_time)
-        self.last_start_time = total_processed_time
+        # Offsets of the responses are relative to the start of each stream
+        self.is_final_offset = 0
+        self.speech_end_offset = 0
         # Send out bytes stored in self.audio_input_chunks that is after the
         # processed_bytes_length.
-        if processed_bytes_length != 0 and self.stt_model != "chirp_3":
-            audio_bytes = b"".join(self.audio_input_chunks)
+        need_to_process_bytes = b""
+        # A stream handed over is cancelled at its last final transcript, so the
+        # audio after it is replayed for every model, chirp_3 included
+        if processed_bytes_length != 0 and (handed_over or self.stt_model != "chirp_3"):
             # Lookback for unprocessed audio data.
             # ApproximatesBytes = Rate(Sample per Second) * Duration(Seconds) *  BitRate(Bits per Sample) / 8
             # reference https://en.wikipedia.org/wiki/G.711
             need_to_process_length = min(
-                int(len(audio_bytes) - processed_bytes_length),
+                int(self.audio_input_chunks.total_bytes - processed_bytes_length),
                 int(config.max_lookback * self._rate),
             )
-            # Note that you need to explicitly use `int` type for
-            # substring.
-            need_to_process_bytes = audio_bytes[(-1)
-                                                * need_to_process_length:]
+            need_to_process_bytes = self.audio_input_chunks.tail(
+                need_to_process_length)
             logging.debug(
                 "Sending need to process bytes length %s, total audio byte length %s, processed byte length %s ",
                 len(need_to_process_bytes),
-                len(audio_bytes),
+                self.audio_input_chunks.total_bytes,
                 processed_bytes_length)
+        # The offsets of the next stream start from the audio replayed, or from
+        # the first audio not sent yet
+        self.last_start_time = (
+            self.audio_input_chunks.total_bytes - len(need_to_process_bytes)) * 1000 / self._rate
+        return need_to_process_bytes
+
+    def should_stop(self) -> bool:
+        """Check if the current stream should end before reading more audio"""
+        if self.closed:
+            return True
+        # Check if the stream has been running for more than 90 seconds,
+        # unless the next stream stands by to take the audio over
+        if self.is_final and self.speech_end_offset > SINGLE_STREAM_MAX_DURATION \
+                and self._standby_generation is None:
+            logging.info("Stream running for > 90s (%s ms), closing current stream.", self.speech_end_offset)
+            return True
+        return False
+
+    def rollover_due(self) -> bool:
+        """Check if the next stream should be opened, shortly before the current
+        one reaches SINGLE_STREAM_MAX_DURATION
+        """
+        return (config.rollover_lead > 0 and self.standby is None
+                and self.speech_end_offset >= SINGLE_STREAM_MAX_DURATION - config.rollover_lead * 1000)
+
+    def handover_due(self) -> bool:
+        """Check if the audio should be handed over at the last final transcript,
+        once the next stream had half of the lead to open
+        """
+        return self.is_final and self.speech_end_offset >= \
+            SINGLE_STREAM_MAX_DURATION - config.rollover_lead * 500
+
+    def stand_by(self) -> int:
+        """Register the generator of the next stream, standing by for the audio
+        until hand_over, and return the generation to create it with
+        """
+        with self._buff.lock:
+            self._last_generation += 1
+            self._standby_generation = self._last_generation
+            return self._standby_generation
+
+    def hand_over(self) -> bool:
+        """Hand the audio over to the generator standing by, stopping the
+        generator of the current stream. Return False if none stands by
+        """
+        with self._buff.lock:
+            if self._standby_generation is None:
+                return False
+            self.generation = self._standby_generation
+            self._standby_generation = None
+            self._buff.wake()
+        logging.info("Stream handed over at %s ms", self.last_start_time + self.is_final_offset)
+        return True
+
+    def cancel_standby(self, generation: int | None = None) -> bool:
+        """Stop the generator standing by, or only the one of generation, and
+        drop the next stream. Return False if generation was handed the audio
+        over already
+        """
+        with self._buff.lock:
+            if generation is not None and generation == self.generation:
+                return False
+            if generation is None or generation == self._standby_generation:
+                self._standby_generation = None
+                self._buff.wake()
+        if generation is None and self.standby is not None:
+            self.standby.cancel()
+            self.standby = None
+        return True
+
+    def _standby_over(self, generation: int) -> bool:
+        return (self.generation == generation or self.closed
+                or self._standby_generation != generation)
+
+    def _start_generator(self, generation: int | None) -> tuple[int, bytes] | None:
+        """Start reading the audio for a generator, and return its generation
+        and the audio to replay first. Return None for a generator standing
+        by that was not handed the audio over
+        """
+        with self._buff.lock:
+            if generation is None:
+                return self.generation, self.restart()
+            if self.generation != generation:
+                if self._standby_generation == generation:
+                    self._standby_generation = None
+                logging.debug("Generator standing by stopped before the hand over")
+                return None
+            return generation, self.restart(handed_over=True)
+
+    def _read_chunk(self, generation: int) -> bytes:
+        """Read the next chunk into the lookback, atomically with hand_over,
+        unless the generation was handed over
+        """
+        with self._buff.lock:
+            chunk = self._buff.read(
+                self.chunk_size, MAX_IDLE_SECONDS, lambda: self.closed,
+                lambda: self.generation != generation)
+            self.audio_input_chunks.extend(chunk)
+            return chunk
+
+    def generator(self, generation: int | None = None):
+        """Stream Audio from Genesys Audiohook Monitor to API and to local buffer.
+        A generator created with a generation from stand_by waits for hand_over
+        """
+        if generation is not None:
+            self._buff.wait(lambda: self._standby_over(generation), MAX_STANDBY_SECONDS)
+        started = self._start_generator(generation)
+        if started is None:
+            return
+        generation, need_to_process_bytes = started
+        # An empty request would half close the stream
+        if need_to_process_bytes:
             try:
                 yield need_to_process_bytes
             except GeneratorExit as e:
@@ -147,49 +458,46 @@ class Stream:
                     "Generator exit from the need to process step %s", e)
                 return
         try:
-            while not self.closed:
-                if self.is_final:
-                    # Check if the stream has been running for more than 90 seconds
-                    if self.speech_end_offset > SINGLE_STREAM_MAX_DURATION:
-                        logging.info("Stream running for > 90s (%s ms), closing current stream.", self.speech_end_offset)
-                        break
-                data = []
-                # Use a blocking get() to ensure there's at least one chunk of
-                # data, and stop iteration if the chunk is None, indicating the
-                # end of the audio stream.
-                try:
-                    chunk = self._buff.get(block=True, timeout=0.5)
-                    with self._lock:
-                        self.buffer_byte_size -= len(chunk)
-                except queue.Empty:
-                    logging.debug(
-                        "queue is empty break the loop and stop generator")
+            while not self.should_stop():
+                # Wait for a whole chunk, so that every request carries the
+                # same duration of audio
+                chunk = self._read_chunk(generation)
+                if chunk:
+                    yield chunk
+                if self.generation != generation:
+                    logging.debug("Audio handed over to the next stream, stop generator")
                     break
-                if chunk is None:
+                if len(chunk) < self.chunk_size:
                     logging.debug(
-                        "chunk is none half close the stream by stopping generates requests")
-                    return
-                data.append(chunk)
-                # Now try to the rest of chunks if there are any left in the
-                # _buff.
-                while True:
-                    try:
-                        chunk = self._buff.get(block=False)
-                        if chunk is None:
-                            logging.debug(
-                                "Remaining chunk is none half close the stream")
-                            return
-                        with self._lock:
-                            self.buffer_byte_size -= len(chunk)
-                        data.append(chunk)
-                    except queue.Empty:
-                        # queue is empty quitting the loop
-                        break
-                self.audio_input_chunks.extend(data)
-
-                if data:
-                    yield b"".join(data)
+                        "No audio for %s seconds or stream closed, stop generator", MAX_IDLE_SECONDS)
+                    break
         except GeneratorExit as e:
             logging.debug("Generator exit after is_final set to true %s", e)
             return
         logging.debug("Stop generator")
+
+    async def async_generator(self, generation: int | None = None):
+        """Same as generator, for a stream created with asynchronous=True"""
+        if generation is not None:
+            await self._buff.wait_async(lambda: self._standby_over(generation), MAX_STANDBY_SECONDS)
+        started = self._start_generator(generation)
+        if started is None:
+            return
+        generation, need_to_process_bytes = started
+        if need_to_process_bytes:
+            yield need_to_process_bytes
+        while not self.should_stop():
+            chunk = await self._buff.read_async(
+                self.chunk_size, MAX_IDLE_SECONDS, lambda: self.closed,
+                lambda: self.generation != generation)
+            self.audio_input_chunks.extend(chunk)
+            if chunk:
+                yield chunk
+            if self.generation != generation:
+                logging.debug("Audio handed over to the next stream, stop generator")
+                break
+            if len(chunk) < self.chunk_size:
+                logging.debug(
+                    "No audio for %s seconds or stream closed, stop generator", MAX_IDLE_SECONDS)
+                break
+        logging.debug("Stop generator")
@@ -87,6 +87,17 @@ class AudioHook:
         logging.debug("send pong messages to the client %s", pong_message)
         return pong_message
 
+    def create_disconnect_message(self, reason: str, info: str = ""):
+        """The server asks the client to close the session with a "disconnect"
+        message, for example with the "error" reason when the conversation
+        cannot be set up
+        """
+        disconnect_message = self.create_message_by_type(
+            message_type="disconnect")
+        disconnect_message["parameters"] = {"reason": reason, "info": info}
+        logging.debug("send disconnect messages to the client %s", disconnect_message)
+        return disconnect_message
+
     def set_session_id(self, session_id: str):
         """Set function for session id
 
@@ -15,23 +15,24 @@
 """ Module for receiving audio streaming from Audiohook Monitor and
 call Agent Assist backend
 """
+from __future__ import annotations
+
 import json
 import logging
+import time
 from dataclasses import dataclass, field
-from threading import Thread
+from threading import Event, Thread
 
-import numpy as np
 from flask import Blueprint
 from flask_sock import Sock
-from google.api_core.exceptions import NotFound
-from google.cloud import dialogflow_v2beta1 as dialogflow
 from simple_websocket import Server
 
-from audio_stream import Stream
+from audio_stream import Stream, deinterleave
 from audiohook import DEFAULT_CONVERSATION_ID, AudioHook
 from audiohook_config import config
-from dialogflow_api import (DialogflowAPI, await_redis, create_conversation_name,
-                            find_participant_by_role, location_id, project)
+from dialogflow_api import (DialogflowAPI, create_conversation_name, get_default_project,
+                            location_id, unwatch_agent_join, wait_for_agent,
+                            watch_agent_join)
 
 audiohook_bp = Blueprint("audiohook", __name__)
 sock = Sock(audiohook_bp)
@@ -50,10 +51,15 @@ logging.basicConfig(
 class OpenConversationState:
     """ Memorize the state after open message that is not a connection prob
     """
-    agent_thread: Thread
-    user_thread: Thread
+    agent_thread: Thread | None
+    user_thread: Thread | None
     conversation_name: str
     is_opened: bool
+    # Sets up the conversation and its participants after the "opened" message,
+    # then creates the agent and user threads
+    setup_thread: Thread | None = None
+    # perf_counter time of the "open" message
+    open_time: float = field(default_factory=time.perf_counter)
 
 
 def process_open_conversation_message(
@@ -65,53 +71,50 @@ def process_open_conversation_message(
         audiohook: AudioHook
 ) -> OpenConversationState:
     """Process "open" message get from Audiohook Monitor, and establish a state
-    object for conversation_name, agent_thread, user_thread, and is_opened bool
+    object for conversation_name, agent_thread, user_thread, and is_opened bool.
+    The session starts paused, so the "opened" message is sent right away and
+    the conversation is set up in the setup_thread of the state
     """
-
-    conversation_profile = dialogflow_api.get_conversation_profile(
-        conversation_profile_name=config.conversation_profile_name)
-    agent_audio_config = agent_stream.define_audio_config(conversation_profile)
-    customer_audio_config = customer_stream.define_audio_config(
-        conversation_profile)
+    open_time = time.perf_counter()
+    cached_profile = dialogflow_api.load_conversation_profile(
+        config.conversation_profile_name)
+    agent_audio_config = agent_stream.use_audio_config(
+        cached_profile.audio_config)
+    customer_audio_config = customer_stream.use_audio_config(
+        cached_profile.audio_config)
     normalized_conversation_id = 'a' + conversation_id
     conversation_name = create_conversation_name(
-        normalized_conversation_id, location_id, project)
-    try:
-        dialogflow_api.get_conversation(
-            conversation_name)
-    except NotFound as e:
-        logging.warning("Error getting the conversation : %s", e)
-        dialogflow_api.create_conversation(
-            conversation_profile, normalized_conversation_id)
+        normalized_conversation_id, location_id, get_default_project())
+    open_conversation_state = OpenConversationState(
+        None, None, conversation_name, True, open_time=open_time)
+    # Watch for the agent assist backend to join the conversation in Redis,
+    # before then the UI modules will not receive the published messages
+    joined = watch_agent_join(conversation_name)
 
-    try:
-        participants_list = dialogflow_api.list_participant(
-            conversation_name)
-        participant_agent = find_participant_by_role(
-            dialogflow.Participant.Role.HUMAN_AGENT, participants_list)
-        participant_user = find_participant_by_role(
-            dialogflow.Participant.Role.END_USER, participants_list)
-        if not participant_agent:
-            participant_agent = dialogflow_api.create_participant(
-                conversation_name=conversation_name, role="HUMAN_AGENT")
-        if not participant_user:
-            participant_user = dialogflow_api.create_participant(
-                conversation_name=conversation_name, role="END_USER")
-    except NotFound as e:
-        logging.error("Participants not found %s: ", e)
+    def set_up_conversation():
+        try:
+            participants = dialogflow_api.set_up_conversation(
+                cached_profile.profile, normalized_conversation_id)
+        except Exception as e:
+            logging.error("Error setting up conversation %s %s", conversation_name, e)
+            unwatch_agent_join(conversation_name, joined)
+            ws.send(json.dumps(audiohook.create_disconnect_message(
+                "error", "Could not set up the Dialogflow conversation")))
+            return
+        open_conversation_state.agent_thread = Thread(
+            target=dialogflow_api.maintained_streaming_analyze_content, args=(
+                agent_stream, participants["HUMAN_AGENT"], agent_audio_config))
+        open_conversation_state.user_thread = Thread(
+            target=dialogflow_api.maintained_streaming_analyze_content, args=(
+                customer_stream, participants["END_USER"], customer_audio_config))
+        resume_when_agent_joined(open_conversation_state, joined, audiohook, ws)
 
-    agent_thread = Thread(
-        target=dialogflow_api.maintained_streaming_analyze_content, args=(
-            agent_stream, participant_agent, agent_audio_config))
-    user_thread = Thread(
-        target=dialogflow_api.maintained_streaming_analyze_content, args=(
-            customer_stream, participant_user, customer_audio_config))
+    open_conversation_state.setup_thread = Thread(target=set_up_conversation)
+    open_conversation_state.setup_thread.start()
     ws.send(json.dumps(audiohook.create_opened_message()))
-    return OpenConversationState(
-        agent_thread,
-        user_thread,
-        conversation_name,
-        True)
+    logging.info("Sent opened message %.0f ms after open",
+                 (time.perf_counter() - open_time) * 1000)
+    return open_conversation_state
 
 
 def process_ongoing_conversation_messages(
@@ -143,8 +146,10 @@ def process_ongoing_conversation_messages(
             # closed to True, now after resume, need to flip the bit
             customer_stream.closed = False
             agent_stream.closed = False
-            open_conversation_state.agent_thread.start()
-            open_conversation_state.user_thread.start()
+            open_conversation_state.setup_thread.join()
+            if open_conversation_state.agent_thread is not None:
+                open_conversation_state.agent_thread.start()
+                open_conversation_state.user_thread.start()
         case "paused":
             customer_stream.closed = True
             agent_stream.closed = True
@@ -156,6 +161,8 @@ def process_ongoing_conversation_messages(
             agent_stream.terminate = True
             customer_stream.terminate = True
             ws.send(json.dumps(audiohook.create_close_message()))
+            # Don't complete a conversation being created
+            open_conversation_state.setup_thread.join()
             try:
                 dialogflow_api.complete_conversation(
                     open_conversation_state.conversation_name)
@@ -174,13 +181,21 @@ def process_ongoing_conversation_messages(
     return False
 
 
-def wait_for_redis_resume(open_conversation_state: OpenConversationState,
-                          audiohook: AudioHook, ws: Server):
-    await_redis(
-            open_conversation_state.conversation_name)
-    # Always send the resume after awaiting the redis, don't stop the audio streaming
-    # event if redis client is not set
+def resume_when_agent_joined(open_conversation_state: OpenConversationState,
+                             joined: Event, audiohook: AudioHook, ws: Server):
+    """Send the resume message once the agent joined the conversation, or at
+    the latest agent_join_timeout seconds after the "open" message
+    """
+    remaining = config.agent_join_timeout - (
+        time.perf_counter() - open_conversation_state.open_time)
+    if not wait_for_agent(open_conversation_state.conversation_name, joined, remaining):
+        logging.warning("Agent has not joined conversation %s, resuming anyway",
+                        open_conversation_state.conversation_name)
+    # Always send the resume, don't stop the audio streaming even if the
+    # agent has not joined yet
     ws.send(json.dumps(audiohook.create_resume_message()))
+    logging.info("Sent resume message %.0f ms after open",
+                 (time.perf_counter() - open_conversation_state.open_time) * 1000)
 
 
 @sock.route('/connect')
@@ -237,13 +252,6 @@ def audiohook_connect(ws: Server):
                     )
                     logging.debug(
                         "open conversation message %s ", open_conversation_state)
-                    # Check if the redis client has join_room called from the
-                    # agent assist backend. Before setting conversation_name in the redis client,
-                    # we should not publish any messages to the redis client
-                    # otherwise e UI modules will not receive pub/subs until redis connects the conversation
-                    await_redis_thread = Thread(target=wait_for_redis_resume, args=(
-                        open_conversation_state, audiohook, ws))
-                    await_redis_thread.start()
             elif message_type == "ping":
                 ws.send(json.dumps(audiohook.create_pong_message()))
             elif message_type == "close" and open_conversation_state is None:
@@ -266,12 +274,9 @@ def audiohook_connect(ws: Server):
         else:
             # audio is a 2-channel interleaved 8-bit PCMU audio stream
             # which is separated into single streams
-            # using numpy
             # stream the audio to pub/sub
-            array = np.frombuffer(data, dtype=np.int8)
-            reshaped = array.reshape(
-                (int(len(array) / 2), 2))
+            customer_audio, agent_audio = deinterleave(data)
             # append audio to customer audio buffer
-            customer_stream.fill_buffer(reshaped[:, 0].tobytes())
+            customer_stream.fill_buffer(customer_audio)
             # append audio to agent audio buffer
-            agent_stream.fill_buffer(reshaped[:, 1].tobytes())
+            agent_stream.fill_buffer(agent_audio)
@@ -37,6 +37,29 @@ class AudiohookConfig:
     rate: int = field(default=8000)
     chunk_size: int = field(default=1600)
     max_lookback: int = field(default=3)
+    # StreamingAnalyzeContent streams opened per second per project and location,
+    # shared by the Audiohook instances through Redis. 0 disables the rate limit
+    analyze_content_rate_limit: float = field(default=0)
+    rate_limit_burst_seconds: float = field(default=1)
+    rate_limit_max_wait: float = field(default=1)
+    # Seconds to wait before reopening a stream after exceeding the quota,
+    # doubled on each consecutive failure up to the maximum
+    quota_backoff: float = field(default=1)
+    max_quota_backoff: float = field(default=16)
+    # gRPC channels to each Dialogflow endpoint shared by the sessions. Each
+    # session streams on one channel, and a channel carries about 100 streams
+    grpc_channels: int = field(default=4)
+    # Seconds a conversation profile is used before reloading it in the
+    # background, and seconds it is still used while the reload fails
+    conversation_profile_ttl: float = field(default=300)
+    conversation_profile_max_stale: float = field(default=3600)
+    # Seconds after the "open" message to wait for the agent to join the
+    # conversation in the UI Connector before resuming the audio anyway
+    agent_join_timeout: float = field(default=1)
+    # Seconds before the maximum duration of a stream when the next stream is
+    # opened, to take the audio over at the next final transcript. 0 reopens
+    # the stream only once the current one is closed
+    rollover_lead: float = field(default=5)
 
     def __post_init__(self):
         """The os.environ can possible return NONE value, need a post process to handel missing values"""
@@ -71,5 +94,20 @@ config = AudiohookConfig(
     ui_connector_endpoint=os.environ.get(
         "UI_CONNECTOR"),
     redis_host=os.environ.get('REDISHOST'),
-    redis_port=int(os.environ.get('REDISPORT'))
+    redis_port=int(os.environ.get('REDISPORT')),
+    analyze_content_rate_limit=float(
+        os.environ.get("DIALOGFLOW_ANALYZE_CONTENT_RATE_LIMIT", 0)),
+    rate_limit_burst_seconds=float(
+        os.environ.get("DIALOGFLOW_RATE_LIMIT_BURST_SECONDS", 1)),
+    rate_limit_max_wait=float(
+        os.environ.get("DIALOGFLOW_RATE_LIMIT_MAX_WAIT", 1)),
+    quota_backoff=float(os.environ.get("DIALOGFLOW_QUOTA_BACKOFF", 1)),
+    max_quota_backoff=float(os.environ.get("DIALOGFLOW_MAX_QUOTA_BACKOFF", 16)),
+    grpc_channels=int(os.environ.get("DIALOGFLOW_GRPC_CHANNELS", 4)),
+    conversation_profile_ttl=float(
+        os.environ.get("CONVERSATION_PROFILE_TTL", 300)),
+    conversation_profile_max_stale=float(
+        os.environ.get("CONVERSATION_PROFILE_MAX_STALE", 3600)),
+    agent_join_timeout=float(os.environ.get("AGENT_JOIN_TIMEOUT", 1)),
+    rollover_lead=float(os.environ.get("STREAM_ROLLOVER_LEAD", 5))
 )
@@ -0,0 +1,932 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local benchmarks for the Audiohook service
+
+Benchmarks need neither a Genesys Cloud organization nor a Dialogflow project.
+Run them from the genesyscloud-audiohook folder, for example:
+    python benchmark.py startup
+    python benchmark.py lookback --minutes 60
+    python benchmark.py deinterleave
+    python benchmark.py buffer
+    python benchmark.py sessions --sessions 50 200
+    python benchmark.py clients
+    python benchmark.py rollover
+
+The sessions benchmark needs a Redis server at REDISHOST:REDISPORT, as the
+service itself
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import queue
+import random
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+from lazy_import import LazyModule
+
+os.environ.setdefault("API_KEY", "benchmark-api-key")
+os.environ.setdefault(
+    "CONVERSATION_PROFILE_NAME",
+    "projects/benchmark-project/locations/global/conversationProfiles/benchmark-profile")
+os.environ.setdefault("GCP_PROJECT_ID", "benchmark-project")
+os.environ.setdefault("UI_CONNECTOR", "http://localhost:8080")
+os.environ.setdefault("REDISHOST", "localhost")
+os.environ.setdefault("REDISPORT", "6379")
+
+dialogflow = LazyModule("google.cloud.dialogflow_v2beta1")
+
+# Imports main, then waits for the Dialogflow client library loaded in the
+# background, and prints both durations
+STARTUP_CODE = """
+import os, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+import dialogflow_api
+dialogflow_api.dialogflow.load()
+print(imported, time.perf_counter() - start, flush=True)
+os._exit(0)
+"""
+
+
+def parse_direct_imports(importtime_output: str) -> dict[str, float]:
+    """Get the cumulative import time in seconds of each module imported
+    directly by the imported module, from -X importtime output
+    """
+    imports = {}
+    for line in importtime_output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Names are indented by two spaces per nesting level
+        if cumulative.strip().isdigit() and name.startswith("   ") and not name.startswith("    "):
+            imports[name.strip()] = int(cumulative) / 1e6
+    return imports
+
+
+def benchmark_startup(args):
+    """Report the time to import main, the time until the Dialogflow client
+    library is loaded, and the slowest imports of the blueprint
+    """
+    imported, preloaded = [], []
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, "-c", STARTUP_CODE],
+                                capture_output=True, text=True, check=True)
+        import_seconds, preload_seconds = map(float, result.stdout.split()[-2:])
+        imported.append(import_seconds)
+        preloaded.append(preload_seconds)
+    print(f"runs={args.runs}")
+    for name, durations in [("import", imported), ("preloaded", preloaded)]:
+        print(f"{name:<12} p50={statistics.median(durations) * 1000:.0f}ms "
+              f"min={min(durations) * 1000:.0f}ms max={max(durations) * 1000:.0f}ms")
+    # Import the blueprint on its own, without main and its preload thread,
+    # so that only its own imports are listed
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import audiohook_blueprint"],
+                            capture_output=True, text=True, check=True)
+    imports = parse_direct_imports(result.stderr)
+    for name, cumulative in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative * 1000:>6.0f}ms {name}")
+
+
+def benchmark_lookback(args):
+    """Compare the memory and replay time of the lookback history over a
+    synthetic call, kept as a list of every chunk as before, or in an AudioRing
+    """
+    from audio_stream import AudioRing
+    from audiohook_config import config
+
+    rate, chunk_size = config.rate, config.chunk_size
+    chunks = int(args.minutes * 60 * rate / chunk_size)
+    restart_every = int(args.restart_seconds * rate / chunk_size)
+    lookback_bytes = int(config.max_lookback * rate)
+
+    def run_list():
+        history = []
+        replay_seconds = 0
+        for index in range(1, chunks + 1):
+            history.append(os.urandom(chunk_size))
+            if index % restart_every == 0:
+                start = time.perf_counter()
+                audio_bytes = b"".join(history)
+                audio_bytes[-lookback_bytes:]
+                replay_seconds += time.perf_counter() - start
+        return history, replay_seconds
+
+    def run_ring():
+        history = AudioRing(lookback_bytes)
+        replay_seconds = 0
+        for index in range(1, chunks + 1):
+            history.extend(os.urandom(chunk_size))
+            if index % restart_every == 0:
+                start = time.perf_counter()
+                history.tail(lookback_bytes)
+                replay_seconds += time.perf_counter() - start
+        return history, replay_seconds
+
+    print(f"minutes={args.minutes} rate={rate} chunk_size={chunk_size} "
+          f"restart_seconds={args.restart_seconds} max_lookback={config.max_lookback}s")
+    for name, run in [("list", run_list), ("ring", run_ring)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        history, replay_seconds = run()
+        elapsed = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del history
+        print(f"{name:<12} retained={retained / 2**20:.2f}MiB peak={peak / 2**20:.2f}MiB "
+              f"replay_total={replay_seconds * 1000:.1f}ms elapsed={elapsed * 1000:.0f}ms")
+
+
+def benchmark_deinterleave(args):
+    """Compare the frames split per second on one core by deinterleave and by
+    the numpy reshape it replaced, when numpy is installed
+    """
+    from audio_stream import deinterleave
+
+    def deinterleave_numpy(data):
+        array = np.frombuffer(data, dtype=np.int8)
+        reshaped = array.reshape((int(len(array) / 2), 2))
+        return reshaped[:, 0].tobytes(), reshaped[:, 1].tobytes()
+
+    frame = os.urandom(args.frame_bytes)
+    candidates = [("slices", deinterleave)]
+    try:
+        import numpy as np
+        assert deinterleave_numpy(frame) == deinterleave(frame)
+        candidates.insert(0, ("numpy", deinterleave_numpy))
+    except ImportError:
+        print("numpy is not installed, skipping the numpy baseline")
+    print(f"frames={args.frames} frame_bytes={args.frame_bytes}")
+    for name, split in candidates:
+        start = time.process_time()
+        for _ in range(args.frames):
+            split(frame)
+        elapsed = time.process_time() - start
+        print(f"{name:<12} frames_per_second={args.frames / elapsed:,.0f} "
+              f"per_frame={elapsed / args.frames * 1e6:.2f}us")
+
+
+def benchmark_buffer(args):
+    """Compare the throughput and the request sizes of the audio buffer between
+    the websocket and StreamingAnalyzeContent, as the queue and lock it replaced
+    or as an AudioBuffer, with a producer thread writing frames of varying size
+    """
+    from audio_stream import AudioBuffer, MAX_BUFFER_SECONDS
+    from audiohook_config import config
+
+    capacity, chunk_size = MAX_BUFFER_SECONDS * config.rate, config.chunk_size
+    sizes = [random.randint(args.frame_bytes // 2, args.frame_bytes * 3 // 2)
+             for _ in range(args.frames)]
+    frames = {size: os.urandom(size) for size in set(sizes)}
+
+    class QueueBuffer:
+        """The queue, lock and byte count previously kept by Stream"""
+
+        def __init__(self):
+            self._buff = queue.Queue()
+            self._lock = threading.Lock()
+            self.size = 0
+
+        def write(self, data):
+            with self._lock:
+                self._buff.put(data)
+                self.size += len(data)
+                while self.size > capacity:
+                    try:
+                        self.size -= len(self._buff.get_nowait())
+                    except queue.Empty:
+                        break
+
+        def read(self, length, timeout, stop):
+            try:
+                data = [self._buff.get(timeout=timeout)]
+            except queue.Empty:
+                return b""
+            while True:
+                try:
+                    data.append(self._buff.get(block=False))
+                except queue.Empty:
+                    break
+            with self._lock:
+                self.size -= sum(len(chunk) for chunk in data)
+            return b"".join(data)
+
+        def wake(self):
+            pass
+
+    print(f"frames={args.frames} frame_bytes={args.frame_bytes} chunk_size={chunk_size}")
+    for name, buff in [("queue", QueueBuffer()), ("ring", AudioBuffer(capacity))]:
+        done = threading.Event()
+
+        def produce():
+            for size in sizes:
+                buff.write(frames[size])
+            done.set()
+            buff.wake()
+
+        requests = []
+        producer = threading.Thread(target=produce)
+        start = time.perf_counter()
+        producer.start()
+        while True:
+            chunk = buff.read(chunk_size, 0.5, done.is_set)
+            if chunk:
+                requests.append(len(chunk))
+            elif done.is_set():
+                break
+        elapsed = time.perf_counter() - start
+        producer.join()
+        written = sum(sizes) / 2**20
+        print(f"{name:<12} written={written / elapsed:,.1f}MiB/s delivered={sum(requests) / elapsed:,.0f}B/s "
+              f"requests={len(requests)} size_mean={statistics.mean(requests):.0f} "
+              f"size_stdev={statistics.pstdev(requests):.0f} size_max={max(requests)}")
+
+
+class FakeDialogflow:
+    """Local stand-in for the Dialogflow methods called by Audiohook sessions,
+    answering unary calls after rpc_latency seconds, and recording the delay of
+    the customer audio it receives
+    """
+
+    PARTICIPANT_IDS = {dialogflow.Participant.Role.HUMAN_AGENT: "agent",
+                       dialogflow.Participant.Role.END_USER: "customer"}
+
+    def __init__(self, frame_channel_bytes: int, rpc_latency: float = 0):
+        self.frame_channel_bytes = frame_channel_bytes
+        self.rpc_latency = rpc_latency
+        self.latencies = []
+        self.customer_audio_bytes = 0
+        # Participants by conversation name
+        self.conversations = {}
+
+    async def get_conversation_profile(self, request, context):
+        await asyncio.sleep(self.rpc_latency)
+        return dialogflow.ConversationProfile(name=request.name)
+
+    async def create_conversation(self, request, context):
+        import grpc
+
+        await asyncio.sleep(self.rpc_latency)
+        name = f"{request.parent}/conversations/{request.conversation_id}"
+        if name in self.conversations:
+            await context.abort(grpc.StatusCode.ALREADY_EXISTS, f"{name} already exists")
+        self.conversations[name] = []
+        return dialogflow.Conversation(name=name)
+
+    async def get_conversation(self, request, context):
+        import grpc
+
+        await asyncio.sleep(self.rpc_latency)
+        if request.name not in self.conversations:
+            await context.abort(grpc.StatusCode.NOT_FOUND, f"{request.name} not found")
+        return dialogflow.Conversation(name=request.name)
+
+    async def list_participants(self, request, context):
+        await asyncio.sleep(self.rpc_latency)
+        return dialogflow.ListParticipantsResponse(
+            participants=self.conversations.get(request.parent, []))
+
+    async def create_participant(self, request, context):
+        await asyncio.sleep(self.rpc_latency)
+        role = request.participant.role
+        participant = dialogflow.Participant(
+            name=f"{request.parent}/participants/{self.PARTICIPANT_IDS[role]}", role=role)
+        self.conversations.setdefault(request.parent, []).append(participant)
+        return participant
+
+    async def complete_conversation(self, request, context):
+        await asyncio.sleep(self.rpc_latency)
+        return dialogflow.Conversation(name=request.name)
+
+    async def streaming_analyze_content(self, requests, context):
+        participant, audio_requests = "", 0
+        async for request in requests:
+            participant = request.participant or participant
+            if not request.input_audio:
+                continue
+            audio_requests += 1
+            if participant.endswith("/customer"):
+                audio = request.input_audio
+                self.customer_audio_bytes += len(audio)
+                # Each frame starts with the time it was sent, measure the delay of the last one
+                last_frame = (len(audio) - 1) // self.frame_channel_bytes * self.frame_channel_bytes
+                self.latencies.append(time.time() - struct.unpack("d", audio[last_frame:last_frame + 8])[0])
+            if audio_requests % 5 == 0:
+                yield dialogflow.StreamingAnalyzeContentResponse(
+                    recognition_result=dialogflow.StreamingRecognitionResult(transcript="benchmark"))
+
+    def handlers(self) -> list:
+        """Get the gRPC handlers of the fake methods"""
+        import grpc
+
+        def unary(method, request_type, response_type):
+            return grpc.unary_unary_rpc_method_handler(
+                method, request_deserializer=request_type.deserialize,
+                response_serializer=response_type.serialize)
+        services = {
+            "ConversationProfiles": {"GetConversationProfile": unary(
+                self.get_conversation_profile, dialogflow.GetConversationProfileRequest,
+                dialogflow.ConversationProfile)},
+            "Conversations": {
+                "CreateConversation": unary(self.create_conversation, dialogflow.CreateConversationRequest,
+                                            dialogflow.Conversation),
+                "GetConversation": unary(self.get_conversation, dialogflow.GetConversationRequest,
+                                         dialogflow.Conversation),
+                "CompleteConversation": unary(self.complete_conversation,
+                                              dialogflow.CompleteConversationRequest,
+                                              dialogflow.Conversation)},
+            "Participants": {
+                "ListParticipants": unary(self.list_participants, dialogflow.ListParticipantsRequest,
+                                          dialogflow.ListParticipantsResponse),
+                "CreateParticipant": unary(self.create_participant, dialogflow.CreateParticipantRequest,
+                                           dialogflow.Participant),
+                "StreamingAnalyzeContent": grpc.stream_stream_rpc_method_handler(
+                    self.streaming_analyze_content,
+                    request_deserializer=dialogflow.StreamingAnalyzeContentRequest.deserialize,
+                    response_serializer=dialogflow.StreamingAnalyzeContentResponse.serialize)},
+        }
+        return [grpc.method_handlers_generic_handler(f"google.cloud.dialogflow.v2beta1.{service}", methods)
+                for service, methods in services.items()]
+
+
+class FakeRecognizer(FakeDialogflow):
+    """Fake Dialogflow recognizing each WORD_BYTES of audio as a word, whose
+    number is read from the audio, with a final transcript every utterance
+    bytes. Its StreamingAnalyzeContent streams take latency seconds to start
+    recognizing, to emit a final transcript and to finish once half closed, and
+    fail with OUT_OF_RANGE after max_duration seconds of audio. Records when
+    each word is first recognized and finalized, and how each stream ends
+    """
+
+    WORD_BYTES = 800
+
+    def __init__(self, utterance_seconds: float, max_duration: float, latency: float):
+        super().__init__(self.WORD_BYTES)
+        self.utterance_bytes = int(utterance_seconds * 8000)
+        self.max_bytes = int(max_duration * 8000)
+        self.latency = latency
+        # Finalized time and words of every final transcript
+        self.finals = []
+        # Time each word was first received by a stream recognizing the audio
+        self.recognized = {}
+        self.streams = []
+
+    @staticmethod
+    def recognition_result(words: list, stream_bytes: int, is_final: bool):
+        return dialogflow.StreamingAnalyzeContentResponse(
+            recognition_result=dialogflow.StreamingRecognitionResult(
+                transcript=" ".join(map(str, words)), is_final=is_final,
+                speech_end_offset=datetime.timedelta(milliseconds=stream_bytes // 8)))
+
+    async def streaming_analyze_content(self, requests, context):
+        import grpc
+
+        stream = {"opened": time.time(), "recognizing": False, "end": "half-closed"}
+        self.streams.append(stream)
+        responses = asyncio.Queue()
+        finalizing = set()
+
+        async def finalize(words, stream_bytes):
+            await asyncio.sleep(self.latency)
+            self.finals.append((time.time(), words))
+            await responses.put(self.recognition_result(words, stream_bytes, True))
+
+        async def recognize():
+            # Stream positions and numbers of the words heard since the last final
+            words, stream_bytes, boundary = [], 0, self.utterance_bytes
+            async for request in requests:
+                audio = request.input_audio
+                if not audio:
+                    continue
+                if not stream["recognizing"]:
+                    await asyncio.sleep(stream["opened"] + self.latency - time.time())
+                    stream["recognizing"] = True
+                for index in range(0, len(audio) - 7, 8):
+                    offset = struct.unpack_from("<Q", audio, index)[0]
+                    if offset % self.WORD_BYTES == 0:
+                        words.append((stream_bytes + index, offset // self.WORD_BYTES))
+                        self.recognized.setdefault(offset // self.WORD_BYTES, time.time())
+                stream_bytes += len(audio)
+                if stream_bytes > self.max_bytes:
+                    stream["end"] = "out-of-range"
+                    await responses.put(grpc.StatusCode.OUT_OF_RANGE)
+                    return
+                while stream_bytes >= boundary:
+                    task = asyncio.create_task(finalize(
+                        [word for position, word in words if position < boundary], boundary))
+                    finalizing.add(task)
+                    words = [(position, word) for position, word in words if position >= boundary]
+                    boundary += self.utterance_bytes
+                await responses.put(self.recognition_result([], stream_bytes, False))
+            await asyncio.gather(*finalizing)
+            if words:
+                await finalize([word for _, word in words], stream_bytes)
+            await responses.put(None)
+
+        reader = asyncio.create_task(recognize())
+        try:
+            while (response := await responses.get()) is not None:
+                if response == grpc.StatusCode.OUT_OF_RANGE:
+                    await context.abort(response, "Exceeded maximum audio duration")
+                yield response
+        except asyncio.CancelledError:
+            # Words not finalized yet are dropped with the stream
+            stream["end"] = "cancelled"
+            raise
+        finally:
+            for task in [reader, *finalizing]:
+                task.cancel()
+
+
+def create_certificate(directory: str) -> tuple[str, str]:
+    """Create a self-signed certificate for localhost, and return the paths of
+    its key and certificate
+    """
+    key, certificate = os.path.join(directory, "key.pem"), os.path.join(directory, "cert.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-keyout", key, "-out", certificate, "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost"], capture_output=True, check=True)
+    return key, certificate
+
+
+async def start_fake_dialogflow(fake: FakeDialogflow, key: str, certificate: str):
+    """Serve the fake Dialogflow methods over TLS, as Dialogflow, and return
+    the server and its endpoint
+    """
+    import grpc
+
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers(fake.handlers())
+    with open(key, "rb") as key_file, open(certificate, "rb") as certificate_file:
+        credentials = grpc.ssl_server_credentials([(key_file.read(), certificate_file.read())])
+    port = server.add_secure_port("localhost:0", credentials)
+    await server.start()
+    return server, f"localhost:{port}"
+
+
+def fake_dialogflow_environment(certificate: str) -> dict:
+    """Get the environment of a process calling the fake Dialogflow service,
+    trusting its certificate
+    """
+    return dict(os.environ, GRPC_DEFAULT_SSL_ROOTS_FILE_PATH=certificate)
+
+
+def use_fake_dialogflow(endpoint: str):
+    """Call the fake Dialogflow service at endpoint instead of Dialogflow,
+    without credentials
+    """
+    from google.auth.credentials import AnonymousCredentials
+
+    import dialogflow_api
+    dialogflow_api._default_credentials.update(credentials=AnonymousCredentials(), project="benchmark-project")
+    dialogflow_api.determine_dialogflow_api_endpoint = lambda location: endpoint
+
+
+def serve_sessions(args):
+    """Run the server of args.mode calling the fake Dialogflow service at
+    args.fake_service, for the sessions benchmark
+    """
+    use_fake_dialogflow(args.fake_service)
+    if args.mode == "asyncio":
+        import async_server
+        asyncio.run(async_server.serve_audiohook("127.0.0.1", args.port))
+    else:
+        from werkzeug.serving import make_server
+
+        import main
+
+        # A thread per connection, unlike the fixed number of gunicorn threads
+        make_server("127.0.0.1", args.port, main.app, threaded=True).serve_forever()
+
+
+def read_process_stats(pid: int) -> dict:
+    """Get the resident memory, threads and CPU seconds of a process"""
+    stats = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "Threads"):
+                stats[name] = int(value.split()[0])
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    stats["cpu"] = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return stats
+
+
+async def run_audiohook_client(url: str, args, frame: bytes, setups: list):
+    """Open a conversation, stream args.seconds of audio in real time and close it,
+    as Audiohook Monitor. Append the seconds from "open" to "opened" and to
+    "resume" to setups. The agent joins args.join_delay milliseconds after
+    "open", or before it when negative
+    """
+    import redis
+    from websockets.asyncio.client import connect
+
+    session_id, seq = str(uuid.uuid4()), 0
+    conversation_id = str(uuid.uuid4())
+    redis_client = redis.Redis(host=os.environ["REDISHOST"], port=int(os.environ["REDISPORT"]))
+
+    async def join(delay=0):
+        await asyncio.sleep(delay)
+        # Join the conversation as the UI Connector does when the agent accepts the call
+        conversation_name = f"projects/benchmark-project/conversations/a{conversation_id}"
+        await asyncio.to_thread(redis_client.set, conversation_name, "benchmark", ex=600)
+        await asyncio.to_thread(redis_client.publish, f"joined:{conversation_name}", "benchmark")
+
+    if args.join_delay < 0:
+        await join()
+
+    async def send(message_type, parameters=None):
+        nonlocal seq
+        seq += 1
+        await ws.send(json.dumps({"version": "2", "type": message_type, "seq": seq,
+                                  "id": session_id, "parameters": parameters or {}}))
+
+    async def receive(message_type):
+        async for message in ws:
+            if json.loads(message)["type"] == message_type:
+                return
+
+    async with connect(url, max_size=None) as ws:
+        start = time.perf_counter()
+        await send("open", {"conversationId": conversation_id})
+        if args.join_delay >= 0:
+            joining = asyncio.create_task(join(args.join_delay / 1000))
+        await receive("opened")
+        opened = time.perf_counter() - start
+        await receive("resume")
+        setups.append((opened, time.perf_counter() - start))
+        await send("resumed")
+        loop = asyncio.get_running_loop()
+        frame_seconds = len(frame) / 2 / args.rate
+        start = loop.time()
+        frame = bytearray(frame)
+        for index in range(int(args.seconds / frame_seconds)):
+            # Stamp the customer channel, the even bytes of the frame
+            frame[0:16:2] = struct.pack("d", time.time())
+            await ws.send(bytes(frame))
+            await asyncio.sleep(start + (index + 1) * frame_seconds - loop.time())
+        await send("close")
+        await receive("closed")
+
+
+async def run_sessions(args, mode: str, sessions: int):
+    """Run sessions concurrent clients against a server subprocess of the mode,
+    and return the server statistics in the middle of the calls
+    """
+    fake = FakeDialogflow(args.frame_bytes // 2, args.rpc_latency / 1000)
+    fake_server, fake_endpoint = await start_fake_dialogflow(fake, *args.certificate)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, __file__, "sessions-server", "--mode", mode,
+                               "--port", str(port), "--fake-service", fake_endpoint],
+                              env=fake_dialogflow_environment(args.certificate[1]),
+                              stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", port)):
+                    break
+            except OSError:
+                await asyncio.sleep(0.1)
+        frame = os.urandom(args.frame_bytes)
+        url = f"ws://127.0.0.1:{port}/connect"
+
+        setups = []
+
+        async def start_client(index):
+            await asyncio.sleep(index * args.ramp / sessions)
+            await run_audiohook_client(url, args, frame, setups)
+
+        clients = asyncio.gather(*(start_client(index) for index in range(sessions)),
+                                 return_exceptions=True)
+        # Sample the server while every session is streaming
+        await asyncio.sleep(args.ramp + 2)
+        before, sampled = read_process_stats(server.pid), time.perf_counter()
+        await asyncio.sleep(args.seconds / 2)
+        after = read_process_stats(server.pid)
+        cpu = (after["cpu"] - before["cpu"]) / (time.perf_counter() - sampled)
+        errors = [result for result in await clients if isinstance(result, Exception)]
+    finally:
+        server.kill()
+        server.wait()
+        await fake_server.stop(None)
+    sent = sessions * int(args.seconds * args.rate / (args.frame_bytes // 2)) * (args.frame_bytes // 2)
+    latencies = sorted(fake.latencies) or [0]
+    opened = sorted(opened for opened, _ in setups) or [0]
+    resumed = sorted(resumed for _, resumed in setups) or [0]
+    return {
+        "opened": opened[len(opened) // 2], "resume": resumed[len(resumed) // 2],
+        "rss": after["VmRSS"] / 1024, "threads": after["Threads"], "cpu": cpu, "errors": len(errors),
+        "delivered": fake.customer_audio_bytes / sent,
+        "p50": latencies[len(latencies) // 2], "p99": latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def benchmark_sessions(args):
+    """Compare the resources and audio delays of the threaded and asyncio
+    servers, for concurrent sessions streaming audio in real time to a fake
+    Dialogflow service
+    """
+    from audiohook_config import config
+
+    args.rate = config.rate
+    print(f"seconds={args.seconds} frame_bytes={args.frame_bytes} chunk_size={config.chunk_size}")
+    with tempfile.TemporaryDirectory() as directory:
+        args.certificate = create_certificate(directory)
+        for sessions in args.sessions:
+            for mode in args.modes:
+                stats = asyncio.run(run_sessions(args, mode, sessions))
+                print(f"{mode:<8} sessions={sessions:<5} threads={stats['threads']:<5} "
+                      f"rss={stats['rss']:.0f}MiB cpu={stats['cpu'] * 100:.0f}% "
+                      f"audio_delay_p50={stats['p50'] * 1000:.0f}ms p99={stats['p99'] * 1000:.0f}ms "
+                      f"delivered={stats['delivered'] * 100:.1f}% errors={stats['errors']} "
+                      f"opened_p50={stats['opened'] * 1000:.0f}ms resume_p50={stats['resume'] * 1000:.0f}ms")
+
+
+def run_session_setups(args):
+    """Set up args.sessions sessions calling the fake Dialogflow service at
+    args.fake_service, keeping their Dialogflow API objects, and print the setup
+    durations and the memory they hold as JSON, for the clients benchmark
+    """
+    use_fake_dialogflow(args.fake_service)
+    from google.api_core.client_options import ClientOptions
+
+    import dialogflow_api
+    from audiohook_config import config
+
+    def create_per_session_api():
+        # As DialogflowAPI did before sharing its clients
+        api = object.__new__(dialogflow_api.DialogflowAPI)
+        credentials = dialogflow_api.get_default_credentials()[0]
+        client_options = ClientOptions(api_endpoint=args.fake_service)
+        api.participants_client = dialogflow.ParticipantsClient(
+            credentials=credentials, client_options=client_options)
+        api.conversations_client = dialogflow.ConversationsClient(
+            credentials=credentials, client_options=client_options)
+        api.conversation_profiles_client = dialogflow.ConversationProfilesClient(
+            credentials=credentials, client_options=client_options)
+        return api
+
+    create_api = create_per_session_api if args.mode == "per-session" else dialogflow_api.DialogflowAPI
+    conversation_name = dialogflow_api.create_conversation_name(
+        "benchmark-conversation", dialogflow_api.location_id, "benchmark-project")
+    dialogflow.load()
+    apis, setups = [], []
+    before = read_process_stats(os.getpid())["VmRSS"]
+    for _ in range(args.sessions):
+        start = time.perf_counter()
+        api = create_api()
+        api.get_conversation_profile(config.conversation_profile_name)
+        api.list_participant(conversation_name)
+        setups.append(time.perf_counter() - start)
+        apis.append(api)
+    after = read_process_stats(os.getpid())["VmRSS"]
+    print(json.dumps({"setups": setups, "memory": (after - before) * 1024 / args.sessions}))
+
+
+def benchmark_clients(args):
+    """Compare the session setup latency and the memory per session of
+    Dialogflow clients created for each session, as before, or shared by the
+    sessions, against a fake Dialogflow service over TLS
+    """
+    async def run(mode, certificate):
+        fake_server, fake_endpoint = await start_fake_dialogflow(FakeDialogflow(800), *certificate)
+        try:
+            setups = await asyncio.create_subprocess_exec(
+                sys.executable, __file__, "clients-run", "--mode", mode, "--sessions", str(args.sessions),
+                "--fake-service", fake_endpoint, env=fake_dialogflow_environment(certificate[1]),
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            stdout, _ = await setups.communicate()
+        finally:
+            await fake_server.stop(None)
+        return json.loads(stdout.splitlines()[-1])
+
+    print(f"sessions={args.sessions}")
+    with tempfile.TemporaryDirectory() as directory:
+        certificate = create_certificate(directory)
+        for mode in ["per-session", "shared"]:
+            stats = asyncio.run(run(mode, certificate))
+            setups = sorted(stats["setups"])
+            print(f"{mode:<12} setup_first={stats['setups'][0] * 1000:.1f}ms "
+                  f"p50={setups[len(setups) // 2] * 1000:.1f}ms p99={setups[int(len(setups) * 0.99)] * 1000:.1f}ms "
+                  f"memory_per_session={stats['memory'] / 1024:.0f}KiB")
+
+
+def run_rollover_stream(args):
+    """Stream args.seconds of audio of one participant with the API of args.mode
+    to the fake Dialogflow service at args.fake_service, and print the times the
+    words were sent as JSON, for the rollover benchmark
+    """
+    use_fake_dialogflow(args.fake_service)
+    import audio_stream
+    import dialogflow_api
+    from audiohook_config import config
+
+    # Scale the maximum stream duration down, so that the call rolls over a few times
+    audio_stream.SINGLE_STREAM_MAX_DURATION = args.max_duration * 1000
+    config.rollover_lead = args.lead
+    participant = dialogflow.Participant(
+        name="projects/benchmark-project/locations/global/conversations/rollover/participants/customer",
+        role=dialogflow.Participant.Role.END_USER)
+    audio_config = audio_stream.create_audio_config(dialogflow.ConversationProfile(), config.rate)
+    word_bytes, word_seconds = FakeRecognizer.WORD_BYTES, FakeRecognizer.WORD_BYTES / config.rate
+    # Each 8 bytes of audio hold their offset in the call
+    words = [struct.pack(f"<{word_bytes // 8}Q", *range(index * word_bytes, (index + 1) * word_bytes, 8))
+             for index in range(int(args.seconds / word_seconds))]
+    sent = []
+
+    if args.mode == "threads":
+        stream = audio_stream.Stream(config.rate, config.chunk_size)
+        streaming = threading.Thread(
+            target=dialogflow_api.DialogflowAPI().maintained_streaming_analyze_content,
+            args=(stream, participant, audio_config))
+        streaming.start()
+        start = time.perf_counter()
+        for index, word in enumerate(words):
+            stream.fill_buffer(word)
+            sent.append(time.time())
+            time.sleep(max(start + (index + 1) * word_seconds - time.perf_counter(), 0))
+        stream.terminate = True
+        stream.closed = True
+        streaming.join()
+    else:
+        async def run():
+            stream = audio_stream.Stream(config.rate, config.chunk_size, asynchronous=True)
+            streaming = asyncio.create_task(
+                dialogflow_api.AsyncDialogflowAPI().maintained_streaming_analyze_content(
+                    stream, participant, audio_config))
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            for index, word in enumerate(words):
+                stream.fill_buffer(word)
+                sent.append(time.time())
+                await asyncio.sleep(start + (index + 1) * word_seconds - loop.time())
+            stream.terminate = True
+            stream.closed = True
+            await streaming
+        asyncio.run(run())
+    print(json.dumps({"sent": sent}))
+
+
+def benchmark_rollover(args):
+    """Compare the transcription gap and latency around the rollovers of the
+    stream of a participant, reopened once closed as before, or opened ahead
+    and handed the audio over, against a fake recognizer
+    """
+    async def run(mode, lead, certificate):
+        fake = FakeRecognizer(args.utterance_seconds, args.max_duration * 1.5, args.latency / 1000)
+        fake_server, fake_endpoint = await start_fake_dialogflow(fake, *certificate)
+        try:
+            streaming = await asyncio.create_subprocess_exec(
+                sys.executable, __file__, "rollover-run", "--mode", mode, "--lead", str(lead),
+                "--seconds", str(args.seconds), "--max-duration", str(args.max_duration),
+                "--fake-service", fake_endpoint, env=fake_dialogflow_environment(certificate[1]),
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            stdout, _ = await streaming.communicate()
+        finally:
+            await fake_server.stop(None)
+        return fake, json.loads(stdout.splitlines()[-1])["sent"]
+
+    print(f"seconds={args.seconds} max_duration={args.max_duration}s utterance={args.utterance_seconds}s "
+          f"latency={args.latency:.0f}ms")
+    with tempfile.TemporaryDirectory() as directory:
+        certificate = create_certificate(directory)
+        for mode in args.modes:
+            for rollover, lead in [("reopen", 0), ("handover", args.lead)]:
+                fake, sent = asyncio.run(run(mode, lead, certificate))
+                finalized = [word for _, words in fake.finals for word in words]
+                lost = len(set(range(len(sent))) - set(finalized))
+                duplicated = len(finalized) - len(set(finalized))
+                # Delay of the words before a stream recognizes them, the gap around
+                # the rollovers, after the first stream started recognizing
+                delays = sorted(fake.recognized[word] - sent[word] for word in fake.recognized
+                                if sent[word] > sent[0] + 1)
+                streams = [stream for stream in fake.streams if stream["recognizing"]]
+                # Delay of each final transcript after its last word was sent
+                latencies = sorted(finalized_time - sent[max(words)] for finalized_time, words in fake.finals if words)
+                print(f"{mode:<8} {rollover:<9} rollovers={len(streams) - 1} "
+                      f"audio_delay_p50={delays[len(delays) // 2] * 1000:.0f}ms max={delays[-1] * 1000:.0f}ms "
+                      f"final_latency_p50={latencies[len(latencies) // 2] * 1000:.0f}ms "
+                      f"max={latencies[-1] * 1000:.0f}ms "
+                      f"lost_words={lost} duplicated_words={duplicated} "
+                      f"ends={','.join(stream['end'] for stream in streams[:-1])}")
+
+
+BENCHMARKS = {
+    "startup": benchmark_startup,
+    "lookback": benchmark_lookback,
+    "deinterleave": benchmark_deinterleave,
+    "buffer": benchmark_buffer,
+    "sessions": benchmark_sessions,
+    "sessions-server": serve_sessions,
+    "clients": benchmark_clients,
+    "clients-run": run_session_setups,
+    "rollover": benchmark_rollover,
+    "rollover-run": run_rollover_stream,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    startup = subparsers.add_parser(
+        "startup", help="Cold start import time of the service, to track regressions.")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--top", type=int, default=10,
+                         help="Number of slowest imports of the blueprint listed.")
+    lookback = subparsers.add_parser(
+        "lookback", help="Memory of the lookback history of one channel over a long call.")
+    lookback.add_argument("--minutes", type=float, default=60)
+    lookback.add_argument("--restart-seconds", type=float, default=90,
+                          help="Seconds between stream restarts, each replaying the lookback.")
+    deinterleave = subparsers.add_parser(
+        "deinterleave", help="Frames of stereo audio split into channels per second on one core.")
+    deinterleave.add_argument("--frames", type=int, default=200000)
+    deinterleave.add_argument("--frame-bytes", type=int, default=1600,
+                              help="Size of a binary frame, 1600 bytes is 100 ms of stereo PCMU.")
+    buffer = subparsers.add_parser(
+        "buffer", help="Throughput and request sizes of the audio buffer of one channel.")
+    buffer.add_argument("--frames", type=int, default=200000)
+    buffer.add_argument("--frame-bytes", type=int, default=800,
+                        help="Average size of the audio written at once, 800 bytes is 100 ms of PCMU.")
+    sessions = subparsers.add_parser(
+        "sessions", help="Resources and audio delays of concurrent sessions per server mode.")
+    sessions.add_argument("--sessions", type=int, nargs="+", default=[50, 200])
+    sessions.add_argument("--modes", nargs="+", choices=["threads", "asyncio"],
+                          default=["threads", "asyncio"])
+    sessions.add_argument("--seconds", type=float, default=20,
+                          help="Duration of the audio streamed by each session.")
+    sessions.add_argument("--ramp", type=float, default=5,
+                          help="Seconds over which the sessions are opened.")
+    sessions.add_argument("--frame-bytes", type=int, default=1600)
+    sessions.add_argument("--rpc-latency", type=float, default=30,
+                          help="Milliseconds taken by the fake Dialogflow service to answer unary calls.")
+    sessions.add_argument("--join-delay", type=float, default=-1,
+                          help="Milliseconds after \"open\" when the agent joins, before \"open\" if negative.")
+    # Run by the sessions benchmark
+    sessions_server = subparsers.add_parser("sessions-server")
+    sessions_server.add_argument("--mode", choices=["threads", "asyncio"])
+    sessions_server.add_argument("--port", type=int)
+    sessions_server.add_argument("--fake-service")
+    clients = subparsers.add_parser(
+        "clients", help="Session setup latency and memory per session of the Dialogflow clients.")
+    clients.add_argument("--sessions", type=int, default=200)
+    # Run by the clients benchmark
+    clients_run = subparsers.add_parser("clients-run")
+    clients_run.add_argument("--mode", choices=["per-session", "shared"])
+    clients_run.add_argument("--sessions", type=int)
+    clients_run.add_argument("--fake-service")
+    rollover = subparsers.add_parser(
+        "rollover", help="Transcription gap and latency around the rollovers of a stream.")
+    rollover.add_argument("--modes", nargs="+", choices=["threads", "asyncio"],
+                          default=["threads", "asyncio"])
+    rollover.add_argument("--seconds", type=float, default=60,
+                          help="Duration of the audio streamed.")
+    rollover.add_argument("--max-duration", type=float, default=15,
+                          help="Seconds of audio after which a stream rolls over, 90 in the service.")
+    rollover.add_argument("--lead", type=float, default=3,
+                          help="Seconds before the maximum duration when the next stream is opened.")
+    rollover.add_argument("--utterance-seconds", type=float, default=2,
+                          help="Seconds of audio between final transcripts.")
+    rollover.add_argument("--latency", type=float, default=300,
+                          help="Milliseconds the fake recognizer takes to start, finalize and finish.")
+    # Run by the rollover benchmark
+    rollover_run = subparsers.add_parser("rollover-run")
+    rollover_run.add_argument("--mode", choices=["threads", "asyncio"])
+    rollover_run.add_argument("--lead", type=float)
+    rollover_run.add_argument("--seconds", type=float)
+    rollover_run.add_argument("--max-duration", type=float)
+    rollover_run.add_argument("--fake-service")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,27 +16,63 @@
 dialogflow_v2beta1 API version
 Reference: https://cloud.google.com/python/docs/reference/dialogflow/latest/google.cloud.dialogflow_v2beta1
 """
+from __future__ import annotations
+
+import asyncio
+import itertools
 import logging
 import re
+import threading
 import time
+from concurrent import futures
+from dataclasses import dataclass
 
 import google.auth
 import redis
-from google.api_core.client_options import ClientOptions
-from google.api_core.exceptions import FailedPrecondition, OutOfRange, ResourceExhausted
-from google.cloud import dialogflow_v2beta1 as dialogflow
+from google.api_core.exceptions import (AlreadyExists, FailedPrecondition, GoogleAPICallError,
+                                        OutOfRange, ResourceExhausted)
 
-from audio_stream import Stream
+from audio_stream import Stream, create_audio_config
 from audiohook_config import config
+from lazy_import import LazyModule
+from rate_limiter import RateLimiter
+
+# Importing the Dialogflow client library takes about a second, it is loaded
+# on first use or by preload in the background
+dialogflow = LazyModule("google.cloud.dialogflow_v2beta1")
+
+# Channel prefix of the signals published by the UI Connector when an agent
+# joins a conversation, followed by the conversation name without location
+AGENT_JOINED_CHANNEL = "joined:"
+# Seconds to wait before subscribing again to the signals after a Redis error
+AGENT_JOINED_RESUBSCRIBE_SECONDS = 1
 
-# Wait for 2 units of 0.5 second for the redis client to set conversation name
-AWAIT_REDIS_COUNTER = 2
-AWAIT_REDIS_SECOND_PER_COUNTER = 0.5
 LOCATION_ID_REGEX = r"^projects\/[^/]+\/locations\/([^/]+)"
+PROJECT_LOCATION_REGEX = r"^projects\/([^/]+)\/locations\/([^/]+)"
+
+# Keep the connections to Dialogflow alive between the sessions sharing them,
+# with pings every 30 seconds as allowed by Google front ends
+GRPC_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.max_receive_message_length", -1),
+]
 
-credentials, project = google.auth.default()
+_default_credentials = {}
+_default_credentials_lock = threading.Lock()
+# Dialogflow clients shared by the sessions, by API endpoint, and the count of
+# borrowed clients to take them in turn
+_clients = {}
+_clients_lock = threading.Lock()
+# Dialogflow asyncio clients by event loop, then by API endpoint, until the
+# loop closes them
+_async_clients = {}
+_borrowed_clients = itertools.count()
 redis_client = redis.StrictRedis(
     host=config.redis_host, port=config.redis_port)
+analyze_content_rate_limiter = RateLimiter(
+    redis_client, "streaming-analyze-content", config.analyze_content_rate_limit,
+    config.rate_limit_burst_seconds)
 
 
 try:
@@ -47,6 +83,97 @@ except Exception as e:
         "Conversation profile name is not in correct format") from e
 
 
+def get_default_credentials() -> tuple:
+    """Load the application default credentials and project on first use
+    """
+    with _default_credentials_lock:
+        if not _default_credentials:
+            _default_credentials["credentials"], _default_credentials["project"] = google.auth.default()
+    return _default_credentials["credentials"], _default_credentials["project"]
+
+
+def get_default_project() -> str:
+    """Get the project of the application default credentials
+    """
+    return get_default_credentials()[1]
+
+
+def preload(conversation_profile: bool = True):
+    """Load the Dialogflow client library, the default credentials and the
+    conversation profile, so that the first call does not wait for them
+    """
+    start_time = time.perf_counter()
+    try:
+        dialogflow.load()
+        get_default_credentials()
+        if conversation_profile:
+            DialogflowAPI().load_conversation_profile(config.conversation_profile_name)
+    except Exception as e:
+        logging.warning("Error preloading Dialogflow dependencies %s", e)
+        return
+    logging.info("Preloaded Dialogflow dependencies in %.0f ms",
+                 (time.perf_counter() - start_time) * 1000)
+
+
+@dataclass
+class CachedConversationProfile:
+    """Conversation profile with the audio config of its streams"""
+    profile: dialogflow.ConversationProfile
+    audio_config: dialogflow.InputAudioConfig
+    loaded_at: float
+
+
+class ConversationProfileCache:
+    """Conversation profiles kept for ttl seconds. Once stale, a profile is
+    still used for up to max_stale seconds while it is reloaded in the background
+    """
+
+    def __init__(self, ttl: float, max_stale: float):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._profiles = {}
+        self._reloading = set()
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> tuple[CachedConversationProfile | None, bool]:
+        """Get a cached profile, None if it must be loaded, and whether the
+        caller should reload it in the background
+        """
+        with self._lock:
+            cached = self._profiles.get(name)
+            if cached is None:
+                return None, False
+            age = time.monotonic() - cached.loaded_at
+            if age > self.ttl + self.max_stale:
+                return None, False
+            if age <= self.ttl or name in self._reloading:
+                return cached, False
+            self._reloading.add(name)
+            return cached, True
+
+    def put(self, name: str, profile: dialogflow.ConversationProfile) -> CachedConversationProfile:
+        """Cache a loaded profile, with the audio config derived from it"""
+        cached = CachedConversationProfile(
+            profile, create_audio_config(profile, config.rate), time.monotonic())
+        with self._lock:
+            self._profiles[name] = cached
+            self._reloading.discard(name)
+        return cached
+
+    def reload_failed(self, name: str, error: Exception):
+        logging.warning("Error reloading conversation profile %s, using the cached one %s", name, error)
+        with self._lock:
+            self._reloading.discard(name)
+
+
+conversation_profile_cache = ConversationProfileCache(
+    config.conversation_profile_ttl, config.conversation_profile_max_stale)
+# Background reloads of the asyncio server, referenced until they are done
+_reload_tasks = set()
+# Roles of the participants streaming the audio of a conversation
+PARTICIPANT_ROLES = ("HUMAN_AGENT", "END_USER")
+
+
 def determine_dialogflow_api_endpoint(location: str) -> str:
     """Get Dialogflow api endpoint
     Reference: https://cloud.google.com/dialogflow/es/docs/reference/rest/v2-overview#service-endpoint
@@ -58,6 +185,72 @@ def determine_dialogflow_api_endpoint(location: str) -> str:
     return dialogflow_endpoint
 
 
+@dataclass
+class DialogflowClients:
+    """Dialogflow clients sharing one gRPC channel"""
+    participants_client: dialogflow.ParticipantsClient | dialogflow.ParticipantsAsyncClient
+    conversations_client: dialogflow.ConversationsClient | dialogflow.ConversationsAsyncClient
+    conversation_profiles_client: (dialogflow.ConversationProfilesClient
+                                   | dialogflow.ConversationProfilesAsyncClient)
+
+
+def create_dialogflow_clients(api_endpoint: str, asynchronous: bool = False) -> DialogflowClients:
+    """Create the Dialogflow clients of an endpoint over a new gRPC channel"""
+    transport_name = "grpc_asyncio" if asynchronous else "grpc"
+    client_classes = [
+        (dialogflow.ParticipantsAsyncClient if asynchronous else dialogflow.ParticipantsClient,
+         dialogflow.ParticipantsClient.get_transport_class(transport_name)),
+        (dialogflow.ConversationsAsyncClient if asynchronous else dialogflow.ConversationsClient,
+         dialogflow.ConversationsClient.get_transport_class(transport_name)),
+        (dialogflow.ConversationProfilesAsyncClient if asynchronous else dialogflow.ConversationProfilesClient,
+         dialogflow.ConversationProfilesClient.get_transport_class(transport_name)),
+    ]
+    host = api_endpoint if ":" in api_endpoint else f"{api_endpoint}:443"
+    channel = client_classes[0][1].create_channel(
+        host, credentials=get_default_credentials()[0], options=GRPC_CHANNEL_OPTIONS)
+    logging.info("Created Dialogflow gRPC channel to %s", host)
+    return DialogflowClients(*(
+        client_class(transport=transport_class(host=host, channel=channel))
+        for client_class, transport_class in client_classes))
+
+
+def get_dialogflow_clients(api_endpoint: str) -> DialogflowClients:
+    """Borrow the Dialogflow clients of an endpoint, shared by every session of
+    the process so that they don't open new connections. The clients are thread
+    safe, and sessions take the clients of the channels of the pool in turn, as
+    each connection carries a limited number of concurrent streams
+    """
+    with _clients_lock:
+        if api_endpoint not in _clients:
+            _clients[api_endpoint] = [create_dialogflow_clients(api_endpoint)
+                                      for _ in range(config.grpc_channels)]
+        pool = _clients[api_endpoint]
+    return pool[next(_borrowed_clients) % len(pool)]
+
+
+def get_async_dialogflow_clients(api_endpoint: str) -> DialogflowClients:
+    """Same as get_dialogflow_clients for the sessions of the running event loop,
+    as asyncio gRPC channels can only be used by the event loop creating them
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if api_endpoint not in clients:
+        clients[api_endpoint] = [create_dialogflow_clients(api_endpoint, asynchronous=True)
+                                 for _ in range(config.grpc_channels)]
+    pool = clients[api_endpoint]
+    return pool[next(_borrowed_clients) % len(pool)]
+
+
+async def close_async_dialogflow_clients():
+    """Close the channels of the Dialogflow clients of the running event loop,
+    which would otherwise keep the loop and its connections alive
+    """
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for pool in clients.values():
+        for dialogflow_clients in pool:
+            # The clients of a pool entry share one channel
+            await dialogflow_clients.participants_client.transport.close()
+
+
 def create_conversation_name(conversation_id: str, location_id: str, project: str) -> str:
     """Set conversation name for the object
     """
@@ -76,6 +269,39 @@ def find_participant_by_role(role: dialogflow.Participant.Role, participants_lis
     return None
 
 
+def find_missing_roles(participants_list: list[dialogflow.Participant]) -> list[str]:
+    """Get the roles of PARTICIPANT_ROLES without a participant"""
+    return [role for role in PARTICIPANT_ROLES
+            if not find_participant_by_role(dialogflow.Participant.Role[role], participants_list)]
+
+
+def process_streaming_analyze_content_response(
+        audio_stream: Stream,
+        participant: dialogflow.Participant,
+        response: dialogflow.StreamingAnalyzeContentResponse):
+    """Track the recognition offsets of the stream from a StreamingAnalyzeContent response
+    """
+    audio_stream.speech_end_offset = response.recognition_result.speech_end_offset.seconds * 1000
+    logging.debug(response)
+    if response.recognition_result.is_final:
+        audio_stream.is_final = True
+        logging.debug(
+            "Final transcript for %s: %s, and is final offset",
+            participant.role.name,
+            response.recognition_result.transcript,
+        )
+        offset = response.recognition_result.speech_end_offset
+        audio_stream.is_final_offset = int(
+            offset.seconds * 1000 + offset.microseconds / 1000
+        )
+    if response.recognition_result:
+        logging.debug(
+            "Role %s: Interim response recognition result transcript: %s, time %s",
+            participant.role.name,
+            response.recognition_result.transcript,
+            response.recognition_result.speech_end_offset)
+
+
 class DialogflowAPI:
     """Class for interacting with the Dialogflow API
     """
@@ -84,20 +310,10 @@ class DialogflowAPI:
 
         self.api_endpoint = determine_dialogflow_api_endpoint(
             location_id)
-        self.participants_client = dialogflow.ParticipantsClient(
-            credentials=credentials,
-            client_options=ClientOptions(
-                api_endpoint=self.api_endpoint)
-        )
-        self.conversations_client = dialogflow.ConversationsClient(
-            credentials=credentials,
-            client_options=ClientOptions(
-                api_endpoint=self.api_endpoint
-            )
-        )
-        self.conversation_profiles_client = dialogflow.ConversationProfilesClient(
-            credentials=credentials, client_options=ClientOptions(
-                api_endpoint=self.api_endpoint))
+        clients = get_dialogflow_clients(self.api_endpoint)
+        self.participants_client = clients.participants_client
+        self.conversations_client = clients.conversations_client
+        self.conversation_profiles_client = clients.conversation_profiles_client
 
     def get_conversation_profile(
             self,
@@ -112,6 +328,31 @@ class DialogflowAPI:
             )
         )
 
+    def load_conversation_profile(
+            self,
+            conversation_profile_name: str) -> CachedConversationProfile:
+        """Get the conversation profile from the cache, loading it when missing
+        and reloading it in the background when stale
+        """
+        cached, reload = conversation_profile_cache.get(conversation_profile_name)
+        if cached is None:
+            return conversation_profile_cache.put(
+                conversation_profile_name,
+                self.get_conversation_profile(conversation_profile_name))
+        if reload:
+            threading.Thread(
+                target=self.reload_conversation_profile,
+                args=(conversation_profile_name,), daemon=True).start()
+        return cached
+
+    def reload_conversation_profile(self, conversation_profile_name: str):
+        try:
+            conversation_profile_cache.put(
+                conversation_profile_name,
+                self.get_conversation_profile(conversation_profile_name))
+        except Exception as e:
+            conversation_profile_cache.reload_failed(conversation_profile_name, e)
+
     def create_conversation(
             self,
             conversation_profile: dialogflow.ConversationProfile,
@@ -123,7 +364,7 @@ class DialogflowAPI:
             conversation_profile=conversation_profile.name
         )
         project_path = self.conversations_client.common_location_path(
-            project, location_id)
+            get_default_project(), location_id)
         conversation_request = dialogflow.CreateConversationRequest(
             parent=project_path,
             conversation=conversation,
@@ -187,6 +428,33 @@ class DialogflowAPI:
 
         return participant
 
+    def set_up_conversation(
+            self,
+            conversation_profile: dialogflow.ConversationProfile,
+            conversation_id: str) -> dict[str, dialogflow.Participant]:
+        """Create the conversation and its participants, or get those that
+        already exist, and return the participants by role.
+        The conversation is created first as it usually does not exist yet, and
+        the participants are created concurrently
+        """
+        conversation_name = create_conversation_name(
+            conversation_id, location_id, get_default_project())
+        participants_list = []
+        try:
+            self.create_conversation(conversation_profile, conversation_id)
+        except AlreadyExists:
+            logging.info("Conversation %s already exists", conversation_name)
+            participants_list = self.list_participant(conversation_name)
+        # One thread per missing role, so that the threads scale with the
+        # sessions being set up rather than queue behind a shared pool
+        with futures.ThreadPoolExecutor(
+                max_workers=len(PARTICIPANT_ROLES), thread_name_prefix="setup") as executor:
+            participants_list.extend(executor.map(
+                lambda role: self.create_participant(conversation_name, role),
+                find_missing_roles(participants_list)))
+        return {role: find_participant_by_role(dialogflow.Participant.Role[role], participants_list)
+                for role in PARTICIPANT_ROLES}
+
     def maintained_streaming_analyze_content(
             self,
             audio_stream: Stream,
@@ -197,62 +465,127 @@ class DialogflowAPI:
         """
         logging.debug("Call streaming analyze content %s, %s",
                       audio_stream.closed, audio_stream.is_final)
+        backoff = config.quota_backoff
         while not audio_stream.terminate:
             # while not audio_stream.is_final and not audio_stream.closed:
             while not audio_stream.closed:
-                self.streaming_analyze_content(
-                    audio_stream,
-                    participant,
-                    audio_config)
+                if self.streaming_analyze_content(
+                        audio_stream,
+                        participant,
+                        audio_config):
+                    # Keep buffering the audio and reopen the stream after a backoff
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, config.max_quota_backoff)
+                else:
+                    backoff = config.quota_backoff
 
     def streaming_analyze_content(
             self,
             audio_stream: Stream,
             participant: dialogflow.Participant,
-            audio_config: dialogflow.InputAudioConfig):
+            audio_config: dialogflow.InputAudioConfig) -> bool:
         """Call dialogflow backend StreamingAnalyzeContent endpoint,
         and send the audio binary stream from Audiohook.
+        Return True when the stream could not be opened within the quota
         """
+        project, location = re.match(
+            PROJECT_LOCATION_REGEX, participant.name).groups()
+        scope = f"{project}/{location}"
+        standby, audio_stream.standby = audio_stream.standby, None
+        if standby is None and analyze_content_rate_limiter.acquire(
+                scope, config.rate_limit_max_wait) is None:
+            logging.warning(
+                "Rate limit exceeded for streaming analyze content %s", participant.name)
+            return True
+        handed_over = False
         try:
-            logging.debug("call streaming analyze content for %s", participant)
-            responses = self.participants_client.streaming_analyze_content(
-                requests=self.generator_streaming_analyze_content_request(
-                    audio_config, participant, audio_stream))
+            if standby is not None:
+                try:
+                    responses = standby.result()
+                except GoogleAPICallError as e:
+                    logging.warning("Error in the stream opened ahead of the rollover %s", e)
+                    return False
+            else:
+                logging.debug("call streaming analyze content for %s", participant)
+                responses = self.participants_client.streaming_analyze_content(
+                    requests=self.generator_streaming_analyze_content_request(
+                        audio_config, participant, audio_stream))
             for response in responses:
-                audio_stream.speech_end_offset = response.recognition_result.speech_end_offset.seconds * 1000
-                logging.debug(response)
-                if response.recognition_result.is_final:
-                    audio_stream.is_final = True
-                    logging.debug(
-                        "Final transcript for %s: %s, and is final offset",
-                        participant.role.name,
-                        response.recognition_result.transcript,
-                    )
-                    offset = response.recognition_result.speech_end_offset
-                    audio_stream.is_final_offset = int(
-                        offset.seconds * 1000 + offset.microseconds / 1000
-                    )
-                if response.recognition_result:
-                    logging.debug(
-                        "Role %s: Interim response recognition result transcript: %s, time %s",
-                        participant.role.name,
-                        response.recognition_result.transcript,
-                        response.recognition_result.speech_end_offset)
+                process_streaming_analyze_content_response(
+                    audio_stream, participant, response)
+                if self.roll_over(audio_stream, participant, audio_config, response, scope):
+                    # The next stream replays the audio after the last final
+                    # transcript, cancel this one rather than transcribe it twice
+                    handed_over = True
+                    responses.cancel()
+                    break
         except OutOfRange as e:
             logging.warning(
                 "The single audio stream exceeded maximum duration restrictions %s ", e)
             # return to restart the stream.
-            return
+            return False
         except FailedPrecondition as e:
             audio_stream.closed = True
             logging.warning(
                 "Failed the precondition check for StreamingAnalyzeContent %s ", e)
-            return
+            return False
         except ResourceExhausted as e:
-            audio_stream.closed = True
             logging.warning(
                 "Exceed quota for calling streaming analyze content %s ", e)
-            return
+            return True
+        finally:
+            if not handed_over:
+                audio_stream.cancel_standby()
+        return False
+
+    def roll_over(
+            self,
+            audio_stream: Stream,
+            participant: dialogflow.Participant,
+            audio_config: dialogflow.InputAudioConfig,
+            response: dialogflow.StreamingAnalyzeContentResponse,
+            scope: str) -> bool:
+        """Open the next stream shortly before the current one reaches its
+        maximum duration, and hand the audio over to it at the next final
+        transcript. Return True once handed over
+        """
+        if audio_stream.rollover_due():
+            # Each call waits for its first response until the audio is handed
+            # over, so it gets its own thread like the streams of the sessions
+            audio_stream.standby = start_standby_thread(
+                self.open_standby, audio_stream, participant, audio_config, scope,
+                audio_stream.stand_by())
+            return False
+        # The call opened ahead only returns once it has audio to respond to,
+        # so it is done before the hand over only if it failed
+        return (response.recognition_result.is_final and audio_stream.handover_due()
+                and audio_stream.standby is not None and not audio_stream.standby.done()
+                and audio_stream.hand_over())
+
+    def open_standby(
+            self,
+            audio_stream: Stream,
+            participant: dialogflow.Participant,
+            audio_config: dialogflow.InputAudioConfig,
+            scope: str,
+            generation: int):
+        """Open the next stream of audio_stream with the generation from
+        Stream.stand_by, standing by for the audio until Stream.hand_over, and
+        return its responses. Return None if the rate limit allows no stream
+        right away
+        """
+        # Once handed the audio over, the stream must be opened to carry it
+        if analyze_content_rate_limiter.acquire(scope) is None \
+                and audio_stream.cancel_standby(generation):
+            return None
+        try:
+            return self.participants_client.streaming_analyze_content(
+                requests=self.generator_streaming_analyze_content_request(
+                    audio_config, participant, audio_stream, generation))
+        except Exception:
+            audio_stream.cancel_standby(generation)
+            raise
+
     def complete_conversation(self, conversation_name: str):
         """Send complete conversation request to Dialogflow
         """
@@ -265,7 +598,8 @@ class DialogflowAPI:
             self,
             audio_config: dialogflow.InputAudioConfig,
             participant: dialogflow.Participant,
-            audio_stream: Stream):
+            audio_stream: Stream,
+            generation: int | None = None):
         """Generates and return an iterator for StreamingAnalyzeContentRequest,
         The first request should only include the input_audio_config
         And the following request contains the audio chunks as input_audio.
@@ -277,13 +611,15 @@ class DialogflowAPI:
             https://cloud.google.com/dialogflow/es/docs/reference/rest/v2beta1/InputAudioConfig
             participant (dialogflow.Participant): Participant for the Dialogflow API call
             audio_queue (asyncio.Queue): Queue to store the audio binary stream
+            generation (int): Generation from Stream.stand_by for a stream opened
+            ahead of the rollover, waiting for the audio to be handed over
 
         Yields:
             _type_: first filed the audio config, and then yield the binary data.
         """
         # Sending audio_config for participant
         enable_debugging_info = config.log_level.upper() == "DEBUG"
-        generator = audio_stream.generator()
+        generator = audio_stream.generator(generation)
         yield dialogflow.StreamingAnalyzeContentRequest(
             participant=participant.name,
             audio_config=audio_config,
@@ -309,23 +645,311 @@ class DialogflowAPI:
             "Ending the current audio stream session, start new session")
 
 
-def await_redis(conversation_name: str) -> bool:
-    """Check if the redis memory store connection has been established or not
+class AsyncDialogflowAPI:
+    """Class for interacting with the Dialogflow API from the asyncio server,
+    with the same methods as DialogflowAPI as coroutines. Must be created on
+    the event loop running them
     """
-    conversation_name = determine_conversation_name_without_location(
-        conversation_name)
-    # give the user bit time to accept the call and wait for the Agent Assist Backend
-    # to create the redis memory store
-    counter = AWAIT_REDIS_COUNTER
 
-    redis_exists = redis_client.exists(conversation_name) != 0
-    while not redis_exists and counter > 0:
-        time.sleep(AWAIT_REDIS_SECOND_PER_COUNTER)
-        redis_exists = redis_client.exists(conversation_name) != 0
-        counter = counter - 1
-    logging.debug("return to send resume message redis client exist %s and final counter %s ",
-                  redis_exists, counter)
-    return redis_exists
+    def __init__(self) -> None:
+        self.api_endpoint = determine_dialogflow_api_endpoint(
+            location_id)
+        clients = get_async_dialogflow_clients(self.api_endpoint)
+        self.participants_client = clients.participants_client
+        self.conversations_client = clients.conversations_client
+        self.conversation_profiles_client = clients.conversation_profiles_client
+
+    async def get_conversation_profile(
+            self,
+            conversation_profile_name: str) -> dialogflow.ConversationProfile:
+        """Load conversation profile
+        """
+        logging.debug("Getting conversation profile for %s ",
+                      conversation_profile_name)
+        return await self.conversation_profiles_client.get_conversation_profile(
+            request=dialogflow.GetConversationProfileRequest(
+                name=conversation_profile_name
+            )
+        )
+
+    async def load_conversation_profile(
+            self,
+            conversation_profile_name: str) -> CachedConversationProfile:
+        """Same as DialogflowAPI.load_conversation_profile, reloading in a task
+        """
+        cached, reload = conversation_profile_cache.get(conversation_profile_name)
+        if cached is None:
+            return conversation_profile_cache.put(
+                conversation_profile_name,
+                await self.get_conversation_profile(conversation_profile_name))
+        if reload:
+            task = asyncio.create_task(
+                self.reload_conversation_profile(conversation_profile_name))
+            _reload_tasks.add(task)
+            task.add_done_callback(_reload_tasks.discard)
+        return cached
+
+    async def reload_conversation_profile(self, conversation_profile_name: str):
+        try:
+            conversation_profile_cache.put(
+                conversation_profile_name,
+                await self.get_conversation_profile(conversation_profile_name))
+        except Exception as e:
+            conversation_profile_cache.reload_failed(conversation_profile_name, e)
+
+    async def create_conversation(
+            self,
+            conversation_profile: dialogflow.ConversationProfile,
+            conversation_id: str,
+    ) -> dialogflow.Conversation:
+        """Create conversation using conversation_id
+        """
+        project_path = self.conversations_client.common_location_path(
+            get_default_project(), location_id)
+        conversation = await self.conversations_client.create_conversation(
+            request=dialogflow.CreateConversationRequest(
+                parent=project_path,
+                conversation=dialogflow.Conversation(
+                    conversation_profile=conversation_profile.name),
+                conversation_id=conversation_id,
+            ))
+        logging.info(
+            "Created conversation %s for project path %s", conversation.name,
+            project_path)
+        return conversation
+
+    async def get_conversation(
+            self, conversation_name: str) -> dialogflow.Conversation:
+        """Get conversation using the conversation_name from dialogflow
+        """
+        return await self.conversations_client.get_conversation(
+            request=dialogflow.GetConversationRequest(name=conversation_name))
+
+    async def list_participant(self,
+                               conversation_name: str) -> list[dialogflow.Participant]:
+        """List existing participant for Human agent and End user
+        """
+        participants_pager = await self.participants_client.list_participants(
+            dialogflow.ListParticipantsRequest(parent=conversation_name))
+        participant_list = [participant async for participant in participants_pager]
+        logging.debug("participant list %s, type ", participant_list)
+        return participant_list
+
+    async def create_participant(
+            self, conversation_name: str,
+            role: str):
+        """Create a participant of the conversation with the role
+        """
+        participant = dialogflow.Participant()
+        participant.role = role
+        participant = await self.participants_client.create_participant(
+            parent=conversation_name, participant=participant)
+        logging.debug("Creating new participant %s:%s",
+                      role,
+                      participant)
+        return participant
+
+    async def set_up_conversation(
+            self,
+            conversation_profile: dialogflow.ConversationProfile,
+            conversation_id: str) -> dict[str, dialogflow.Participant]:
+        """Same as DialogflowAPI.set_up_conversation
+        """
+        conversation_name = create_conversation_name(
+            conversation_id, location_id, get_default_project())
+        participants_list = []
+        try:
+            await self.create_conversation(conversation_profile, conversation_id)
+        except AlreadyExists:
+            logging.info("Conversation %s already exists", conversation_name)
+            participants_list = await self.list_participant(conversation_name)
+        participants_list.extend(await asyncio.gather(*(
+            self.create_participant(conversation_name, role)
+            for role in find_missing_roles(participants_list))))
+        return {role: find_participant_by_role(dialogflow.Participant.Role[role], participants_list)
+                for role in PARTICIPANT_ROLES}
+
+    async def complete_conversation(self, conversation_name: str):
+        """Send complete conversation request to Dialogflow
+        """
+        await self.conversations_client.complete_conversation(
+            name=conversation_name
+        )
+        logging.debug("Call complete conversation for %s", conversation_name)
+
+    async def maintained_streaming_analyze_content(
+            self,
+            audio_stream: Stream,
+            participant: dialogflow.Participant,
+            audio_config: dialogflow.InputAudioConfig):
+        """While the stream is not closed or terminated, maintain a steady call to streaming
+        analyze content API endpoint. Unlike the threaded version, waits for the
+        stream to be resumed instead of polling it
+        """
+        backoff = config.quota_backoff
+        while not audio_stream.terminate:
+            if audio_stream.closed:
+                await audio_stream.wait_resumed()
+                continue
+            if await self.streaming_analyze_content(
+                    audio_stream,
+                    participant,
+                    audio_config):
+                # Keep buffering the audio and reopen the stream after a backoff
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, config.max_quota_backoff)
+            else:
+                backoff = config.quota_backoff
+
+    async def streaming_analyze_content(
+            self,
+            audio_stream: Stream,
+            participant: dialogflow.Participant,
+            audio_config: dialogflow.InputAudioConfig) -> bool:
+        """Call dialogflow backend StreamingAnalyzeContent endpoint,
+        and send the audio binary stream from Audiohook.
+        Return True when the stream could not be opened within the quota
+        """
+        project, location = re.match(
+            PROJECT_LOCATION_REGEX, participant.name).groups()
+        scope = f"{project}/{location}"
+        standby, audio_stream.standby = audio_stream.standby, None
+        # The rate limiter waits on Redis, keep the event loop running meanwhile
+        if standby is None and config.analyze_content_rate_limit and await asyncio.to_thread(
+                analyze_content_rate_limiter.acquire, scope, config.rate_limit_max_wait) is None:
+            logging.warning(
+                "Rate limit exceeded for streaming analyze content %s", participant.name)
+            return True
+        handed_over = False
+        try:
+            if standby is not None:
+                try:
+                    responses = await standby
+                except GoogleAPICallError as e:
+                    logging.warning("Error in the stream opened ahead of the rollover %s", e)
+                    return False
+            else:
+                logging.debug("call streaming analyze content for %s", participant)
+                responses = await self.participants_client.streaming_analyze_content(
+                    requests=self.generator_streaming_analyze_content_request(
+                        audio_config, participant, audio_stream))
+            async for response in responses:
+                process_streaming_analyze_content_response(
+                    audio_stream, participant, response)
+                if self.roll_over(audio_stream, participant, audio_config, response, scope):
+                    handed_over = True
+                    responses.cancel()
+                    break
+        except OutOfRange as e:
+            logging.warning(
+                "The single audio stream exceeded maximum duration restrictions %s ", e)
+            return False
+        except FailedPrecondition as e:
+            audio_stream.closed = True
+            logging.warning(
+                "Failed the precondition check for StreamingAnalyzeContent %s ", e)
+            return False
+        except ResourceExhausted as e:
+            logging.warning(
+                "Exceed quota for calling streaming analyze content %s ", e)
+            return True
+        finally:
+            if not handed_over:
+                audio_stream.cancel_standby()
+        return False
+
+    def roll_over(
+            self,
+            audio_stream: Stream,
+            participant: dialogflow.Participant,
+            audio_config: dialogflow.InputAudioConfig,
+            response: dialogflow.StreamingAnalyzeContentResponse,
+            scope: str) -> bool:
+        """Same as DialogflowAPI.roll_over, opening the next stream in a task"""
+        if audio_stream.rollover_due():
+            audio_stream.standby = asyncio.ensure_future(self.open_standby(
+                audio_stream, participant, audio_config, scope, audio_stream.stand_by()))
+            return False
+        return (response.recognition_result.is_final and audio_stream.handover_due()
+                and audio_stream.standby is not None and standing_by(audio_stream.standby)
+                and audio_stream.hand_over())
+
+    async def open_standby(
+            self,
+            audio_stream: Stream,
+            participant: dialogflow.Participant,
+            audio_config: dialogflow.InputAudioConfig,
+            scope: str,
+            generation: int):
+        """Same as DialogflowAPI.open_standby"""
+        if config.analyze_content_rate_limit and await asyncio.to_thread(
+                analyze_content_rate_limiter.acquire, scope) is None \
+                and audio_stream.cancel_standby(generation):
+            return None
+        try:
+            return await self.participants_client.streaming_analyze_content(
+                requests=self.generator_streaming_analyze_content_request(
+                    audio_config, participant, audio_stream, generation))
+        except Exception:
+            audio_stream.cancel_standby(generation)
+            raise
+
+    async def generator_streaming_analyze_content_request(
+            self,
+            audio_config: dialogflow.InputAudioConfig,
+            participant: dialogflow.Participant,
+            audio_stream: Stream,
+            generation: int | None = None):
+        """Same requests as DialogflowAPI.generator_streaming_analyze_content_request,
+        from the async_generator of the stream
+        """
+        enable_debugging_info = config.log_level.upper() == "DEBUG"
+        yield dialogflow.StreamingAnalyzeContentRequest(
+            participant=participant.name,
+            audio_config=audio_config,
+            enable_debugging_info=enable_debugging_info,
+            output_multiple_utterances=True,
+        )
+        async for content in audio_stream.async_generator(generation):
+            yield dialogflow.StreamingAnalyzeContentRequest(
+                input_audio=content,
+                enable_debugging_info=enable_debugging_info,
+                output_multiple_utterances=True,
+            )
+        logging.info(
+            "Participant: %s, streaming analyze content request, end streaming yield an empty request ",
+            participant.name)
+        yield dialogflow.StreamingAnalyzeContentRequest(
+            enable_debugging_info=enable_debugging_info,
+        )
+
+
+def start_standby_thread(function, *args) -> futures.Future:
+    """Call function on a new thread, for a stream opened ahead of its rollover,
+    and return a future of its result
+    """
+    future = futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="standby", daemon=True).start()
+    return future
+
+
+def standing_by(standby: asyncio.Task) -> bool:
+    """Check if the task opening a stream ahead of its rollover is still
+    connecting, or opened a call that has not ended
+    """
+    if not standby.done():
+        return True
+    return (not standby.cancelled() and standby.exception() is None
+            and standby.result() is not None and not standby.result().done())
 
 
 def determine_conversation_name_without_location(conversation_name: str):
@@ -336,3 +960,127 @@ def determine_conversation_name_without_location(conversation_name: str):
         conversation_name_without_location = '/'.join(
             name_array[i] for i in [0, 1, -2, -1])
     return conversation_name_without_location
+
+
+class AgentJoinListener:
+    """Calls back the sessions waiting for the agent of their conversation
+    when the UI Connector signals that the agent joined it. One thread
+    subscribed to the signals serves every session of the process
+    """
+
+    def __init__(self, redis_client: redis.Redis):
+        self._redis_client = redis_client
+        # Callbacks by conversation name without location
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, conversation_name: str, callback):
+        """Call callback, from the listening thread, once the agent joins the conversation"""
+        with self._lock:
+            self._callbacks.setdefault(conversation_name, []).append(callback)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._listen, name="agent-join", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, conversation_name: str, callback):
+        with self._lock:
+            callbacks = self._callbacks.get(conversation_name, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._callbacks.pop(conversation_name, None)
+
+    def _listen(self):
+        while True:
+            pubsub = self._redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(f"{AGENT_JOINED_CHANNEL}*")
+                for message in pubsub.listen():
+                    self._notify(message["channel"].decode()[len(AGENT_JOINED_CHANNEL):])
+            except redis.exceptions.RedisError as e:
+                # Sessions waiting meanwhile resume after their timeout
+                logging.warning("Error listening to agent join signals %s", e)
+                time.sleep(AGENT_JOINED_RESUBSCRIBE_SECONDS)
+            except Exception as e:
+                # Keep serving the other sessions, this thread is never restarted
+                logging.error("Unexpected error listening to agent join signals %s", e)
+                time.sleep(AGENT_JOINED_RESUBSCRIBE_SECONDS)
+            finally:
+                pubsub.close()
+
+    def _notify(self, conversation_name: str):
+        with self._lock:
+            callbacks = self._callbacks.pop(conversation_name, [])
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error("Error resuming a session after the agent joined %s", e)
+
+
+agent_join_listener = AgentJoinListener(redis_client)
+
+
+def agent_joined(conversation_name: str) -> bool:
+    """Check if the agent has already joined the conversation, as the UI
+    Connector maps it to its server id in Redis
+    """
+    try:
+        return redis_client.exists(conversation_name) != 0
+    except redis.exceptions.RedisError as e:
+        logging.warning("Error checking if the agent joined %s", e)
+        return False
+
+
+def watch_agent_join(conversation_name: str) -> threading.Event:
+    """Get an event set once the agent joins the conversation, or right away
+    if the agent has already joined. Wait for it with wait_for_agent
+    """
+    conversation_name = determine_conversation_name_without_location(
+        conversation_name)
+    joined = threading.Event()
+    agent_join_listener.watch(conversation_name, joined.set)
+    if agent_joined(conversation_name):
+        joined.set()
+    return joined
+
+
+def wait_for_agent(conversation_name: str, joined: threading.Event, timeout: float) -> bool:
+    """Wait up to timeout seconds for the event of watch_agent_join, and return
+    whether the agent joined
+    """
+    try:
+        return joined.wait(max(timeout, 0))
+    finally:
+        unwatch_agent_join(conversation_name, joined)
+
+
+def unwatch_agent_join(conversation_name: str, joined: threading.Event):
+    """Stop watching for the agent to join, for an event of watch_agent_join"""
+    agent_join_listener.unwatch(
+        determine_conversation_name_without_location(conversation_name), joined.set)
+
+
+async def async_wait_for_agent(conversation_name: str, timeout: float) -> bool:
+    """Wait up to timeout seconds for the agent to join the conversation, and
+    return whether the agent joined, without blocking the event loop
+    """
+    conversation_name = determine_conversation_name_without_location(
+        conversation_name)
+    loop = asyncio.get_running_loop()
+    joined = asyncio.Event()
+
+    def set_joined():
+        loop.call_soon_threadsafe(joined.set)
+    agent_join_listener.watch(conversation_name, set_joined)
+    try:
+        if await asyncio.to_thread(agent_joined, conversation_name):
+            return True
+        await asyncio.wait_for(joined.wait(), max(timeout, 0))
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        agent_join_listener.unwatch(conversation_name, set_joined)
@@ -12,12 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from threading import Thread
+
 from flask import Flask
 
 from audiohook_blueprint import audiohook_bp
+from dialogflow_api import preload
 
 app = Flask(__name__)
 app.register_blueprint(audiohook_bp)
+# Serve connection probes right away while loading Dialogflow dependencies
+Thread(target=preload, name="preload", daemon=True).start()
 
 
 if __name__ == '__main__':
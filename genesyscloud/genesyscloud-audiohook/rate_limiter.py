@@ -0,0 +1,89 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Module for rate limiting Dialogflow calls with token buckets shared through
+Redis, so that every instance stays within the same project quotas
+"""
+from __future__ import annotations
+
+import logging
+import time
+
+import redis
+
+# Same script as the UI Connector rate limiter. Its buckets are keyed by method
+# family, and the Audiohook only uses its own streaming-analyze-content family, so
+# the two components never configure the same bucket differently.
+# Refills a token bucket stored in a Redis hash and takes `cost` tokens from it when
+# at least `reserve` tokens are left afterwards. Returns 0 when the tokens are taken,
+# otherwise the milliseconds to wait until they would be available.
+# KEYS[1]: bucket key. ARGV: rate in tokens per second, burst, reserve, now in milliseconds, cost.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local cost = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(bucket[1]) or burst
+local timestamp = tonumber(bucket[2]) or now
+if now > timestamp then
+  tokens = math.min(burst, tokens + (now - timestamp) * rate / 1000)
+  timestamp = now
+end
+local wait = 0
+if tokens - cost >= reserve then
+  tokens = tokens - cost
+else
+  wait = math.ceil((cost + reserve - tokens) * 1000 / rate)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'timestamp', timestamp)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RateLimiter:
+    """Token bucket of one method family, such as streaming-analyze-content, per
+    project and location. Fails open when Redis is unavailable.
+    """
+
+    def __init__(self, redis_client: redis.Redis, family: str, rate: float, burst_seconds: float = 1):
+        self.family = family
+        self.rate = rate
+        self.burst = max(rate * burst_seconds, 1)
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self, scope: str, max_wait: float = 0) -> float | None:
+        """Take a token, waiting up to max_wait seconds for one.
+        Return the seconds waited, or None if no token was available in time
+        """
+        if not self.rate:
+            return 0
+        key = f"rate-limit:{scope}:{self.family}"
+        waited = 0
+        while True:
+            try:
+                wait = self._script(
+                    keys=[key], args=[self.rate, self.burst, 0, int(time.time() * 1000), 1]) / 1000
+            except redis.exceptions.RedisError as e:
+                logging.warning(
+                    "Rate limiter is unavailable, letting the request through %s", e)
+                return waited
+            if wait == 0:
+                return waited
+            if waited + wait > max_wait:
+                return None
+            time.sleep(wait)
+            waited += wait
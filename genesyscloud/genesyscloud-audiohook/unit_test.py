@@ -0,0 +1,614 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import itertools
+import json
+import queue
+import threading
+import time
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+from google.api_core.exceptions import AlreadyExists
+from google.auth.credentials import AnonymousCredentials
+
+import async_server
+import dialogflow_api
+from audio_stream import AsyncAudioBuffer, AudioBuffer, AudioRing, Stream, deinterleave
+from dialogflow_api import AgentJoinListener, ConversationProfileCache, dialogflow
+
+RATE = 8000
+CHUNK_SIZE = 1600
+
+
+class TestAudioRing(unittest.TestCase):
+    """Unit tests for the lookback history of the streams."""
+
+    def test_wraparound(self):
+        """Keeps the most recent bytes across the end of the ring."""
+        ring = AudioRing(5)
+        ring.extend(b"abc")
+        self.assertEqual(ring.tail(2), b"bc")
+        ring.extend(b"defg")
+        self.assertEqual(ring.total_bytes, 7)
+        self.assertEqual(ring.tail(5), b"cdefg")
+        self.assertEqual(ring.tail(3), b"efg")
+        self.assertEqual(ring.tail(10), b"cdefg")
+        self.assertEqual(ring.tail(0), b"")
+
+    def test_extend_over_capacity(self):
+        """Keeps only the end of audio longer than the ring."""
+        ring = AudioRing(4)
+        ring.extend(b"ab")
+        ring.extend(b"0123456789")
+        self.assertEqual(ring.total_bytes, 12)
+        self.assertEqual(ring.tail(4), b"6789")
+        self.assertEqual(AudioRing(0).tail(4), b"")
+
+    def test_restart_lookback(self):
+        """Replays the audio after the last final transcript on restart."""
+        stream = Stream(RATE, CHUNK_SIZE)
+        stream.stt_model = "latest_long"
+        stream.audio_input_chunks.extend(bytes(range(200)) * 80)
+        stream.is_final_offset = 1500
+        replay = stream.restart()
+        self.assertEqual(replay, stream.audio_input_chunks.tail(4000))
+        self.assertEqual(len(replay), 4000)
+        # The offsets of the next stream start from the audio replayed
+        self.assertEqual(stream.last_start_time, 1500)
+        self.assertEqual(stream.is_final_offset, 0)
+
+
+class TestDeinterleave(unittest.TestCase):
+    """Unit tests for splitting the stereo frames of Audiohook."""
+
+    def test_deinterleave(self):
+        """Splits the samples of each channel."""
+        self.assertEqual(deinterleave(b"aAbBcC"), (b"abc", b"ABC"))
+        self.assertEqual(deinterleave(b""), (b"", b""))
+
+    def test_deinterleave_odd_length(self):
+        """Drops a trailing incomplete sample."""
+        self.assertEqual(deinterleave(b"aAbBc"), (b"ab", b"AB"))
+        self.assertEqual(deinterleave(b"a"), (b"", b""))
+
+
+class TestAudioBuffer(unittest.TestCase):
+    """Unit tests for the audio buffered between Audiohook and the streams."""
+
+    def test_read_waits_for_length(self):
+        """Blocks until a whole chunk is buffered."""
+        buffer = AudioBuffer(10)
+        buffer.write(b"abc")
+        threading.Timer(0.05, buffer.write, [b"def"]).start()
+        self.assertEqual(buffer.read(5, 2, lambda: False), b"abcde")
+        self.assertEqual(buffer.size, 1)
+
+    def test_read_timeout(self):
+        """Returns the audio buffered once the timeout elapses."""
+        buffer = AudioBuffer(10)
+        buffer.write(b"ab")
+        self.assertEqual(buffer.read(4, 0.05, lambda: False), b"ab")
+        self.assertEqual(buffer.read(4, 0.01, lambda: False), b"")
+
+    def test_read_stop(self):
+        """Wakes a blocked read once stop() is true."""
+        buffer = AudioBuffer(10)
+        stopped = threading.Event()
+
+        def stop():
+            stopped.set()
+            buffer.wake()
+
+        threading.Timer(0.05, stop).start()
+        start = time.monotonic()
+        self.assertEqual(buffer.read(4, 5, stopped.is_set), b"")
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_overflow(self):
+        """Drops the oldest audio when full, across the end of the ring."""
+        buffer = AudioBuffer(4)
+        buffer.write(b"abc")
+        self.assertEqual(buffer.read(2, 0, lambda: False), b"ab")
+        buffer.write(b"defgh")
+        self.assertEqual(buffer.dropped_bytes, 2)
+        self.assertEqual(buffer.read(4, 0, lambda: False), b"efgh")
+        buffer.write(b"0123456789")
+        self.assertEqual(buffer.dropped_bytes, 8)
+        self.assertEqual(buffer.read(8, 0, lambda: False), b"6789")
+
+    def test_read_async(self):
+        """Awaits a whole chunk without blocking the event loop."""
+        async def read():
+            buffer = AsyncAudioBuffer(10)
+            asyncio.get_running_loop().call_later(0.05, buffer.write, b"abcd")
+            return await buffer.read_async(3, 2, lambda: False)
+
+        self.assertEqual(asyncio.run(read()), b"abc")
+
+    def test_generator_stops_when_closed(self):
+        """Stops the generator of a stream waiting for audio once it is closed."""
+        stream = Stream(RATE, CHUNK_SIZE)
+        stream.fill_buffer(bytes(CHUNK_SIZE))
+        generator = stream.generator()
+        self.assertEqual(next(generator), bytes(CHUNK_SIZE))
+        threading.Timer(0.05, setattr, [stream, "closed", True]).start()
+        start = time.monotonic()
+        self.assertEqual(list(generator), [])
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class TestDialogflowClients(unittest.TestCase):
+    """Unit tests for the Dialogflow clients shared by the sessions."""
+
+    @patch("dialogflow_api.get_default_credentials", return_value=(AnonymousCredentials(), "p"))
+    def test_async_clients_closed_with_loop(self, MockCredentials):
+        """Shares the asyncio clients of a loop until it closes them."""
+        async def serve():
+            loop = asyncio.get_running_loop()
+            clients = dialogflow_api.get_async_dialogflow_clients("localhost:1")
+            self.assertIn(clients, dialogflow_api._async_clients[loop]["localhost:1"])
+            await dialogflow_api.close_async_dialogflow_clients()
+            self.assertNotIn(loop, dialogflow_api._async_clients)
+
+        with patch("dialogflow_api.config.grpc_channels", 2):
+            asyncio.run(serve())
+
+
+class TestConversationProfileCache(unittest.TestCase):
+    """Unit tests for the conversation profiles cached by the sessions."""
+
+    def setUp(self):
+        self.cache = ConversationProfileCache(ttl=60, max_stale=30)
+        self.name = "projects/p/locations/global/conversationProfiles/c"
+        self.profile = dialogflow.ConversationProfile(name=self.name)
+
+    @patch("dialogflow_api.time.monotonic")
+    def test_fresh(self, MockMonotonic):
+        """Serves a profile without reloading it within its ttl."""
+        MockMonotonic.return_value = 100
+        self.assertEqual(self.cache.get(self.name), (None, False))
+        cached = self.cache.put(self.name, self.profile)
+        self.assertEqual(cached.profile, self.profile)
+        self.assertEqual(cached.audio_config.model, "chirp_3")
+        MockMonotonic.return_value = 160
+        self.assertEqual(self.cache.get(self.name), (cached, False))
+
+    @patch("dialogflow_api.time.monotonic")
+    def test_stale(self, MockMonotonic):
+        """Asks a single caller to reload a stale profile meanwhile served."""
+        MockMonotonic.return_value = 100
+        cached = self.cache.put(self.name, self.profile)
+        MockMonotonic.return_value = 170
+        self.assertEqual(self.cache.get(self.name), (cached, True))
+        self.assertEqual(self.cache.get(self.name), (cached, False))
+        reloaded = self.cache.put(self.name, self.profile)
+        self.assertEqual(self.cache.get(self.name), (reloaded, False))
+
+    @patch("dialogflow_api.time.monotonic")
+    def test_expired(self, MockMonotonic):
+        """Loads a profile stale for more than max_stale again."""
+        MockMonotonic.return_value = 100
+        self.cache.put(self.name, self.profile)
+        MockMonotonic.return_value = 191
+        self.assertEqual(self.cache.get(self.name), (None, False))
+
+    @patch("dialogflow_api.time.monotonic")
+    def test_reload_failed(self, MockMonotonic):
+        """Lets the next caller retry a failed reload."""
+        MockMonotonic.return_value = 100
+        cached = self.cache.put(self.name, self.profile)
+        MockMonotonic.return_value = 170
+        self.assertEqual(self.cache.get(self.name), (cached, True))
+        self.cache.reload_failed(self.name, Exception("unavailable"))
+        self.assertEqual(self.cache.get(self.name), (cached, True))
+
+
+
+@patch("dialogflow_api.get_default_credentials", return_value=(AnonymousCredentials(), "p"))
+class TestConversationSetUp(unittest.TestCase):
+    """Unit tests for creating the conversation of a session and its participants."""
+
+    def setUp(self):
+        self.profile = dialogflow.ConversationProfile(
+            name="projects/p/locations/global/conversationProfiles/c")
+        self.conversation_name = dialogflow_api.create_conversation_name(
+            "c1", dialogflow_api.location_id, "p")
+        self.agent = dialogflow.Participant(
+            name=self.conversation_name + "/participants/agent", role="HUMAN_AGENT")
+        self.customer = dialogflow.Participant(
+            name=self.conversation_name + "/participants/customer", role="END_USER")
+
+    def participant(self, role):
+        return self.agent if role == "HUMAN_AGENT" else self.customer
+
+    def api(self):
+        with patch("dialogflow_api.get_dialogflow_clients") as MockClients:
+            MockClients.return_value.conversations_client.common_location_path = (
+                dialogflow.ConversationsClient.common_location_path)
+            return dialogflow_api.DialogflowAPI()
+
+    def async_api(self):
+        conversations_client = AsyncMock()
+        conversations_client.common_location_path = dialogflow.ConversationsClient.common_location_path
+        with patch("dialogflow_api.get_async_dialogflow_clients", return_value=Mock(
+                participants_client=AsyncMock(), conversations_client=conversations_client)):
+            return dialogflow_api.AsyncDialogflowAPI()
+
+    def test_create(self, MockCredentials):
+        """Creates the conversation, then both participants at the same time."""
+        api = self.api()
+        # Each creation waits for the other, so they only complete if concurrent
+        barrier = threading.Barrier(2, timeout=1)
+
+        def create_participant(parent, participant):
+            barrier.wait()
+            return self.participant(participant.role.name)
+        api.participants_client.create_participant.side_effect = create_participant
+        participants = api.set_up_conversation(self.profile, "c1")
+        self.assertEqual(participants, {"HUMAN_AGENT": self.agent, "END_USER": self.customer})
+        request = api.conversations_client.create_conversation.call_args.kwargs["request"]
+        self.assertEqual(request.conversation_id, "c1")
+        api.participants_client.list_participants.assert_not_called()
+
+    def test_already_exists(self, MockCredentials):
+        """Lists the participants of an existing conversation and only creates those missing."""
+        api = self.api()
+        api.conversations_client.create_conversation.side_effect = AlreadyExists("exists")
+        api.participants_client.list_participants.return_value = [self.agent]
+        api.participants_client.create_participant.return_value = self.customer
+        participants = api.set_up_conversation(self.profile, "c1")
+        self.assertEqual(participants, {"HUMAN_AGENT": self.agent, "END_USER": self.customer})
+        self.assertEqual(
+            api.participants_client.list_participants.call_args.args[0].parent, self.conversation_name)
+        api.participants_client.create_participant.assert_called_once()
+        self.assertEqual(
+            api.participants_client.create_participant.call_args.kwargs["participant"].role.name, "END_USER")
+
+    def test_async_create(self, MockCredentials):
+        """Creates the conversation, then both participants at the same time, on the loop."""
+        async def set_up():
+            api = self.async_api()
+            started, both_started = [], asyncio.Event()
+
+            async def create_participant(parent, participant):
+                started.append(participant.role.name)
+                if len(started) == 2:
+                    both_started.set()
+                await asyncio.wait_for(both_started.wait(), 1)
+                return self.participant(participant.role.name)
+            api.participants_client.create_participant.side_effect = create_participant
+            participants = await api.set_up_conversation(self.profile, "c1")
+            self.assertEqual(participants, {"HUMAN_AGENT": self.agent, "END_USER": self.customer})
+            api.conversations_client.create_conversation.assert_awaited_once()
+            api.participants_client.list_participants.assert_not_called()
+
+        asyncio.run(set_up())
+
+    def test_async_already_exists(self, MockCredentials):
+        """Lists the participants of an existing conversation and only creates those missing, on the loop."""
+        async def participants_pager():
+            for participant in [self.customer]:
+                yield participant
+
+        async def set_up():
+            api = self.async_api()
+            api.conversations_client.create_conversation.side_effect = AlreadyExists("exists")
+            api.participants_client.list_participants.return_value = participants_pager()
+            api.participants_client.create_participant.return_value = self.agent
+            participants = await api.set_up_conversation(self.profile, "c1")
+            self.assertEqual(participants, {"HUMAN_AGENT": self.agent, "END_USER": self.customer})
+            api.participants_client.create_participant.assert_awaited_once()
+            self.assertEqual(
+                api.participants_client.create_participant.call_args.kwargs["participant"].role.name,
+                "HUMAN_AGENT")
+
+        asyncio.run(set_up())
+
+
+class FakeWebSocket:
+    """Websocket of an Audiohook client, sending the messages put in received"""
+
+    def __init__(self):
+        self.received = asyncio.Queue()
+        self.sent = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.received.get()
+        if data is None:
+            raise StopAsyncIteration
+        return data
+
+    async def send(self, data: str):
+        await self.sent.put(json.loads(data))
+
+
+class TestAudiohookSession(unittest.TestCase):
+    """Unit tests for the Audiohook sessions of the asyncio server."""
+
+    def setUp(self):
+        self.api = Mock()
+        self.api.load_conversation_profile = AsyncMock(return_value=Mock(
+            profile=dialogflow.ConversationProfile(name="projects/p/locations/global/conversationProfiles/c"),
+            audio_config=dialogflow.InputAudioConfig(model="latest_long")))
+        self.api.set_up_conversation = AsyncMock(side_effect=self.set_up_conversation)
+        self.api.maintained_streaming_analyze_content = AsyncMock()
+        self.api.complete_conversation = AsyncMock()
+        for target, kwargs in (
+                ("async_server.AsyncDialogflowAPI", {"return_value": self.api}),
+                ("async_server.async_wait_for_agent", {"new": AsyncMock(return_value=True)}),
+                ("async_server.get_default_project", {"return_value": "p"})):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def set_up_conversation(self, profile, conversation_id):
+        await self.set_up
+        return {"HUMAN_AGENT": Mock(name="agent"), "END_USER": Mock(name="customer")}
+
+    async def start(self):
+        """Start a session, with its conversation set up once set_up is done"""
+        self.set_up = asyncio.get_running_loop().create_future()
+        preloaded = asyncio.get_running_loop().create_future()
+        preloaded.set_result(None)
+        self.ws = FakeWebSocket()
+        self.session = async_server.AudiohookSession(self.ws, preloaded)
+        self.run_task = asyncio.create_task(self.session.run())
+
+    async def receive(self, message_type: str, **parameters):
+        """Send a message of the client to the server"""
+        await self.ws.received.put(json.dumps(
+            {"version": "2", "type": message_type, "id": "s1", "seq": 1, "parameters": parameters}))
+
+    async def exchange(self, message_type: str, **parameters) -> dict:
+        """Send a message, and return the next message of the server"""
+        await self.receive(message_type, **parameters)
+        return await asyncio.wait_for(self.ws.sent.get(), 1)
+
+    async def open(self) -> dict:
+        """Open a conversation, and return the "resume" message once it is set up"""
+        opened = await self.exchange("open", conversationId="c1")
+        self.assertEqual(opened["type"], "opened")
+        self.assertTrue(opened["parameters"]["startPaused"])
+        self.set_up.set_result(None)
+        return await asyncio.wait_for(self.ws.sent.get(), 1)
+
+    async def end(self):
+        await self.ws.received.put(None)
+        await asyncio.wait_for(self.run_task, 1)
+
+    def test_open(self):
+        """Responds to open right away, and resumes once the conversation is set up."""
+        async def session():
+            await self.start()
+            self.assertEqual((await self.open())["type"], "resume")
+            self.api.set_up_conversation.assert_awaited_once()
+            self.assertEqual(self.api.set_up_conversation.call_args.args[1], "ac1")
+            self.assertTrue(self.session.conversation_name.endswith("/conversations/ac1"))
+            await self.end()
+
+        asyncio.run(session())
+
+    def test_resumed(self):
+        """Starts the agent and customer streams once resumed, and closes them when paused."""
+        async def session():
+            await self.start()
+            await self.open()
+            await self.receive("resumed")
+            # A "pong" is sent once the previous message is processed
+            self.assertEqual((await self.exchange("ping"))["type"], "pong")
+            self.assertFalse(self.session.agent_stream.closed)
+            self.assertFalse(self.session.customer_stream.closed)
+            streams = [call.args[0] for call in self.api.maintained_streaming_analyze_content.call_args_list]
+            self.assertEqual(streams, [self.session.agent_stream, self.session.customer_stream])
+            await self.receive("paused")
+            await self.exchange("ping")
+            self.assertTrue(self.session.agent_stream.closed)
+            self.assertTrue(self.session.customer_stream.closed)
+            # Resumed again, the streams are not started twice
+            await self.receive("resumed")
+            await self.exchange("ping")
+            self.assertEqual(self.api.maintained_streaming_analyze_content.await_count, 2)
+            await self.end()
+
+        asyncio.run(session())
+
+    def test_close_during_set_up(self):
+        """Completes a conversation closed while it is set up only once it is set up."""
+        async def session():
+            await self.start()
+            self.assertEqual((await self.exchange("open", conversationId="c1"))["type"], "opened")
+            await self.receive("close")
+            self.assertEqual((await asyncio.wait_for(self.ws.sent.get(), 1))["type"], "closed")
+            self.assertTrue(self.session.agent_stream.terminate)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(asyncio.shield(self.run_task), 0.1)
+            self.api.complete_conversation.assert_not_awaited()
+            self.set_up.set_result(None)
+            await asyncio.wait_for(self.run_task, 1)
+            self.api.complete_conversation.assert_awaited_once_with(self.session.conversation_name)
+
+        asyncio.run(session())
+
+    def test_set_up_failure(self):
+        """Asks the client to disconnect when the conversation cannot be set up."""
+        async def session():
+            await self.start()
+            self.api.set_up_conversation.side_effect = Exception("unavailable")
+            disconnect = await self.open()
+            self.assertEqual(disconnect["type"], "disconnect")
+            self.assertEqual(disconnect["parameters"]["reason"], "error")
+            await self.receive("resumed")
+            await self.exchange("ping")
+            self.api.maintained_streaming_analyze_content.assert_not_called()
+            await self.end()
+
+        asyncio.run(session())
+
+class TestAgentJoinListener(unittest.TestCase):
+    """Unit tests for the signals resuming sessions once the agent joins."""
+
+    def setUp(self):
+        self.messages = queue.Queue()
+        redis_client = Mock()
+        redis_client.pubsub.return_value.listen.side_effect = self.listen
+        self.listener = AgentJoinListener(redis_client)
+
+    def listen(self):
+        while True:
+            message = self.messages.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    def join(self, conversation_name):
+        self.messages.put({"channel": f"joined:{conversation_name}".encode()})
+
+    def test_notify(self):
+        """Calls back the sessions of the conversation joined, once."""
+        joined, other_joined = threading.Event(), threading.Event()
+        self.listener.watch("projects/p/conversations/c1", joined.set)
+        self.listener.watch("projects/p/conversations/c2", other_joined.set)
+        self.join("projects/p/conversations/c1")
+        self.assertTrue(joined.wait(1))
+        self.assertFalse(other_joined.is_set())
+        self.assertEqual(list(self.listener._callbacks), ["projects/p/conversations/c2"])
+
+    def test_unwatch(self):
+        """Does not call back sessions that stopped waiting."""
+        unwatched, joined = threading.Event(), threading.Event()
+        self.listener.watch("projects/p/conversations/c1", unwatched.set)
+        self.listener.unwatch("projects/p/conversations/c1", unwatched.set)
+        self.listener.watch("projects/p/conversations/c2", joined.set)
+        self.join("projects/p/conversations/c1")
+        self.join("projects/p/conversations/c2")
+        self.assertTrue(joined.wait(1))
+        self.assertFalse(unwatched.is_set())
+        self.assertEqual(self.listener._callbacks, {})
+
+    @patch("dialogflow_api.AGENT_JOINED_RESUBSCRIBE_SECONDS", 0)
+    def test_errors(self):
+        """Keeps listening after unexpected errors and failing callbacks."""
+        joined = threading.Event()
+        self.listener.watch("projects/p/conversations/c1", Mock(side_effect=ValueError("failed")))
+        self.listener.watch("projects/p/conversations/c1", joined.set)
+        self.messages.put(KeyError("channel"))
+        self.join("projects/p/conversations/c1")
+        self.assertTrue(joined.wait(1))
+
+
+class TestStreamRollover(unittest.TestCase):
+    """Unit tests for handing the audio over to the next stream."""
+
+    def setUp(self):
+        self.stream = Stream(RATE, CHUNK_SIZE)
+        self.stream.stt_model = "latest_long"
+        self.stream.fill_buffer(bytes(range(200)) * 8)
+        self.current = self.stream.generator()
+        self.assertEqual(len(next(self.current)), CHUNK_SIZE)
+        # The current stream runs past its maximum duration, with a final
+        # transcript 100 ms before the end of the audio sent
+        self.stream.is_final = True
+        self.stream.is_final_offset = 100
+        self.stream.speech_end_offset = 95000
+
+    def start_standby(self, generation):
+        """Read the first request of the generator of generation on a thread"""
+        requests = []
+        thread = threading.Thread(
+            target=lambda: requests.extend(itertools.islice(self.stream.generator(generation), 1)))
+        thread.start()
+        return thread, requests
+
+    def test_hand_over(self):
+        """Replays the audio after the last final transcript to the next stream."""
+        generation = self.stream.stand_by()
+        self.assertFalse(self.stream.should_stop())
+        thread, requests = self.start_standby(generation)
+        self.assertTrue(self.stream.hand_over())
+        thread.join(1)
+        self.assertEqual(requests, [self.stream.audio_input_chunks.tail(800)])
+        self.assertEqual(self.stream.generation, generation)
+        # The current generator stops without reading the audio of the next one
+        self.stream.fill_buffer(bytes(CHUNK_SIZE))
+        self.assertEqual(list(self.current), [])
+        self.assertEqual(self.stream.buffer_byte_size, CHUNK_SIZE)
+
+    def test_cancel_standby(self):
+        """Stops the generator standing by and restores the maximum duration."""
+        generation = self.stream.stand_by()
+        self.stream.standby = standby = Mock()
+        thread, requests = self.start_standby(generation)
+        self.stream.cancel_standby()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(requests, [])
+        standby.cancel.assert_called_once_with()
+        self.assertIsNone(self.stream.standby)
+        self.assertFalse(self.stream.hand_over())
+        self.assertTrue(self.stream.should_stop())
+
+    def test_cancel_generation(self):
+        """Only cancels the generation standing by, unless handed over."""
+        stale = self.stream.stand_by()
+        self.stream.cancel_standby()
+        generation = self.stream.stand_by()
+        self.assertTrue(self.stream.cancel_standby(stale))
+        self.assertTrue(self.stream.hand_over())
+        self.assertFalse(self.stream.cancel_standby(generation))
+        self.assertEqual(self.stream.generation, generation)
+
+    @patch("dialogflow_api.start_standby_thread")
+    def test_roll_over(self, MockStartStandbyThread):
+        """Registers the next stream before opening it on its own thread."""
+        self.stream.is_final = False
+        self.stream.speech_end_offset = 86000
+        api, participant, audio_config = Mock(), Mock(), Mock()
+        self.assertFalse(dialogflow_api.DialogflowAPI.roll_over(
+            api, self.stream, participant, audio_config, Mock(), "p/global"))
+        generation = self.stream._standby_generation
+        self.assertIsNotNone(generation)
+        MockStartStandbyThread.assert_called_once_with(
+            api.open_standby, self.stream, participant, audio_config, "p/global", generation)
+        self.assertEqual(self.stream.standby, MockStartStandbyThread.return_value)
+        # Cancelled before its thread runs, the standby no longer lifts the
+        # maximum duration
+        self.stream.speech_end_offset = 95000
+        self.stream.is_final = True
+        self.stream.cancel_standby()
+        self.assertTrue(self.stream.should_stop())
+
+    @patch("dialogflow_api.analyze_content_rate_limiter")
+    def test_open_standby_rate_limited(self, MockRateLimiter):
+        """Drops a standby the rate limit does not allow, unless handed over."""
+        MockRateLimiter.acquire.return_value = None
+        api = Mock()
+        generation = self.stream.stand_by()
+        self.assertIsNone(dialogflow_api.DialogflowAPI.open_standby(
+            api, self.stream, Mock(), Mock(), "p/global", generation))
+        self.assertIsNone(self.stream._standby_generation)
+        api.participants_client.streaming_analyze_content.assert_not_called()
+        generation = self.stream.stand_by()
+        self.stream.hand_over()
+        self.assertEqual(dialogflow_api.DialogflowAPI.open_standby(
+            api, self.stream, Mock(), Mock(), "p/global", generation),
+            api.participants_client.streaming_analyze_content.return_value)
+
+
+if __name__ == "__main__":
+    unittest.main()